@@ -0,0 +1,331 @@
+"""Time and memory-profile each tinscan-find stage on synthetic data at
+several scales, and compare scaling curves with stored baselines.
+
+    python benchmarks/bench_find.py                 # Report timings
+    python benchmarks/bench_find.py --save          # Store as baselines
+    python benchmarks/bench_find.py --check         # Fail on regressions
+
+Data sets are grown along one axis: more scaffolds (more Target:Query
+buckets) or more hits per bucket (denser buckets). For each stage the
+scaling exponent b of time ~ hits^b is fitted, so a change that keeps small
+inputs fast but grows worse than before is reported as a regression.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import tinscan
+
+from synth import DEFAULTS, generate, writeRows
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+# tinscan-find stages, in run order
+STAGES = ("readLASTZ", "readHitTable", "getHitPairs", "writeGFFlines")
+
+# Data set growth factors
+SCALES = (1, 2, 4, 8)
+
+# Default tinscan-find settings
+FIND_ARGS = argparse.Namespace(
+    maxTSD=100,
+    maxInsert=100000,
+    minInsert=100,
+    qGap=100,
+    minIdent=80,
+    maxIdentDiff=20,
+    noflanks=True,
+)
+
+
+def settingsAt(axis, scale):
+    """Synthetic data settings grown scale times along axis."""
+    if axis == "scaffolds":
+        return DEFAULTS._replace(scaffolds=DEFAULTS.scaffolds * scale)
+    return DEFAULTS._replace(hitsPerBucket=DEFAULTS.hitsPerBucket * scale)
+
+
+def _stageRunners(infile, gffout):
+    """Return dict of stage name: function of the previous stage results."""
+    args = FIND_ARGS
+
+    def writeGFF(state):
+        with open(gffout, "w") as f:
+            for x in tinscan.writeGFFlines(state["getHitPairs"], args.noflanks):
+                f.write(x)
+        return None
+
+    return {
+        "readLASTZ": lambda state: tinscan.readLASTZ(infile, minID=args.minIdent),
+        "readHitTable": lambda state: tinscan.readHitTable(infile, minID=args.minIdent),
+        "getHitPairs": lambda state: tinscan.getHitPairs(state["readHitTable"], args),
+        "writeGFFlines": writeGFF,
+    }
+
+
+def runStages(infile, gffout, repeat=3, memory=True):
+    """Run each stage repeat times. Returns dict of stage name: (best seconds,
+    peak traced memory in MB or None) and the number of candidates found."""
+    runners = _stageRunners(infile, gffout)
+    state = dict()
+    results = dict()
+    for stage in STAGES:
+        times = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            state[stage] = runners[stage](state)
+            times.append(time.perf_counter() - start)
+        peak = None
+        if memory:
+            # Traced separately, as tracing slows allocation-heavy code
+            tracemalloc.start()
+            runners[stage](state)
+            peak = tracemalloc.get_traced_memory()[1] / 1024**2
+            tracemalloc.stop()
+        results[stage] = (min(times), peak)
+    return results, len(state["getHitPairs"])
+
+
+def fitExponent(xs, ys):
+    """Least squares slope of log(y) on log(x)."""
+    points = [(math.log(x), math.log(y)) for x, y in zip(xs, ys) if x > 0 and y > 0]
+    if len(points) < 2:
+        return None
+    mx = sum(x for x, _ in points) / len(points)
+    my = sum(y for _, y in points) / len(points)
+    sxx = sum((x - mx) ** 2 for x, _ in points)
+    if not sxx:
+        return None
+    return sum((x - mx) * (y - my) for x, y in points) / sxx
+
+
+def runAxis(axis, scales, repeat, memory, workdir):
+    """Benchmark all stages at each scale along axis. Returns a result dict."""
+    curve = {
+        "scales": list(scales),
+        "hits": list(),
+        "candidates": list(),
+        "stages": {s: {"seconds": list(), "peakMB": list()} for s in STAGES},
+    }
+    for scale in scales:
+        rows, planted, _ = generate(settingsAt(axis, scale))
+        infile = writeRows(rows, os.path.join(workdir, "%s_%s.tab" % (axis, scale)))
+        results, candidates = runStages(
+            infile, os.path.join(workdir, "out.gff3"), repeat, memory
+        )
+        curve["hits"].append(len(rows))
+        curve["candidates"].append(candidates)
+        for stage, (seconds, peak) in results.items():
+            curve["stages"][stage]["seconds"].append(round(seconds, 5))
+            curve["stages"][stage]["peakMB"].append(
+                None if peak is None else round(peak, 3)
+            )
+        print(
+            "%s x%s: %s hits, %s planted, %s candidates"
+            % (axis, scale, len(rows), len(planted), candidates),
+            file=sys.stderr,
+        )
+    for stage in STAGES:
+        result = curve["stages"][stage]
+        result["timeExponent"] = _round(fitExponent(curve["hits"], result["seconds"]))
+        if memory:
+            result["memExponent"] = _round(fitExponent(curve["hits"], result["peakMB"]))
+    return curve
+
+
+def _round(x, digits=3):
+    return None if x is None else round(x, digits)
+
+
+def _fmt(x, spec="%.4f"):
+    return "-" if x is None else spec % x
+
+
+def report(results, baselines=None, timeTol=2.0, memTol=1.5, expTol=0.25):
+    """Print scaling curves, side by side with baselines if given.
+    Returns list of regressions found."""
+    regressions = list()
+    for axis, curve in results["axes"].items():
+        base = (baselines or dict()).get("axes", dict()).get(axis)
+        if base and base["scales"] != curve["scales"]:
+            print("# Baseline scales differ for axis %s, not compared." % axis)
+            base = None
+        print("# Axis: %s" % axis)
+        print("# Stage\tScale\tHits\tSeconds\tBase_s\tRatio\tPeak_MB\tBase_MB")
+        for stage in STAGES:
+            cur = curve["stages"][stage]
+            ref = base["stages"][stage] if base else None
+            for n, scale in enumerate(curve["scales"]):
+                seconds = cur["seconds"][n]
+                peak = cur["peakMB"][n]
+                baseSec = ref["seconds"][n] if ref else None
+                basePeak = ref["peakMB"][n] if ref else None
+                ratio = seconds / baseSec if baseSec else None
+                print(
+                    "\t".join(
+                        [
+                            stage,
+                            str(scale),
+                            str(curve["hits"][n]),
+                            _fmt(seconds),
+                            _fmt(baseSec),
+                            _fmt(ratio, "%.2f"),
+                            _fmt(peak, "%.2f"),
+                            _fmt(basePeak, "%.2f"),
+                        ]
+                    )
+                )
+            line = "# %s: time ~ hits^%s" % (stage, _fmt(cur["timeExponent"], "%.2f"))
+            if cur.get("memExponent") is not None:
+                line += ", memory ~ hits^%s" % _fmt(cur["memExponent"], "%.2f")
+            if ref:
+                line += " (baseline: time ~ hits^%s" % _fmt(ref["timeExponent"], "%.2f")
+                if ref.get("memExponent") is not None:
+                    line += ", memory ~ hits^%s" % _fmt(ref["memExponent"], "%.2f")
+                line += ")"
+                regressions += _compare(axis, stage, cur, ref, timeTol, memTol, expTol)
+            print(line)
+    for x in regressions:
+        print("REGRESSION: " + x)
+    return regressions
+
+
+def _compare(axis, stage, cur, ref, timeTol, memTol, expTol):
+    """Compare one stage curve with its baseline. Time and memory are judged
+    at the largest scale, and the fitted exponents over all scales."""
+    found = list()
+    label = "%s %s" % (axis, stage)
+    if ref["seconds"][-1] and cur["seconds"][-1] > timeTol * ref["seconds"][-1]:
+        found.append(
+            "%s time %.4fs vs baseline %.4fs"
+            % (label, cur["seconds"][-1], ref["seconds"][-1])
+        )
+    if (
+        cur["timeExponent"] is not None
+        and ref["timeExponent"] is not None
+        and cur["timeExponent"] > ref["timeExponent"] + expTol
+    ):
+        found.append(
+            "%s time scales as hits^%.2f vs baseline hits^%.2f"
+            % (label, cur["timeExponent"], ref["timeExponent"])
+        )
+    curPeak = cur["peakMB"][-1]
+    refPeak = ref["peakMB"][-1]
+    if curPeak is not None and refPeak and curPeak > memTol * refPeak:
+        found.append(
+            "%s peak memory %.2fMB vs baseline %.2fMB" % (label, curPeak, refPeak)
+        )
+    return found
+
+
+def mainArgs():
+    parser = argparse.ArgumentParser(
+        description="Benchmark tinscan-find stages on synthetic alignments.",
+    )
+    parser.add_argument(
+        "--axis",
+        type=str,
+        nargs="+",
+        choices=["scaffolds", "hitsPerBucket"],
+        default=["scaffolds", "hitsPerBucket"],
+        help="Grow data sets by adding scaffolds, or hits per bucket.",
+    )
+    parser.add_argument(
+        "--scales",
+        type=str,
+        default=",".join(map(str, SCALES)),
+        help="Comma separated data set growth factors.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Time each stage this many times, keep best.",
+    )
+    parser.add_argument(
+        "--noMemory",
+        action="store_true",
+        default=False,
+        help="If set, do not trace peak memory of each stage.",
+    )
+    parser.add_argument(
+        "--baselines", type=str, default=BASELINES, help="Baselines file."
+    )
+    parser.add_argument(
+        "--save", action="store_true", default=False, help="Write results as baselines."
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        default=False,
+        help="Compare with baselines, exit with status 1 on regression.",
+    )
+    parser.add_argument(
+        "--timeTol",
+        type=float,
+        default=2.0,
+        help="Allowed ratio of time to baseline at the largest scale.",
+    )
+    parser.add_argument(
+        "--memTol",
+        type=float,
+        default=1.5,
+        help="Allowed ratio of peak memory to baseline at the largest scale.",
+    )
+    parser.add_argument(
+        "--expTol",
+        type=float,
+        default=0.25,
+        help="Allowed increase in fitted time scaling exponent.",
+    )
+    parser.add_argument(
+        "--out",
+        type=str,
+        default=None,
+        help="Optional: Write results to this json file.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = mainArgs()
+    scales = [int(x) for x in args.scales.split(",")]
+    results = {
+        "machine": platform.platform(),
+        "python": platform.python_version(),
+        "axes": dict(),
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for axis in args.axis:
+            results["axes"][axis] = runAxis(
+                axis, scales, args.repeat, not args.noMemory, workdir
+            )
+    baselines = None
+    if args.check:
+        if not os.path.isfile(args.baselines):
+            print("Baselines not found: %s" % args.baselines)
+            sys.exit(1)
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+        print("# Baseline: %s, Python %s" % (baselines["machine"], baselines["python"]))
+    regressions = report(results, baselines, args.timeTol, args.memTol, args.expTol)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.save:
+        with open(args.baselines, "w") as f:
+            json.dump(results, f, indent=1)
+            f.write("\n")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""Seeded generator of synthetic A/B genomes and LASTZ result tables with
+known planted insertions, for benchmarking and validating tinscan-find.
+
+Each target scaffold (A) is a copy of a query scaffold (B) with insertions
+planted in it. The target site is duplicated on either side of each
+insertion, so the flanking alignments overlap by the TSD length in the query.
+Alignments of the collinear segments between insertions are written to the
+result table, along with random background hits from other query scaffolds.
+
+    python benchmarks/synth.py --outdir synth --scaffolds 20 --hitsPerBucket 500
+"""
+
+import argparse
+from collections import namedtuple
+import os
+import random
+
+HEADER = (
+    "#name1\tstrand1\tstart1\tend1\tname2\tstrand2\tstart2+\tend2+\tscore\tidentity\n"
+)
+
+# A planted insertion. start:end are the inserted bases in the target, excluding
+# the TSD copies (idx '1', inclusive). tsd is the TSD length.
+Planted = namedtuple("Planted", ["target", "query", "start", "end", "tsd", "strand"])
+
+# Settings for a synthetic data set
+Settings = namedtuple(
+    "Settings",
+    [
+        "scaffolds",
+        "queriesPerTarget",
+        "hitsPerBucket",
+        "insertDensity",
+        "tsdLens",
+        "insertLens",
+        "seed",
+    ],
+)
+
+DEFAULTS = Settings(
+    scaffolds=10,
+    queriesPerTarget=3,
+    hitsPerBucket=200,
+    insertDensity=0.1,
+    tsdLens=(0, 5, 15),
+    insertLens=(500, 10000),
+    seed=1,
+)
+
+# Shortest aligned segment between planted insertions
+MIN_SEGMENT = 1000
+
+
+def _segments(rng, qlen, count, settings):
+    """Choose insertion sites in a query of length qlen.
+    Returns list of (site, tsd, insert length) sorted by site, where site is
+    the query position (idx '0') of the first TSD base."""
+    sites = list()
+    gap = max(MIN_SEGMENT, (qlen - MIN_SEGMENT) // max(1, count))
+    for k in range(count):
+        # One site in each slot, so sites are at least MIN_SEGMENT apart
+        site = MIN_SEGMENT + k * gap + rng.randint(0, gap - MIN_SEGMENT)
+        if site + MIN_SEGMENT > qlen:
+            break
+        sites.append(
+            (site, rng.choice(settings.tsdLens), rng.randint(*settings.insertLens))
+        )
+    return sites
+
+
+def _row(tname, tstart, tend, qname, strand, qstart, qend, qlen, idt):
+    """Result table row for aligned target tstart:tend and query qstart:qend
+    (idx '0', end exclusive). Query coordinates are given on the plus strand."""
+    if strand == "-":
+        qstart, qend = qlen - qend, qlen - qstart
+    return [tname, "+", tstart + 1, tend, qname, strand, qstart + 1, qend, 1000, idt]
+
+
+def _plantCount(settings):
+    return max(1, int(settings.hitsPerBucket * settings.insertDensity))
+
+
+def plantBucket(rng, tname, qname, qlen, settings):
+    """Plant insertions in a copy of query qname (length qlen) as target tname.
+    Returns (rows, planted insertions, target length, strand, layout), where
+    layout lists the (query start, query end, insert length) of each target
+    segment, with query coordinates on the aligned strand."""
+    count = _plantCount(settings)
+    sites = _segments(rng, qlen, count, settings)
+    strand = rng.choice("+-")
+    rows = list()
+    planted = list()
+    layout = list()
+    qstart = tpos = 0
+    for site, tsd, insertLen in sites + [(qlen, 0, 0)]:
+        # Segment runs to the end of the TSD, which is aligned on both sides
+        qend = min(site + tsd, qlen)
+        idt = round(rng.uniform(92, 100), 1)
+        rows.append(
+            _row(
+                tname,
+                tpos,
+                tpos + qend - qstart,
+                qname,
+                strand,
+                qstart,
+                qend,
+                qlen,
+                idt,
+            )
+        )
+        layout.append((qstart, qend, insertLen))
+        tpos += qend - qstart
+        if insertLen:
+            planted.append(
+                Planted(tname, qname, tpos + 1, tpos + insertLen, tsd, strand)
+            )
+            tpos += insertLen
+        qstart = site
+    return rows, planted, tpos, strand, layout
+
+
+def noiseRows(rng, tname, tlen, qname, qlen, count):
+    """Random background hits between tname and qname."""
+    rows = list()
+    for _ in range(count):
+        size = rng.randint(100, 3000)
+        tstart = rng.randint(0, max(0, tlen - size))
+        qstart = rng.randint(0, max(0, qlen - size))
+        idt = round(rng.uniform(60, 100), 1)
+        strand = rng.choice("+-")
+        rows.append(
+            _row(
+                tname,
+                tstart,
+                tstart + size,
+                qname,
+                strand,
+                qstart,
+                qstart + size,
+                qlen,
+                idt,
+            )
+        )
+    return rows
+
+
+def generate(settings=DEFAULTS):
+    """Build a synthetic data set. Returns (rows, planted, genome) where rows
+    are result table rows in bucket order, planted the list of Planted
+    insertions and genome a dict of target name: (query name, target length,
+    query length, strand, layout) used to write sequences."""
+    rng = random.Random(settings.seed)
+    rows = list()
+    planted = list()
+    genome = dict()
+    queries = ["B%s" % i for i in range(settings.scaffolds)]
+    # Room for each planted insertion to be flanked by segments of MIN_SEGMENT or more
+    count = _plantCount(settings)
+    qlens = {q: 2 * MIN_SEGMENT * (count + 1) for q in queries}
+    for i, qname in enumerate(queries):
+        tname = "A%s" % i
+        bucketRows, bucketPlanted, tlen, strand, layout = plantBucket(
+            rng, tname, qname, qlens[qname], settings
+        )
+        # Fill the homologous bucket with background hits
+        bucketRows += noiseRows(
+            rng,
+            tname,
+            tlen,
+            qname,
+            qlens[qname],
+            settings.hitsPerBucket - len(bucketRows),
+        )
+        rows += bucketRows
+        planted += bucketPlanted
+        genome[tname] = (qname, tlen, qlens[qname], strand, layout)
+        # Background hits from other query scaffolds
+        others = [q for q in queries if q != qname]
+        for other in rng.sample(
+            others, min(len(others), settings.queriesPerTarget - 1)
+        ):
+            rows += noiseRows(
+                rng, tname, tlen, other, qlens[other], settings.hitsPerBucket
+            )
+    return rows, planted, genome
+
+
+def writeRows(rows, path):
+    with open(path, "w") as f:
+        f.write(HEADER)
+        for row in rows:
+            f.write("\t".join(map(str, row)) + "\n")
+    return path
+
+
+def writePlanted(planted, path):
+    with open(path, "w") as f:
+        f.write("#target\tquery\tstart\tend\ttsd\tstrand\n")
+        for p in planted:
+            f.write("\t".join(map(str, p)) + "\n")
+    return path
+
+
+def readPlanted(path):
+    planted = list()
+    with open(path) as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            li = line.rstrip("\n").split("\t")
+            planted.append(
+                Planted(li[0], li[1], int(li[2]), int(li[3]), int(li[4]), li[5])
+            )
+    return planted
+
+
+def _revcomp(seq):
+    return seq[::-1].translate(str.maketrans("ACGT", "TGCA"))
+
+
+def writeGenomes(genome, seed, Apath, Bpath, width=60):
+    """Write target and query sequences matching the planted layout. Background
+    hits are not backed by sequence."""
+    rng = random.Random(seed)
+
+    def randomSeq(n):
+        return "".join(rng.choice("ACGT") for _ in range(n))
+
+    def wrap(seq):
+        return "\n".join(seq[i : i + width] for i in range(0, len(seq), width)) + "\n"
+
+    queries = dict()
+    with open(Apath, "w") as A:
+        for tname, (qname, tlen, qlen, strand, layout) in genome.items():
+            query = randomSeq(qlen)
+            target = "".join(query[s:e] + randomSeq(n) for s, e, n in layout)
+            A.write(">" + tname + "\n" + wrap(target))
+            queries[qname] = query if strand == "+" else _revcomp(query)
+    with open(Bpath, "w") as B:
+        for qname, query in queries.items():
+            B.write(">" + qname + "\n" + wrap(query))
+
+
+def mainArgs():
+    parser = argparse.ArgumentParser(
+        description="Write synthetic LASTZ alignments with planted insertions.",
+    )
+    parser.add_argument("--outdir", type=str, default="synth", help="Output directory.")
+    parser.add_argument(
+        "--scaffolds",
+        type=int,
+        default=DEFAULTS.scaffolds,
+        help="Number of target scaffolds.",
+    )
+    parser.add_argument(
+        "--queriesPerTarget",
+        type=int,
+        default=DEFAULTS.queriesPerTarget,
+        help="Number of query scaffolds with hits to each target.",
+    )
+    parser.add_argument(
+        "--hitsPerBucket",
+        type=int,
+        default=DEFAULTS.hitsPerBucket,
+        help="Number of hits in each Target:Query bucket.",
+    )
+    parser.add_argument(
+        "--insertDensity",
+        type=float,
+        default=DEFAULTS.insertDensity,
+        help="Planted insertions per hit in homologous buckets.",
+    )
+    parser.add_argument(
+        "--tsdLens",
+        type=str,
+        default=",".join(map(str, DEFAULTS.tsdLens)),
+        help="Comma separated TSD lengths to choose from.",
+    )
+    parser.add_argument(
+        "--insertLens",
+        type=str,
+        default=",".join(map(str, DEFAULTS.insertLens)),
+        help="Minimum and maximum insertion length, comma separated.",
+    )
+    parser.add_argument("--seed", type=int, default=DEFAULTS.seed, help="Random seed.")
+    parser.add_argument(
+        "--fasta",
+        action="store_true",
+        default=False,
+        help="If set, also write target and query genomes as A.fa and B.fa.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = mainArgs()
+    settings = Settings(
+        scaffolds=args.scaffolds,
+        queriesPerTarget=args.queriesPerTarget,
+        hitsPerBucket=args.hitsPerBucket,
+        insertDensity=args.insertDensity,
+        tsdLens=tuple(int(x) for x in args.tsdLens.split(",")),
+        insertLens=tuple(int(x) for x in args.insertLens.split(",")),
+        seed=args.seed,
+    )
+    os.makedirs(args.outdir, exist_ok=True)
+    rows, planted, genome = generate(settings)
+    writeRows(rows, os.path.join(args.outdir, "alignment.tab"))
+    writePlanted(planted, os.path.join(args.outdir, "planted.tsv"))
+    if args.fasta:
+        writeGenomes(
+            genome,
+            settings.seed,
+            os.path.join(args.outdir, "A.fa"),
+            os.path.join(args.outdir, "B.fa"),
+        )
+    print("Wrote %s hits with %s planted insertions." % (len(rows), len(planted)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
 from shlex import quote
 import glob
+import hashlib
 import os
 import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
+
+from .faidx import (
+    FastaIndex,
+    QueryBatch,
+    SeqRef,
+    TargetWindow,
+    fasta_names,
+    seq_name,
+)
+from .hittable import readHitTable
+from .metrics import timed
+from .schedule import Batch, Progress, plan_jobs, seq_length
 
 
 class Error(Exception):
@@ -38,6 +54,223 @@ def get_all_pairs(Adir=None, Bdir=None):
     return pairs
 
 
+def import_fasta_pairs(file=None, Aindex=None, Bindex=None):
+    """Read target:query sequence name pairs from file. Return pairs of SeqRefs
+    into the indexed A and B genomes."""
+    pairs = list()
+    with open(file) as f:
+        for line in f:
+            li = line.strip()
+            if li and not li.startswith("#"):
+                A, B = li.split()[:2]
+                for name, index in ((A, Aindex), (B, Bindex)):
+                    if name not in index:
+                        raise Error("Sequence %s not found in %s" % (name, index.fasta))
+                pairs.append((SeqRef(Aindex, A), SeqRef(Bindex, B)))
+    return pairs
+
+
+def get_all_fasta_pairs(Aindex=None, Bindex=None):
+    """Return all pairs of SeqRefs between indexed A and B genomes."""
+    pairs = list()
+    for A in Aindex.names:
+        for B in Bindex.names:
+            pairs.append((SeqRef(Aindex, A), SeqRef(Bindex, B)))
+    return pairs
+
+
+# Header line of the alignment result table
+HEADER = (
+    "#name1\tstrand1\tstart1\tend1\tname2\tstrand2\tstart2+\tend2+\tscore\tidentity\n"
+)
+
+
+def LASTZ_args(lzpath="lastz", A=None, B=None, hspthresh=3000, verbose=False):
+    """Compose LASTZ argument list to align query B onto target A.
+    Output is written to stdout unless an --output option is appended."""
+    if verbose:
+        verb = 1
+    else:
+        verb = 0
+    return [
+        lzpath,
+        A,
+        B,
+        "--entropy",
+        "--format=general:name1,strand1,start1,end1,length1,name2,strand2,start2+,end2+,length2,score,identity",
+        "--markend",
+        "--gfextend",
+        "--chain",
+        "--gapped",
+        "--step=1",
+        "--strand=both",
+        "--hspthresh=" + str(hspthresh),
+        "--verbosity=" + str(verb),
+    ]
+
+
+def LASTZ_align_cmd(
+    lzpath="lastz", A=None, B=None, hspthresh=3000, outfile=None, verbose=False
+):
+    """Compose LASTZ command to align query B onto target A, writing raw
+    output to outfile."""
+    cmd = LASTZ_args(lzpath=lzpath, A=A, B=B, hspthresh=hspthresh, verbose=verbose)
+    cmd.insert(-1, "--output=" + outfile)
+    return " ".join(quote(x) for x in cmd)
+
+
+# Columns of LASTZ general output kept in the result table
+# name1,strand1,start1,end1,name2,strand2,start2+,end2+,score,identity
+KEEP_COLS = (0, 1, 2, 3, 5, 6, 7, 8, 10, 12)
+
+
+def _number(x):
+    """Numeric value of a LASTZ output field. Non-numeric fields count as 0."""
+    try:
+        return float(x)
+    except ValueError:
+        return 0.0
+
+
+def filter_LASTZ(lines, minIdt=60, minLen=100):
+    """Filter raw LASTZ general format output lines.
+    Scrub % symbols, drop comment lines and hits with target length < minLen or
+    identity < minIdt. Yield kept hits as lists of result table fields:
+    name1,strand1,start1,end1,name2,strand2,start2+,end2+,score,identity"""
+    for line in lines:
+        if line.startswith("#"):
+            continue
+        fields = line.replace("%", "").split()
+        if len(fields) < 13:
+            continue
+        if _number(fields[4]) >= minLen and _number(fields[12]) >= minIdt:
+            yield [fields[i] for i in KEEP_COLS]
+
+
+def sort_hits(rows):
+    """Sort result table rows by target name then start position, in place.
+    Ties are broken on the whole row, as with 'sort -k 1,1 -k 3n,4n' in the C locale."""
+    rows.sort(key=lambda row: (row[0], _number(row[2]), "\t".join(row)))
+    return rows
+
+
+def stream_LASTZ(
+    lzpath="lastz",
+    A=None,
+    B=None,
+    hspthresh=3000,
+    tee=None,
+    verbose=False,
+    timeout=None,
+):
+    """Run LASTZ and yield lines of raw output as they are produced.
+    If tee is an open file, raw lines are also copied to it.
+    LASTZ progress messages are shown if verbose is set, otherwise they are
+    captured and reported only if LASTZ fails.
+    LASTZ is killed and Error raised if it runs for more than timeout seconds."""
+    cmd = LASTZ_args(lzpath=lzpath, A=A, B=B, hspthresh=hspthresh, verbose=verbose)
+    with tempfile.TemporaryFile() as err:
+        proc = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=None if verbose else err,
+            universal_newlines=True,
+        )
+        timer = None
+        killed = threading.Event()
+        if timeout:
+
+            def kill():
+                killed.set()
+                proc.kill()
+
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+        try:
+            with proc.stdout:
+                for line in proc.stdout:
+                    if tee is not None:
+                        tee.write(line)
+                    yield line
+            returncode = proc.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if killed.is_set():
+            raise Error("LASTZ timed out after %s seconds:" % timeout, " ".join(cmd))
+        if returncode != 0:
+            err.seek(0)
+            print(
+                "The following command failed with exit code",
+                returncode,
+                file=sys.stderr,
+            )
+            print(" ".join(quote(x) for x in cmd), file=sys.stderr)
+            print("\nThe output was:\n", file=sys.stderr)
+            print(decode(err.read()), file=sys.stderr)
+            raise Error("Error running command:", " ".join(cmd))
+
+
+def LASTZ_filter_cmd(infile=None, outfile=None, minIdt=60, minLen=100):
+    """Compose command to filter raw LASTZ output in infile and append
+    hits to outfile. The raw file is left unchanged."""
+    ## Scrub % symbols
+    ## Filter Inter_Chrome targets to min len $minLen [100], min identity $minIdt [90]
+    ## New Header = name1,strand1,start1,end1,name2,strand2,start2+,end2+,score,identity
+    ## Sort filtered file by chrom, start, stop
+    return " ".join(
+        [
+            "sed -e 's/%//g'",
+            quote(infile),
+            "| awk '!/^#/ { print; }'",
+            "| awk -v minLen=" + str(minLen),
+            "'0+$5 >= minLen {print ;}' | awk -v OFS=" + "'\\t'",
+            "-v minIdt=" + str(minIdt),
+            "'0+$13 >= minIdt {print $1,$2,$3,$4,$6,$7,$8,$9,$11,$13;}' | sed 's/ //g' | sort -k 1,1 -k 3n,4n >>",
+            quote(outfile),
+        ]
+    )
+
+
+def _temp_name(A, B, tmpdir=None):
+    t_name = seq_name(A)
+    q_name = seq_name(B)
+    name = "_".join(["temp", q_name, "onto", t_name, ".tab"])
+    if tmpdir:
+        return os.path.join(os.path.abspath(tmpdir), name)
+    return name
+
+
+def LASTZ_pair_cmds(
+    lzpath="lastz",
+    A=None,
+    B=None,
+    minIdt=60,
+    minLen=100,
+    hspthresh=3000,
+    outfile=None,
+    verbose=False,
+    tmpdir=None,
+):
+    """Compose commands to align query B onto target A with LASTZ and
+    append filtered, sorted hits to outfile. Raw LASTZ output is written
+    to tmpdir, or the directory the commands are run in if not set."""
+    temp_outfile = _temp_name(A, B, tmpdir)
+    return [
+        LASTZ_align_cmd(
+            lzpath=lzpath,
+            A=A,
+            B=B,
+            hspthresh=hspthresh,
+            outfile=temp_outfile,
+            verbose=verbose,
+        ),
+        LASTZ_filter_cmd(
+            infile=temp_outfile, outfile=outfile, minIdt=minIdt, minLen=minLen
+        ),
+    ]
+
+
 def LASTZ_cmds(
     lzpath="lastz",
     pairs=None,
@@ -46,11 +279,8 @@ def LASTZ_cmds(
     hspthresh=3000,
     outfile=None,
     verbose=False,
+    tmpdir=None,
 ):
-    if verbose:
-        verb = 1
-    else:
-        verb = 0
     cmds = list()
     # Write header
     cmds.append(
@@ -62,44 +292,838 @@ def LASTZ_cmds(
         )
     )
     for A, B in pairs:
-        t_file = A
-        t_name = os.path.splitext(os.path.basename(A))[0]
-        q_file = B
-        q_name = os.path.splitext(os.path.basename(B))[0]
-        temp_outfile = "_".join(["temp", q_name, "onto", t_name, ".tab"])
-        # Compose LASTZ command
-        cmds.append(
-            " ".join(
-                [
-                    quote(lzpath),
-                    quote(t_file),
-                    quote(q_file),
-                    "--entropy --format=general:name1,strand1,start1,end1,length1,name2,strand2,start2+,end2+,length2,score,identity --markend --gfextend --chain --gapped --step=1 --strand=both --hspthresh="
-                    + str(hspthresh),
-                    "--output=" + temp_outfile,
-                    "--verbosity=" + str(verb),
-                ]
+        cmds.extend(
+            LASTZ_pair_cmds(
+                lzpath=lzpath,
+                A=A,
+                B=B,
+                minIdt=minIdt,
+                minLen=minLen,
+                hspthresh=hspthresh,
+                outfile=outfile,
+                verbose=verbose,
+                tmpdir=tmpdir,
             )
         )
-        # Scrub % symbols
-        cmds.append(" ".join(["sed -i '' -e 's/%//g'", temp_outfile]))
-        ## Filter Inter_Chrome targets to min len $minLen [100], min identity $minIdt [90]
-        ## New Header = name1,strand1,start1,end1,name2,strand2,start2+,end2+,score,identity
-        ## Sort filtered file by chrom, start, stop
-        cmds.append(
-            " ".join(
-                [
-                    "awk '!/^#/ { print; }'",
-                    temp_outfile,
-                    "| awk -v minLen=" + str(minLen),
-                    "'0+$5 >= minLen {print ;}' | awk -v OFS=" + "'\\t'",
-                    "-v minIdt=" + str(minIdt),
-                    "'0+$13 >= minIdt {print $1,$2,$3,$4,$6,$7,$8,$9,$11,$13;}' | sed 's/ //g' | sort -k 1,1 -k 3n,4n >>",
-                    quote(outfile),
-                ]
+    return cmds
+
+
+def target_windows(ref, length, window, overlap):
+    """Split a target of length bases into windows of size window, each
+    overlapping the next by overlap bases. Window cores tile the target, so
+    every hit is reported by exactly one window. Hits starting on the first
+    base of a window may be clipped parts of longer hits, so cores start one
+    base in and these hits are left to the previous window."""
+    step = window - overlap
+    windows = list()
+    start = 0
+    core_start = 0
+    while True:
+        end = min(start + window, length)
+        if end == length:
+            windows.append(TargetWindow(ref, start, end, core_start, length))
+            break
+        windows.append(TargetWindow(ref, start, end, core_start, start + step + 1))
+        core_start = start + step + 1
+        start += step
+    return windows
+
+
+def window_jobs(pairs, window=None, overlap=100000, tmpdir=None):
+    """Expand target:query pairs into alignment jobs.
+    Returns list of (pair index, target, query). Targets longer than window are
+    split into overlapping TargetWindows. Targets given as file paths are
+    indexed into tmpdir, or in memory if tmpdir is not set, and only split if
+    the file holds a single sequence."""
+    if window and overlap >= window:
+        raise Error("Window overlap must be smaller than window size.")
+    jobs = list()
+    windowed = dict()
+    for i, (A, B) in enumerate(pairs):
+        if not window:
+            jobs.append((i, A, B))
+            continue
+        if A not in windowed:
+            windowed[A] = [A]
+            if isinstance(A, SeqRef):
+                ref = A
+            elif os.path.getsize(A) > window:
+                if tmpdir:
+                    faipath = os.path.join(
+                        tmpdir, "target_" + str(len(windowed)) + ".fai"
+                    )
+                    index = FastaIndex(A, faipath=faipath)
+                else:
+                    index = FastaIndex(A, write=False)
+                ref = SeqRef(index, index.names[0]) if len(index) == 1 else None
+            else:
+                ref = None
+            if ref is not None:
+                length = ref.index.length(ref.name)
+                if length > window:
+                    windowed[A] = target_windows(ref, length, window, overlap)
+        for target in windowed[A]:
+            jobs.append((i, target, B))
+    return jobs
+
+
+def batch_queries(jobs, batchSize=None):
+    """Group jobs that share a target and have queries shorter than batchSize
+    into QueryBatches of up to batchSize bases, each aligned as one LASTZ job.
+    The target is then read and seeded once per batch rather than per query.
+    Returns list of (pair index, target, query) jobs. Pair index is None for
+    batched jobs, see QueryBatch.pairs."""
+    if not batchSize:
+        return jobs
+    batched = list()
+    # Open batch for each target: (position in batched, total length)
+    current = dict()
+    for i, A, B in jobs:
+        length = seq_length(B)
+        if length >= batchSize:
+            batched.append((i, A, B))
+            continue
+        names = [B.name] if isinstance(B, SeqRef) else fasta_names(B)
+        pos, total = current.get(A, (None, 0))
+        if pos is not None:
+            batch = batched[pos][2]
+            # Record names must be unique within a batch to split the output
+            taken = set(name for li in batch.names for name in li)
+            if total + length > batchSize or taken.intersection(names):
+                pos = None
+        if pos is None:
+            pos, total = len(batched), 0
+            batched.append((None, A, QueryBatch(list(), list(), list())))
+        batch = batched[pos][2]
+        batch.queries.append(B)
+        batch.pairs.append(i)
+        batch.names.append(names)
+        current[A] = (pos, total + length)
+    # Batches holding a single query are run as ordinary jobs
+    for n, (i, A, B) in enumerate(batched):
+        if isinstance(B, QueryBatch) and len(B.queries) == 1:
+            batched[n] = (B.pairs[0], A, B.queries[0])
+    return batched
+
+
+def job_outputs(job, jobout):
+    """Return list of (pair index, file) holding the hits of each pair aligned
+    by job. A QueryBatch job writes a separate file for each pair."""
+    i, _, B = job
+    if isinstance(B, QueryBatch):
+        base = os.path.splitext(jobout)[0]
+        return [(p, "%s_%s.tab" % (base, k)) for k, p in enumerate(B.pairs)]
+    return [(i, jobout)]
+
+
+# First field of job output lines holding hit continuations, see lift_hits
+PIECE = "#piece"
+
+
+def lift_hits(rows, window, pieces=None):
+    """Shift target coordinates of hits aligned to a TargetWindow into
+    scaffold coordinates. Keep only hits starting within the window core.
+    If pieces is a list, hits starting on the first base of a window after
+    the first are lifted and added to it. These may continue hits clipped at
+    the end of the previous window, see stitch_hits."""
+    lifted = list()
+    for row in rows:
+        start = int(row[2]) + window.start
+        # LASTZ positions are idx '1'
+        if window.core_start <= start - 1 < window.core_end:
+            lifted.append(row)
+        elif pieces is not None and window.start and start - 1 == window.start:
+            pieces.append(row)
+        else:
+            continue
+        row[2] = str(start)
+        row[3] = str(int(row[3]) + window.start)
+    return lifted
+
+
+def stitch_hits(rows, pieces):
+    """Join hits clipped at the end of a target window with their
+    continuations, given as pieces starting on the first base of the next
+    window. A piece continues a hit on the same query and strand that covers
+    its first base and ends before it does, with query coordinates running on
+    from those of the hit. The score of the piece is added in proportion to
+    the bases it adds, and identity is averaged over both parts. Other pieces
+    are dropped, as their hits are reported whole by the previous window.
+    Rows are updated in place and returned."""
+    byKey = dict()
+    for row in rows:
+        byKey.setdefault((row[0], row[4], row[5]), list()).append(row)
+    for piece in sorted(pieces, key=lambda row: int(row[2])):
+        s, f = int(piece[2]), int(piece[3])
+        pb, pe = int(piece[6]), int(piece[7])
+        for row in byKey.get((piece[0], piece[4], piece[5]), list()):
+            a, e = int(row[2]), int(row[3])
+            qb, qe = int(row[6]), int(row[7])
+            if not a <= s <= e < f:
+                continue
+            # Query coordinates are on the + strand
+            if piece[5] == "-":
+                if not pb < qb <= pe <= qe:
+                    continue
+                row[6] = piece[6]
+            else:
+                if not qb <= pb <= qe < pe:
+                    continue
+                row[7] = piece[7]
+            added = f - e
+            length = e - a + 1
+            row[3] = piece[3]
+            row[8] = str(
+                int(round(_number(row[8]) + _number(piece[8]) * added / (f - s + 1)))
             )
+            if row[9] != piece[9]:
+                ident = _number(row[9].rstrip("%")) * length
+                ident += _number(piece[9].rstrip("%")) * added
+                row[9] = "%.1f%%" % (ident / (length + added))
+            break
+    return rows
+
+
+class ScratchSeqs(object):
+    """Scratch copies of the SeqRefs and TargetWindows aligned by a set of
+    jobs. Each sequence is extracted once, when first needed, and shared by
+    all jobs that align it. Copies are removed when the last job using them
+    is released."""
+
+    def __init__(self, scratch, jobs):
+        self.scratch = scratch
+        self._users = dict()
+        for _, A, B in jobs:
+            for x in (A, B):
+                if isinstance(x, (SeqRef, TargetWindow)):
+                    self._users[x] = self._users.get(x, 0) + 1
+        # Each sequence has its own file name and lock, fixed before any job
+        # runs, so concurrent first uses of different sequences never collide
+        self._names = {
+            x: os.path.join(scratch, "seq_%s.fa" % n) for n, x in enumerate(self._users)
+        }
+        self._locks = {x: threading.Lock() for x in self._users}
+        self._paths = dict()
+        self._lock = threading.Lock()
+
+    def path(self, x):
+        """Return path to a fasta file of x, extracting it on first use."""
+        with self._locks[x]:
+            if x not in self._paths:
+                path = self._names[x]
+                if isinstance(x, TargetWindow):
+                    x.ref.index.extract(x.ref.name, path, x.start, x.end)
+                else:
+                    x.index.extract(x.name, path)
+                self._paths[x] = path
+            return self._paths[x]
+
+    def release(self, x):
+        """Record that a job using x is done. Removes the copy of x after its
+        last job."""
+        if not isinstance(x, (SeqRef, TargetWindow)):
+            return
+        with self._lock:
+            self._users[x] -= 1
+            if self._users[x]:
+                return
+            path = self._paths.pop(x, None)
+        if path is not None:
+            os.remove(path)
+
+
+def _materialise(x, seqs, tag):
+    """Return path to a fasta file containing sequence x. SeqRefs and
+    TargetWindows are shared copies from seqs. QueryBatches are written to
+    seqs.scratch as a single multifasta. Returns (path, is_temp)."""
+    if isinstance(x, QueryBatch):
+        path = os.path.join(seqs.scratch, tag + ".fa")
+        with open(path, "wb") as handle:
+            for q in x.queries:
+                if isinstance(q, SeqRef):
+                    q.index.write(q.name, handle)
+                    continue
+                with open(q, "rb") as f:
+                    data = f.read()
+                handle.write(data if data.endswith(b"\n") else data + b"\n")
+        return path, True
+    if isinstance(x, (SeqRef, TargetWindow)):
+        return seqs.path(x), False
+    return x, False
+
+
+def _counted(lines, stats):
+    """Pass lines through, counting LASTZ hits in stats['rawHits']."""
+    for line in lines:
+        if not line.startswith("#"):
+            stats["rawHits"] += 1
+        yield line
+
+
+def _align_files(
+    t_file,
+    q_file,
+    lzpath,
+    minIdt,
+    minLen,
+    hspthresh,
+    cache,
+    verbose,
+    timeout=None,
+    stats=None,
+    target=None,
+    query=None,
+):
+    """Align q_file onto t_file and return list of filtered hits.
+    LASTZ output is filtered as it is read from the pipe, so no unfiltered
+    intermediate file is written. If a cache is given, raw LASTZ output is read
+    from it when present, or copied into it during alignment. Cache entries
+    are keyed by the target and query sequences the files hold, if given,
+    else by the files.
+    If stats is a dict, unfiltered hits are counted in stats['rawHits']."""
+    if stats is not None:
+        stats.setdefault("rawHits", 0)
+
+    def count(lines):
+        return lines if stats is None else _counted(lines, stats)
+
+    if cache is not None:
+        key = cache.key(
+            target or t_file, query or q_file, lzpath=lzpath, hspthresh=hspthresh
         )
-    return cmds
+        raw = cache.get(key)
+        if raw is not None:
+            if verbose:
+                print("Using cached alignment for:", t_file, q_file, flush=True)
+            with open(raw) as f:
+                return list(filter_LASTZ(count(f), minIdt=minIdt, minLen=minLen))
+        temp_outfile = cache.tempfile()
+        try:
+            with open(temp_outfile, "w") as tee:
+                rows = list(
+                    filter_LASTZ(
+                        count(
+                            stream_LASTZ(
+                                lzpath, t_file, q_file, hspthresh, tee, verbose, timeout
+                            )
+                        ),
+                        minIdt=minIdt,
+                        minLen=minLen,
+                    )
+                )
+        except Exception:
+            os.remove(temp_outfile)
+            raise
+        cache.put(key, temp_outfile)
+        return rows
+    return list(
+        filter_LASTZ(
+            count(
+                stream_LASTZ(
+                    lzpath, t_file, q_file, hspthresh, verbose=verbose, timeout=timeout
+                )
+            ),
+            minIdt=minIdt,
+            minLen=minLen,
+        )
+    )
+
+
+def _write_rows(rows, path):
+    """Write rows to path via a temporary file, so that path only exists once
+    it is complete."""
+    with open(path + ".part", "w") as out:
+        for row in rows:
+            out.write("\t".join(row) + "\n")
+    os.replace(path + ".part", path)
+
+
+def _align_pair(
+    A,
+    B,
+    jobout,
+    seqs,
+    lzpath,
+    minIdt,
+    minLen,
+    hspthresh,
+    cache,
+    verbose,
+    timeout=None,
+):
+    """Align one target:query pair and write filtered, sorted hits to jobout.
+    Sequences given as SeqRefs or TargetWindows are read from their shared
+    copies in seqs, a ScratchSeqs. Hits of a QueryBatch are split by query name into the
+    per-pair files given by job_outputs.
+    Returns dict of seconds spent extracting sequences, in LASTZ and filtering,
+    and sorting and writing hits, with counts of unfiltered and kept hits."""
+    if verbose:
+        print("Aligning", seq_name(B), "onto", seq_name(A), flush=True)
+    stats = dict()
+    temps = list()
+    tag = os.path.splitext(os.path.basename(jobout))[0]
+    start = time.perf_counter()
+    try:
+        t_file, is_temp = _materialise(A, seqs, tag + "_target")
+        if is_temp:
+            temps.append(t_file)
+        q_file, is_temp = _materialise(B, seqs, tag + "_query")
+        if is_temp:
+            temps.append(q_file)
+        stats["extractSeconds"] = round(time.perf_counter() - start, 4)
+        start = time.perf_counter()
+        rows = _align_files(
+            t_file,
+            q_file,
+            lzpath,
+            minIdt,
+            minLen,
+            hspthresh,
+            cache,
+            verbose,
+            timeout,
+            stats,
+            A,
+            B,
+        )
+        stats["lastzSeconds"] = round(time.perf_counter() - start, 4)
+    finally:
+        for path in temps:
+            os.remove(path)
+    start = time.perf_counter()
+    stats["hits"] = len(rows)
+    pieces = list()
+    if isinstance(A, TargetWindow):
+        rows = lift_hits(rows, A, pieces)
+    sort_hits(rows)
+    # Continuations of clipped hits are kept for stitch_hits
+    rows.extend([PIECE] + row for row in pieces)
+    if not isinstance(B, QueryBatch):
+        _write_rows(rows, jobout)
+        stats["sortSeconds"] = round(time.perf_counter() - start, 4)
+        return stats
+    route = dict()
+    for k, names in enumerate(B.names):
+        for name in names:
+            route[name] = k
+    split = [list() for _ in B.queries]
+    for row in rows:
+        # Query name, counted from the end to skip any PIECE field
+        split[route[row[-6]]].append(row)
+    for (_, path), part in zip(job_outputs((None, A, B), jobout), split):
+        _write_rows(part, path)
+    stats["sortSeconds"] = round(time.perf_counter() - start, 4)
+    return stats
+
+
+def _describe(x):
+    """Identify sequence x, including the size and modification time of the
+    file it is read from."""
+    if isinstance(x, QueryBatch):
+        return "+".join(_describe(q) for q in x.queries)
+    if isinstance(x, TargetWindow):
+        return "%s[%s:%s]" % (_describe(x.ref), x.start, x.end)
+    if isinstance(x, SeqRef):
+        return "%s|%s" % (_describe(x.index.fasta), x.name)
+    stat = os.stat(x)
+    return "%s|%s|%s" % (os.path.abspath(x), stat.st_size, stat.st_mtime_ns)
+
+
+def job_key(job, *settings):
+    """Stable name for the output of a job, derived from its sequences and the
+    alignment settings. Used to find completed jobs when resuming a run."""
+    _, A, B = job
+    h = hashlib.sha1()
+    for part in [_describe(A), _describe(B)] + [str(x) for x in settings]:
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()[:20]
+
+
+def _job_done(job, jobout):
+    return all(os.path.isfile(path) for _, path in job_outputs(job, jobout))
+
+
+def _align_batch(
+    batch, jobs, jobouts, retries, progress, failed, onDone, metrics, seqs, *args
+):
+    """Run the jobs of a scheduled batch one after another.
+    Each job is attempted up to retries + 1 times. Jobs that still fail are
+    added to failed, and remaining jobs continue. onDone, if set, is called
+    with the index of each job that succeeds. If metrics is given, the
+    duration and hit counts of each job are recorded. Shared sequence copies
+    in seqs are released as each job finishes."""
+    for j in batch.jobs:
+        _, A, B = jobs[j]
+        start = time.perf_counter()
+        for attempt in range(retries + 1):
+            try:
+                stats = _align_pair(A, B, jobouts[j], seqs, *args)
+                if metrics is not None:
+                    metrics.job(
+                        target=seq_name(A),
+                        query=seq_name(B),
+                        seconds=round(time.perf_counter() - start, 4),
+                        attempts=attempt + 1,
+                        ok=True,
+                        **stats,
+                    )
+                if onDone is not None:
+                    onDone(j)
+                break
+            except Error as error:
+                if metrics is not None and attempt < retries:
+                    metrics.count("jobRetries")
+                if attempt < retries:
+                    print(
+                        "Retrying %s onto %s: %s"
+                        % (seq_name(B), seq_name(A), error.args[0]),
+                        file=sys.stderr,
+                        flush=True,
+                    )
+                else:
+                    failed.append(j)
+                    if metrics is not None:
+                        metrics.job(
+                            target=seq_name(A),
+                            query=seq_name(B),
+                            seconds=round(time.perf_counter() - start, 4),
+                            attempts=attempt + 1,
+                            ok=False,
+                        )
+        seqs.release(A)
+        seqs.release(B)
+        if progress is not None:
+            progress.update(j)
+
+
+def _scratch(tmpdir=None):
+    """Create a scratch directory within tmpdir (default: the system temporary
+    directory). Returns its absolute path."""
+    return tempfile.mkdtemp(
+        prefix="tmp.", dir=os.path.abspath(tmpdir or tempfile.gettempdir())
+    )
+
+
+def plan_pairs(pairs, threads=1, window=None, overlap=100000, batchSize=None):
+    """Return (jobs, Schedule) that run_pairs would use for pairs, without
+    running any alignments. Nothing is written: targets given as file paths
+    are indexed in memory."""
+    jobs = window_jobs(pairs, window=window, overlap=overlap)
+    jobs = batch_queries(jobs, batchSize=batchSize)
+    return jobs, plan_jobs(jobs, threads=threads)
+
+
+def _make_jobs(
+    pairs, scratch, lzpath, minIdt, minLen, hspthresh, window, overlap, batchSize
+):
+    """Expand pairs into alignment jobs with output files in scratch.
+    Returns (jobs, jobouts, byPair), where byPair is a dict of pair index:
+    list of (job index, file) holding the hits of that pair."""
+    jobs = window_jobs(pairs, window=window, overlap=overlap, tmpdir=scratch)
+    jobs = batch_queries(jobs, batchSize=batchSize)
+    jobouts = [
+        os.path.join(
+            scratch, "job_" + job_key(job, lzpath, minIdt, minLen, hspthresh) + ".tab"
+        )
+        for job in jobs
+    ]
+    byPair = dict()
+    for j, (job, jobout) in enumerate(zip(jobs, jobouts)):
+        for i, path in job_outputs(job, jobout):
+            byPair.setdefault(i, list()).append((j, path))
+    return jobs, jobouts, byPair
+
+
+def _run_jobs(
+    jobs,
+    jobouts,
+    scratch,
+    lzpath,
+    minIdt,
+    minLen,
+    hspthresh,
+    threads,
+    cache,
+    verbose,
+    timeout,
+    retries,
+    progress,
+    onDone=None,
+    metrics=None,
+):
+    """Run alignment jobs, skipping those with complete outputs in scratch.
+    If onDone is given it is called with the index of each completed job, from
+    the thread that ran it. Raises Error once all jobs have finished if any
+    job failed. If metrics is given, jobs run, skipped and failed are counted
+    and each job is recorded."""
+    todo = list()
+    for j, job in enumerate(jobs):
+        if not _job_done(job, jobouts[j]):
+            todo.append(j)
+        elif onDone is not None:
+            onDone(j)
+    if len(todo) < len(jobs):
+        print(
+            "Resuming: %s of %s jobs already complete in %s"
+            % (len(jobs) - len(todo), len(jobs), scratch),
+            file=sys.stderr,
+        )
+    if metrics is not None:
+        metrics.count("lastzJobs", len(todo))
+        metrics.count("jobsSkipped", len(jobs) - len(todo))
+    schedule = plan_jobs([jobs[j] for j in todo], threads=threads)
+    batches = [
+        Batch([todo[j] for j in batch.jobs], batch.cost) for batch in schedule.batches
+    ]
+    tracker = Progress(jobs, todo) if progress else None
+    seqs = ScratchSeqs(scratch, [jobs[j] for j in todo])
+    failed = list()
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as pool:
+        futures = [
+            pool.submit(
+                _align_batch,
+                batch,
+                jobs,
+                jobouts,
+                retries,
+                tracker,
+                failed,
+                onDone,
+                metrics,
+                seqs,
+                lzpath,
+                minIdt,
+                minLen,
+                hspthresh,
+                cache,
+                verbose,
+                timeout,
+            )
+            for batch in batches
+        ]
+        for future in futures:
+            future.result()
+    if tracker is not None:
+        tracker.finish()
+    if metrics is not None:
+        metrics.count("jobsFailed", len(failed))
+    if failed:
+        raise Error(
+            "%s of %s alignment jobs failed:" % (len(failed), len(jobs)),
+            ", ".join(
+                "%s onto %s" % (seq_name(jobs[j][2]), seq_name(jobs[j][1]))
+                for j in sorted(failed)
+            ),
+        )
+
+
+def pair_rows(outputs):
+    """Read hits of one pair from its (job index, file) outputs. Hits from
+    several windows of a target are merged and re-sorted, with hits clipped
+    at window ends joined to their continuations."""
+    rows = list()
+    pieces = list()
+    for _, path in outputs:
+        with open(path) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if fields[0] == PIECE:
+                    pieces.append(fields[1:])
+                else:
+                    rows.append(fields)
+    if pieces:
+        stitch_hits(rows, pieces)
+    if len(outputs) > 1:
+        sort_hits(rows)
+    return rows
+
+
+def _merged_rows(out, byPair, count, pairIds=None):
+    """Yield hits of pairs 0..count-1 in pair order from their job outputs,
+    writing each hit to out as it is yielded."""
+    for i in range(count):
+        if pairIds is not None:
+            out.write("##pair %s\n" % pairIds[i])
+        for row in pair_rows(byPair[i]):
+            out.write("\t".join(row) + "\n")
+            yield row
+
+
+def run_pairs(
+    lzpath="lastz",
+    pairs=None,
+    minIdt=60,
+    minLen=100,
+    hspthresh=3000,
+    outfile=None,
+    threads=1,
+    cache=None,
+    verbose=False,
+    window=None,
+    overlap=100000,
+    batchSize=None,
+    workdir=None,
+    timeout=None,
+    retries=0,
+    progress=False,
+    pairIds=None,
+    comment=None,
+    tmpdir=None,
+    metrics=None,
+    binfile=None,
+):
+    """Align each target:query pair as an independent job in a pool of threads.
+    Each job writes its filtered hits to a separate file. Job outputs are then
+    merged into outfile in pair order, giving the same result as a serial run.
+    If cache is an AlignmentCache, raw LASTZ output is reused for unchanged pairs.
+    Pairs may be given as paths to single sequence fasta files, or as SeqRefs
+    into indexed multifasta genomes.
+    If window is set, targets longer than window are aligned as overlapping
+    windows and hits are lifted back to scaffold coordinates.
+    Jobs are dispatched longest first, with small jobs packed into batches, so
+    that a large pair does not start last (see plan_jobs).
+    If batchSize is set, queries shorter than batchSize are aligned to each
+    target in multi-sequence batches of up to batchSize bases.
+    LASTZ runs longer than timeout seconds are killed, and failed jobs are
+    retried up to retries times. A failed job does not stop other jobs. Job
+    outputs are kept in workdir (default: a new scratch directory in tmpdir,
+    or the system temporary directory), and jobs with complete outputs in workdir are not run again, so
+    an interrupted run can be resumed. If progress is set, jobs done,
+    throughput and ETA are reported to stderr.
+    If pairIds is given, the hits of each pair are preceded by a '##pair id'
+    line, and comment is written as a '##' line after the header. This is the
+    shard format read by merge_shards.
+    If binfile is set, merged hits are also saved there as a binary HitTable,
+    built from the job outputs as they are merged.
+    If metrics is a Metrics object, the alignment and merge stages are timed
+    and each job is recorded."""
+    if workdir:
+        scratch = os.path.abspath(workdir)
+        os.makedirs(scratch, exist_ok=True)
+    else:
+        scratch = _scratch(tmpdir)
+    try:
+        jobs, jobouts, byPair = _make_jobs(
+            pairs,
+            scratch,
+            lzpath,
+            minIdt,
+            minLen,
+            hspthresh,
+            window,
+            overlap,
+            batchSize,
+        )
+        with timed(metrics, "align"):
+            _run_jobs(
+                jobs,
+                jobouts,
+                scratch,
+                lzpath,
+                minIdt,
+                minLen,
+                hspthresh,
+                threads,
+                cache,
+                verbose,
+                timeout,
+                retries,
+                progress,
+                metrics=metrics,
+            )
+    except BaseException:
+        print(
+            "Completed alignments are kept in %s. Re-run with --workdir %s to resume."
+            % (scratch, scratch),
+            file=sys.stderr,
+        )
+        raise
+    # Merge job outputs in pair order
+    with timed(metrics, "merge"):
+        with open(outfile, "w") as out:
+            out.write(HEADER)
+            if comment:
+                out.write("##" + comment + "\n")
+            if binfile:
+                rows = _merged_rows(out, byPair, len(pairs), pairIds)
+                readHitTable(rows, minID=0).save(binfile)
+            else:
+                for i in range(len(pairs)):
+                    if pairIds is not None:
+                        out.write("##pair %s\n" % pairIds[i])
+                    if len(byPair[i]) == 1:
+                        with open(byPair[i][0][1]) as f:
+                            shutil.copyfileobj(f, out)
+                        continue
+                    for row in pair_rows(byPair[i]):
+                        out.write("\t".join(row) + "\n")
+    if not workdir:
+        shutil.rmtree(scratch)
+    # Trim cache to size limit
+    if cache is not None:
+        cache.evict()
+
+
+def align(
+    pairs,
+    lzpath="lastz",
+    minIdt=60,
+    minLen=100,
+    hspthresh=3000,
+    threads=1,
+    cache=None,
+    window=None,
+    overlap=100000,
+    batchSize=None,
+    timeout=None,
+    retries=0,
+    tmpdir=None,
+    verbose=False,
+):
+    """Align target:query pairs and yield hits as lists of result table fields
+    (name1,strand1,start1,end1,name2,strand2,start2+,end2+,score,identity),
+    in the same order as the table written by run_pairs.
+    Scratch files are kept in a new directory within tmpdir (default: the
+    system temporary directory), addressed by absolute path, and removed once
+    all hits have been read or the iterator is closed. The working directory is never changed, so align may be
+    called from several threads. Hits can be loaded for getHitPairs with
+    readHitTable(align(pairs))."""
+    scratch = _scratch(tmpdir)
+    try:
+        jobs, jobouts, byPair = _make_jobs(
+            pairs,
+            scratch,
+            lzpath,
+            minIdt,
+            minLen,
+            hspthresh,
+            window,
+            overlap,
+            batchSize,
+        )
+        _run_jobs(
+            jobs,
+            jobouts,
+            scratch,
+            lzpath,
+            minIdt,
+            minLen,
+            hspthresh,
+            threads,
+            cache,
+            verbose,
+            timeout,
+            retries,
+            False,
+        )
+        for i in range(len(pairs)):
+            for row in pair_rows(byPair[i]):
+                yield row
+    finally:
+        shutil.rmtree(scratch)
+    if cache is not None:
+        cache.evict()
 
 
 def _write_script(cmds, script):
@@ -110,12 +1134,14 @@ def _write_script(cmds, script):
     f.close()
 
 
-def syscall(cmd, verbose=False):
+def syscall(cmd, verbose=False, cwd=None):
     """Manage error handling when making syscalls"""
     if verbose:
         print("Running command:", cmd, flush=True)
     try:
-        output = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
+        output = subprocess.check_output(
+            cmd, shell=True, stderr=subprocess.STDOUT, cwd=cwd
+        )
     except subprocess.CalledProcessError as error:
         print(
             "The following command failed with exit code",
@@ -130,13 +1156,14 @@ def syscall(cmd, verbose=False):
         print(decode(output))
 
 
-def run_cmd(cmds, verbose=False):
-    """Write and excute script"""
-    tmpdir = tempfile.mkdtemp(prefix="tmp.", dir=os.getcwd())
-    original_dir = os.getcwd()
-    os.chdir(tmpdir)
-    script = "run_jobs.sh"
-    _write_script(cmds, script)
-    syscall("bash " + script, verbose=verbose)
-    os.chdir(original_dir)
-    shutil.rmtree(tmpdir)
+def run_cmd(cmds, verbose=False, tmpdir=None):
+    """Write and excute script in a scratch directory created within tmpdir
+    (default: the system temporary directory). The working directory of the
+    caller is not changed."""
+    scratch = _scratch(tmpdir)
+    try:
+        script = os.path.join(scratch, "run_jobs.sh")
+        _write_script(cmds, script)
+        syscall("bash " + quote(script), verbose=verbose, cwd=scratch)
+    finally:
+        shutil.rmtree(scratch)
@@ -1,69 +1,193 @@
-from collections import namedtuple
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import copy
+
+import numpy as np
 
 from .LASTZ_wrapper import *
+from .binfmt import is_binary
+from .cache import AlignmentCache
+from .faidx import LINE_WIDTH, FastaIndex, SeqRef, buildFai, seq_name
+from .findstate import FindState, bucketDigest, pairParams
+from .gffindex import CandidateIndex, Feature, buildIndex, parseRegion
+from .hittable import (
+    STRAND_CODE,
+    STRANDS,
+    HitTable,
+    _isPath,
+    bucketPairs,
+    hitTup,
+    iterLASTZChunks,
+    readHitTable,
+)
+from .metrics import Metrics, profiled, profiledCall, timed
+from .schedule import PACK_SIZE, format_schedule, job_cost, plan_jobs
+from .shard import merge_shards, pairs_digest, parse_shard, shard_comment, shard_pairs
+from .sketch import SketchIndex, kmerHashes, prefilterPairs, sketch, writePairs
 
 
-def readLASTZ(infile, minID=90):
+def readLASTZ(infile, minID=90, metrics=None):
     """Read in LASTZ result file from LASTZ_genome_align.sh
-    Populate nested dictionary of hits keyed by Target and then Query scaffold names."""
-    with open(infile) as f:
-        content = f.readlines()
-    content = [x.strip().split() for x in content]
+    Populate nested dictionary of hits keyed by Target and then Query scaffold names.
+    The file is parsed in blocks, see iterLASTZChunks.
+    Binary alignment files, or rows yielded by align, are also accepted."""
+    if _isPath(infile) and is_binary(infile):
+        return readHitTable(infile, minID=minID, metrics=metrics).toDict()
     hitsDict = dict()
-    # Set named tuple format
-    hitTup = namedtuple(
-        "Elem",
-        [
-            "t_start",
-            "t_end",
-            "t_strand",
-            "q_start",
-            "q_end",
-            "q_strand",
-            "idPct",
-            "UID",
-        ],
-    )
-    counter = 0
-    # Read in split rows
-    for row in content:
-        # Ignore lines begining with '#'
-        if row[0][0] == "#":
-            continue
-        # Count if hit identity exceeds threshold
-        elif float(row[9]) >= minID:
-            counter += 1
-            UID = counter
-            t_name = str(row[0])
-            t_strand = str(row[1])
-            t_start = int(row[2]) - 1  # Convert from idx '1' to idx '0'
-            t_end = int(row[3]) - 1  # Convert from idx '1' to idx '0'
-            q_name = str(row[4])
-            q_strand = str(row[5])
-            idPct = float(row[9])
-            # Check that start position < end position
-            if int(row[6]) < int(row[7]):
-                q_start = int(row[6]) - 1  # Convert from idx '1' to idx '0'
-                q_end = int(row[7]) - 1  # Convert from idx '1' to idx '0'
-            # Correct for inverted coordinates
-            else:
-                print("Inverting query sequence coordinates for record number: ", UID)
-                q_end = int(row[6]) - 1  # Convert from idx '1' to idx '0'
-                q_start = int(row[7]) - 1  # Convert from idx '1' to idx '0'
+    for t_names, q_names, cols in iterLASTZChunks(infile, minID=minID, metrics=metrics):
+        # Build named tuples from block columns
+        rows = zip(*[cols[c].tolist() for c in HitTable.columns])
+        for t_name, q_name, row in zip(t_names, q_names, rows):
+            t_start, t_end, t_strand, q_start, q_end, q_strand, idPct, UID = row
             # Create target scaffold dict if not seen
-            if t_name not in hitsDict.keys():
+            if t_name not in hitsDict:
                 hitsDict[t_name] = dict()
             # Create query scaffold list if not seen
-            if q_name not in hitsDict[t_name].keys():
+            if q_name not in hitsDict[t_name]:
                 hitsDict[t_name][q_name] = list()
             # Write record to target:query list as named tuple
             hitsDict[t_name][q_name].append(
-                hitTup(t_start, t_end, t_strand, q_start, q_end, q_strand, idPct, UID)
+                hitTup(
+                    t_start,
+                    t_end,
+                    STRANDS[t_strand],
+                    q_start,
+                    q_end,
+                    STRANDS[q_strand],
+                    idPct,
+                    UID,
+                )
             )
     return hitsDict
 
 
-def getHitPairs(hits, args):
+def _isHitPair(hit, mate, args):
+    """Return True if mate lies downstream of hit in the target and the pair
+    satisfies the identity, query gap and TSD overlap filters."""
+    if (
+        mate.UID != hit.UID
+        and mate.q_strand == hit.q_strand
+        and abs(mate.idPct - hit.idPct) <= args.maxIdentDiff
+        and mate.t_start - hit.t_end >= args.minInsert
+        and mate.t_start - hit.t_end <= args.maxInsert
+    ):
+        if (
+            hit.q_strand == "+"
+            and mate.q_start - hit.q_end <= args.qGap
+            and mate.q_start - hit.q_end >= 0 - args.maxTSD
+        ):
+            return True
+        elif (
+            hit.q_strand == "-"
+            and hit.q_start - mate.q_end <= args.qGap
+            and hit.q_start - mate.q_end >= 0 - args.maxTSD
+        ):
+            return True
+    return False
+
+
+def getHitPairsNaive(hits, args):
+    """Original all-vs-all pairing search. Compares every hit against every other
+    hit in each Target:Query bucket. Retained for validating getHitPairs output."""
+    valid_elem = []
+    for t_name in hits.keys():
+        for q_name in hits[t_name].keys():
+            for hit in hits[t_name][q_name]:
+                for mate in hits[t_name][q_name]:
+                    if _isHitPair(hit, mate, args):
+                        valid_elem.append(((t_name, q_name), hit, mate))
+    return valid_elem
+
+
+def _sweepBucket(bucket, args):
+    """Yield (hit, mate) index pairs from a single Target:Query list of hits.
+    Hits are indexed by t_start so that only mates starting within
+    [hit.t_end + minInsert, hit.t_end + maxInsert] are tested. Candidate mates
+    are visited in their original list order, so pairs are yielded in the
+    same order as the all-vs-all search."""
+    order = sorted(range(len(bucket)), key=lambda i: bucket[i].t_start)
+    starts = [bucket[i].t_start for i in order]
+    for h, hit in enumerate(bucket):
+        lo = bisect_left(starts, hit.t_end + args.minInsert)
+        hi = bisect_right(starts, hit.t_end + args.maxInsert)
+        if lo >= hi:
+            continue
+        for i in sorted(order[lo:hi]):
+            if _isHitPair(hit, bucket[i], args):
+                yield h, i
+
+
+def _bucketIndexPairs(bucket, args):
+    """Return arrays of (hit, mate) indices for one Target:Query bucket, given
+    either as a single bucket HitTable or as a list of hit tuples."""
+    if isinstance(bucket, HitTable):
+        return bucketPairs(bucket, 0, len(bucket), args)
+    # Rebuild named tuples if bucket was sent to a worker as plain tuples
+    bucket = [hitTup(*hit) for hit in bucket]
+    pairs = list(_sweepBucket(bucket, args))
+    hit_idx = np.array([h for h, m in pairs], dtype=np.int64)
+    mate_idx = np.array([m for h, m in pairs], dtype=np.int64)
+    return hit_idx, mate_idx
+
+
+def _mapBuckets(buckets, args, threads=1):
+    """Pair hits in each bucket. If threads > 1 buckets are shared across a pool
+    of processes, largest first. Results are returned in bucket order."""
+    if threads <= 1:
+        return [_bucketIndexPairs(bucket, args) for bucket in buckets]
+    results = [None] * len(buckets)
+    order = sorted(range(len(buckets)), key=lambda i: len(buckets[i]), reverse=True)
+    with ProcessPoolExecutor(max_workers=threads) as pool:
+        futures = dict()
+        for i in order:
+            bucket = buckets[i]
+            if not isinstance(bucket, HitTable):
+                bucket = [tuple(hit) for hit in bucket]
+            futures[pool.submit(_bucketIndexPairs, bucket, args)] = i
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
+
+def _bucketCandidates(bucket, args):
+    """Number of hit:mate comparisons made by the sort-and-sweep search of one
+    bucket, i.e. mates starting within the insert size range of each hit."""
+    if isinstance(bucket, HitTable):
+        t_start, t_end = bucket.t_start, bucket.t_end
+    else:
+        t_start = np.array([hit.t_start for hit in bucket], dtype=np.int64)
+        t_end = np.array([hit.t_end for hit in bucket], dtype=np.int64)
+    starts = np.sort(t_start)
+    lo = np.searchsorted(starts, t_end + args.minInsert, side="left")
+    hi = np.searchsorted(starts, t_end + args.maxInsert, side="right")
+    return int(np.maximum(hi - lo, 0).sum())
+
+
+def _statePairs(keys, buckets, args, state, threads=1, metrics=None):
+    """Pair hits in each bucket, reusing results saved in state for buckets
+    whose hits and pairing settings are unchanged. Results for all buckets
+    are then saved to state. Returns results in bucket order."""
+    params = pairParams(args)
+    saved = state.load(params)
+    digests = [bucketDigest(bucket) for bucket in buckets]
+    results = [None] * len(buckets)
+    changed = list()
+    for i, (key, digest) in enumerate(zip(keys, digests)):
+        if key in saved and saved[key][0] == digest:
+            results[i] = saved[key][1:]
+        else:
+            changed.append(i)
+    paired = _mapBuckets([buckets[i] for i in changed], args, threads=threads)
+    for i, result in zip(changed, paired):
+        results[i] = result
+    state.save(params, keys, digests, results)
+    if metrics is not None:
+        metrics.count("bucketsReused", len(buckets) - len(changed))
+        metrics.count("bucketsPaired", len(changed))
+    return results
+
+
+def getHitPairs(hits, args, naive=False, threads=1, metrics=None, state=None):
     """Given a nested dictionary keyed by Target scaffold name, then Query scaffold name,
     where Query scaffold sub-dict contains a list of hits stored as named tuples
     i.e. (t_start,t_end,t_strand,q_start,q_end,q_strand,idPct,UID)
@@ -73,35 +197,173 @@ def getHitPairs(hits, args):
     hit=hitTup(t_start,t_end,t_strand,q_start,q_end,q_strand,idPct,UID),
     mate=hitTup(t_start,t_end,t_strand,q_start,q_end,q_strand,idPct,UID)
     )
-    - that is a tuple containg three tuples."""
+    - that is a tuple containg three tuples.
+    Candidate mates are found with a sort-and-sweep over target coordinates.
+    Hits may also be given as a columnar HitTable.
+    If threads > 1, Target:Query buckets are processed in parallel. Pairs are
+    returned in the same order as a serial run.
+    If naive is set, use the original all-vs-all search instead.
+    If metrics is given, hit:mate comparisons made and pairs accepted are counted.
+    Comparisons are counted as pairsCompared for the naive search, every hit
+    against every hit in its bucket, and as pairsExamined for sort-and-sweep,
+    mates starting within the insert size range of each hit.
+    If state (a FindState) is given, only buckets whose hits or pairing settings
+    changed since the last run saved to it are searched."""
+    if naive:
+        if isinstance(hits, HitTable):
+            hits = hits.toDict()
+        valid_elem = getHitPairsNaive(hits, args)
+        if metrics is not None:
+            metrics.count(
+                "pairsCompared",
+                sum(len(b) ** 2 for t_name in hits for b in hits[t_name].values()),
+            )
+            metrics.count("pairsAccepted", len(valid_elem))
+        return valid_elem
+    if isinstance(hits, HitTable):
+        keys = list()
+        buckets = list()
+        for t_name, q_name, start, stop in hits.iterBuckets():
+            keys.append((t_name, q_name))
+            buckets.append(hits.bucket(start, stop))
+    else:
+        keys = [(t_name, q_name) for t_name in hits for q_name in hits[t_name]]
+        buckets = [hits[t_name][q_name] for t_name, q_name in keys]
     valid_elem = []
-    for t_name in hits.keys():
-        for q_name in hits[t_name].keys():
-            for hit in hits[t_name][q_name]:
-                for mate in hits[t_name][q_name]:
-                    if (
-                        mate.UID != hit.UID
-                        and mate.q_strand == hit.q_strand
-                        and abs(mate.idPct - hit.idPct) <= args.maxIdentDiff
-                        and mate.t_start - hit.t_end >= args.minInsert
-                        and mate.t_start - hit.t_end <= args.maxInsert
-                    ):
-                        if (
-                            hit.q_strand == "+"
-                            and mate.q_start - hit.q_end <= args.qGap
-                            and mate.q_start - hit.q_end >= 0 - args.maxTSD
-                        ):
-                            valid_elem.append(((t_name, q_name), hit, mate))
-                        elif (
-                            hit.q_strand == "-"
-                            and hit.q_start - mate.q_end <= args.qGap
-                            and hit.q_start - mate.q_end >= 0 - args.maxTSD
-                        ):
-                            valid_elem.append(((t_name, q_name), hit, mate))
+    if state is not None:
+        results = _statePairs(keys, buckets, args, state, threads, metrics)
+    else:
+        results = _mapBuckets(buckets, args, threads=threads)
+    for key, bucket, (hit_idx, mate_idx) in zip(keys, buckets, results):
+        if isinstance(bucket, HitTable):
+            getHit = bucket.hit
+        else:
+            getHit = bucket.__getitem__
+        for h, m in zip(hit_idx.tolist(), mate_idx.tolist()):
+            valid_elem.append((key, getHit(h), getHit(m)))
+    if metrics is not None:
+        metrics.count(
+            "pairsExamined", sum(_bucketCandidates(bucket, args) for bucket in buckets)
+        )
+        metrics.count("pairsAccepted", len(valid_elem))
     return valid_elem
 
 
-def formatGFFline(pair, featureID):
+# Filter settings that can be varied in a parameter sweep
+SWEEP_PARAMS = ("minIdent", "maxIdentDiff", "minInsert", "maxInsert", "qGap", "maxTSD")
+
+
+def loosestSettings(points):
+    """Return a copy of the first settings in points, with each sweep parameter
+    set to its least strict value across all points."""
+    loose = copy.copy(points[0])
+    loose.minIdent = min(p.minIdent for p in points)
+    loose.maxIdentDiff = max(p.maxIdentDiff for p in points)
+    loose.minInsert = min(p.minInsert for p in points)
+    loose.maxInsert = max(p.maxInsert for p in points)
+    loose.qGap = max(p.qGap for p in points)
+    loose.maxTSD = max(p.maxTSD for p in points)
+    return loose
+
+
+def _bucketRank(table, minID):
+    """Rank buckets in the order readLASTZ would create them if only hits with
+    identity >= minID were read. Buckets with no such hits are ranked last."""
+    nohit = np.iinfo(np.int64).max
+    uid = np.where(table.idPct >= minID, table.UID, nohit)
+    starts = table.buckets[:, 2]
+    b_first = np.full(len(starts), nohit, dtype=np.int64)
+    filled = starts < table.buckets[:, 3]
+    b_first[filled] = np.minimum.reduceat(uid, starts[filled])
+    # First appearance of each target scaffold
+    t_first = np.full(len(table.names), nohit, dtype=np.int64)
+    np.minimum.at(t_first, table.buckets[:, 0], b_first)
+    order = np.lexsort((b_first, t_first[table.buckets[:, 0]]))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    return rank
+
+
+def _sweepSelect(table, points, threads=1):
+    """Enumerate candidate pairs in a HitTable once under the loosest settings,
+    then yield (point, bucket, hit, mate, gap) for each settings point.
+    bucket, hit and mate are arrays of bucket numbers and table row indices for
+    pairs passing the point filters, in the order getHitPairs would report them.
+    gap is the distance between flanks in the query, negative where flanks
+    overlap as a TSD."""
+    loose = loosestSettings(points)
+    buckets = [table.bucket(start, stop) for _, _, start, stop in table.iterBuckets()]
+    results = _mapBuckets(buckets, loose, threads=threads)
+    starts = table.buckets[:, 2]
+    b = np.concatenate(
+        [np.full(len(h), i, dtype=np.int64) for i, (h, m) in enumerate(results)]
+        + [np.zeros(0, dtype=np.int64)]
+    )
+    h = np.concatenate(
+        [h + starts[i] for i, (h, m) in enumerate(results)]
+        + [np.zeros(0, dtype=np.int64)]
+    )
+    m = np.concatenate(
+        [m + starts[i] for i, (h, m) in enumerate(results)]
+        + [np.zeros(0, dtype=np.int64)]
+    )
+    # Pair attributes tested by the filters
+    hitID = table.idPct[h]
+    mateID = table.idPct[m]
+    insert = table.t_start[m] - table.t_end[h]
+    plus = table.q_strand[h] == STRAND_CODE["+"]
+    gap = np.where(
+        plus, table.q_start[m] - table.q_end[h], table.q_start[h] - table.q_end[m]
+    )
+    ranks = dict()
+    for p in points:
+        keep = (
+            (hitID >= p.minIdent)
+            & (mateID >= p.minIdent)
+            & (np.abs(mateID - hitID) <= p.maxIdentDiff)
+            & (insert >= p.minInsert)
+            & (insert <= p.maxInsert)
+            & (gap <= p.qGap)
+            & (gap >= 0 - p.maxTSD)
+        )
+        sel = np.flatnonzero(keep)
+        # Bucket order depends on which hits pass minIdent
+        if p.minIdent not in ranks:
+            ranks[p.minIdent] = _bucketRank(table, p.minIdent)
+        sel = sel[np.argsort(ranks[p.minIdent][b[sel]], kind="stable")]
+        yield p, b[sel], h[sel], m[sel], gap[sel]
+
+
+def sweepCounts(table, points, threads=1):
+    """Count candidate insertions, and candidates with a TSD, for each settings
+    point in a single pass over a HitTable. The table must have been read with
+    minID no greater than the lowest minIdent in points.
+    Returns a list of (point, candidates, TSDs)."""
+    return [
+        (p, len(sel_h), int((gap < 0).sum()))
+        for p, _, sel_h, _, gap in _sweepSelect(table, points, threads=threads)
+    ]
+
+
+def sweepHitPairs(table, points, threads=1):
+    """Evaluate several settings points in a single pass over a HitTable.
+    The table must have been read with minID no greater than the lowest minIdent
+    in points. Yields (point, validPairs) where validPairs matches the output of
+    getHitPairs for that point."""
+    keys = [(t_name, q_name) for t_name, q_name, _, _ in table.iterBuckets()]
+    for p, b, h, m, _ in _sweepSelect(table, points, threads=threads):
+        yield (
+            p,
+            [
+                (keys[i], table.hit(j), table.hit(k))
+                for i, j, k in zip(b.tolist(), h.tolist(), m.tolist())
+            ],
+        )
+
+
+def formatGFFline(pair, featureID, extra=None):
+    """GFF line for the insert of pair. extra is an optional dict of
+    attributes added after the flank identities."""
     seqid = str(pair[0][0])
     source = "InsertScanner"
     feature_type = "Candidate_Insertion"
@@ -145,6 +407,7 @@ def formatGFFline(pair, featureID):
         + str(pair[1].idPct)
         + ";rightID="
         + str(pair[2].idPct)
+        + "".join(";%s=%s" % (k, v) for k, v in (extra or dict()).items())
         + "\n"
     )
     return "\t".join(
@@ -162,13 +425,31 @@ def formatGFFline(pair, featureID):
     )
 
 
-def getTSD(pair, parentID):
+def getTSDlen(pair):
+    """Length of overlap between flanking hits in the query, or None if
+    flanks do not overlap."""
     TSDlen = None
     if pair[1].q_strand == "+" and pair[1].q_end > pair[2].q_start:
         TSDlen = pair[1].q_end - pair[2].q_start
     elif pair[1].q_strand == "-" and pair[1].q_start < pair[2].q_end:
         TSDlen = pair[2].q_end - pair[1].q_start
+    return TSDlen
+
+
+def getTSD(pair, parentID, genome=None):
+    """Yield GFF lines for the TSD copies of pair, if flanks overlap in the query.
+    If genome (a FastaIndex of the target genome) is given, the identity of
+    the two copies is reported as TSDid."""
+    TSDlen = getTSDlen(pair)
     if TSDlen:
+        extra = ""
+        if genome is not None:
+            seqL, seqR = [
+                genome.fetch(str(pair[0][0]), start, end)
+                for label, start, end in candidateRegions(pair)
+                if label.startswith("_TSD")
+            ]
+            extra = ";TSDid=" + str(tsdIdentity(seqL, seqR))
         TSDr_start = pair[2].t_start
         TSDr_end = pair[2].t_start + TSDlen
         TSDl_start = pair[1].t_end - TSDlen
@@ -185,6 +466,7 @@ def getTSD(pair, parentID):
             + str(parentID)
             + ";len="
             + str(TSDlen)
+            + extra
             + "\n"
         )
         attributesL = (
@@ -195,6 +477,7 @@ def getTSD(pair, parentID):
             + str(parentID)
             + ";len="
             + str(TSDlen)
+            + extra
             + "\n"
         )
         # Yield left
@@ -324,18 +607,162 @@ def getFlank(pair, parentID):
     )
 
 
-def writeGFFlines(validPairs, reportFlanks=True):
-    yield "#gff-version 3\n#seqid\tsource\ttype\tstart\tend\tscore\tstrand\tphase\tattributes\n"
-    counter = 0
-    fillLen = len(str(abs(len(validPairs)))) + 1
-    for pair in validPairs:
-        counter += 1
-        featureID = "IS_" + str(counter).zfill(fillLen)
-        yield formatGFFline(pair, featureID)
-        TSDlines = getTSD(pair, featureID)
+def featureIDs(count, fillLen=None, start=0):
+    """GFF feature IDs for count candidates, numbered from start + 1 and
+    zero-padded to fillLen digits (default: one more than needed for count)."""
+    if fillLen is None:
+        fillLen = len(str(abs(count))) + 1
+    return ["IS_" + str(n).zfill(fillLen) for n in range(start + 1, start + count + 1)]
+
+
+def writeGFFlines(
+    validPairs,
+    reportFlanks=True,
+    fillLen=None,
+    start=0,
+    header=True,
+    genome=None,
+    attributes=None,
+):
+    """Yield GFF lines for validPairs. Features are numbered from start + 1,
+    zero-padded to fillLen digits (default: one more than needed for the
+    number of pairs). If genome is given, TSD identity is reported.
+    attributes is an optional list of dicts, one per pair, of extra insert
+    attributes, e.g. from clusterPairs."""
+    if header:
+        yield "#gff-version 3\n#seqid\tsource\ttype\tstart\tend\tscore\tstrand\tphase\tattributes\n"
+    if attributes is None:
+        attributes = [None] * len(validPairs)
+    for pair, featureID, extra in zip(
+        validPairs, featureIDs(len(validPairs), fillLen, start), attributes
+    ):
+        yield formatGFFline(pair, featureID, extra)
+        TSDlines = getTSD(pair, featureID, genome)
         if TSDlines:
             for x in TSDlines:
                 yield x
         if reportFlanks:
             for y in getFlank(pair, featureID):
                 yield y
+
+
+def clusterPairs(validPairs):
+    """Merge candidates on the same target whose insert intervals overlap.
+    Candidates are sorted by target and insert start, and a cluster is closed
+    when the next insert starts after the furthest end seen so far.
+    Each cluster is represented by the member with the highest mean flank
+    identity (the first listed, if tied). Returns (representatives, attributes),
+    ordered by the first member of each cluster in validPairs, where attributes
+    lists for each cluster its number of members and the best left and right
+    flank identities of any member."""
+    n = len(validPairs)
+    if not n:
+        return list(), list()
+    codes = dict()
+    t_code = np.array(
+        [codes.setdefault(str(pair[0][0]), len(codes)) for pair in validPairs],
+        dtype=np.int64,
+    )
+    # Insert intervals as written to GFF
+    a = np.array([pair[1].t_end + 1 for pair in validPairs], dtype=np.int64)
+    b = np.array([pair[2].t_start - 1 for pair in validPairs], dtype=np.int64)
+    lo, hi = np.minimum(a, b), np.maximum(a, b)
+    leftID = np.array([pair[1].idPct for pair in validPairs], dtype=np.float64)
+    rightID = np.array([pair[2].idPct for pair in validPairs], dtype=np.float64)
+    idx = np.arange(n)
+    order = np.lexsort((idx, lo, t_code))
+    t_code, lo, hi = t_code[order], lo[order], hi[order]
+    # Furthest end of earlier inserts on the same target. Targets are offset
+    # so that the running maximum does not carry over between them.
+    span = int(hi.max() - min(int(lo.min()), 0)) + 2
+    reach = np.maximum.accumulate(hi + t_code * span) - t_code * span
+    newCluster = np.ones(n, dtype=bool)
+    newCluster[1:] = (t_code[1:] != t_code[:-1]) | (lo[1:] > reach[:-1])
+    firsts = np.flatnonzero(newCluster)
+    cluster = np.cumsum(newCluster) - 1
+    # Representative: highest mean flank identity, then earliest in validPairs
+    score = (leftID + rightID)[order]
+    best = np.lexsort((order, -score, cluster))
+    reps = order[best[np.searchsorted(cluster[best], np.arange(len(firsts)))]]
+    members = np.diff(np.append(firsts, n))
+    bestLeft = np.maximum.reduceat(leftID[order], firsts)
+    bestRight = np.maximum.reduceat(rightID[order], firsts)
+    first = np.minimum.reduceat(order, firsts)
+    representatives = list()
+    attributes = list()
+    for c in np.argsort(first, kind="stable").tolist():
+        representatives.append(validPairs[int(reps[c])])
+        attributes.append(
+            {
+                "members": int(members[c]),
+                "bestLeftID": float(bestLeft[c]),
+                "bestRightID": float(bestRight[c]),
+            }
+        )
+    return representatives, attributes
+
+
+def candidateRegions(pair):
+    """Target regions of a candidate as (label, start, end) (idx '0', end
+    exclusive): the insert body, both flanks, and both TSD copies if the
+    flanks overlap in the query. Hit coordinates are idx '0' with inclusive
+    ends, as read by readHitTable and readLASTZ."""
+    left, right = pair[1], pair[2]
+    regions = [
+        ("", left.t_end + 1, right.t_start),
+        ("_Flank_L", left.t_start, left.t_end + 1),
+        ("_Flank_R", right.t_start, right.t_end + 1),
+    ]
+    TSDlen = getTSDlen(pair)
+    if TSDlen:
+        # Flanks overlap by TSDlen + 1 bases in the query
+        regions.append(("_TSD_L", left.t_end - TSDlen, left.t_end + 1))
+        regions.append(("_TSD_R", right.t_start, right.t_start + TSDlen + 1))
+    return regions
+
+
+def tsdIdentity(seqL, seqR):
+    """Percent identity of two TSD copies of equal length, ignoring case."""
+    if not seqL or len(seqL) != len(seqR):
+        return None
+    a = np.frombuffer(seqL.upper(), dtype=np.uint8)
+    b = np.frombuffer(seqR.upper(), dtype=np.uint8)
+    return round(100.0 * int(np.count_nonzero(a == b)) / len(a), 1)
+
+
+def writeCandidateSeqs(validPairs, genome, outfile, fillLen=None, start=0):
+    """Write insert, flank and TSD sequences of validPairs to outfile as fasta,
+    read from genome (a FastaIndex of the target genome). Records are named
+    by GFF feature ID. Candidates are extracted in genome order, so the
+    memory-mapped genome is read front to back and never loaded whole.
+    Returns number of records written."""
+    IDs = featureIDs(len(validPairs), fillLen, start)
+    for pair in validPairs:
+        seqid = str(pair[0][0])
+        if seqid not in genome:
+            raise Error("Target sequence not found in genome: %s" % seqid)
+        if pair[2].t_end >= genome.length(seqid):
+            raise Error(
+                "Candidate extends past end of target sequence %s, check that "
+                "--genome is the aligned target genome." % seqid
+            )
+    rank = {name: i for i, name in enumerate(genome.names)}
+    order = sorted(
+        range(len(validPairs)),
+        key=lambda i: (rank[str(validPairs[i][0][0])], validPairs[i][1].t_start),
+    )
+    records = 0
+    with open(outfile, "wb") as f:
+        for i in order:
+            seqid = str(validPairs[i][0][0])
+            for label, rstart, rend in candidateRegions(validPairs[i]):
+                seq = genome.fetch(seqid, rstart, rend)
+                f.write(
+                    (
+                        ">%s%s %s:%s-%s\n" % (IDs[i], label, seqid, rstart + 1, rend)
+                    ).encode()
+                )
+                for n in range(0, len(seq), LINE_WIDTH):
+                    f.write(seq[n : n + LINE_WIDTH] + b"\n")
+                records += 1
+    return records
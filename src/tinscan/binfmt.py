@@ -0,0 +1,76 @@
+import json
+import struct
+
+import numpy as np
+
+# File signature for tinscan binary column files
+MAGIC = b"TINSCAN\x01"
+
+# Column data is aligned to this many bytes
+ALIGN = 64
+
+
+def is_binary(path):
+    """Return True if path is a tinscan binary column file."""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _pad(n):
+    return (ALIGN - n % ALIGN) % ALIGN
+
+
+def write_columns(path, columns, meta=None):
+    """Write a dict of 1-D NumPy arrays to path as aligned, typed columns.
+    Layout: MAGIC, uint64 header length, JSON header, column data.
+    The header records dtype, length and byte offset of each column, plus any
+    JSON-serialisable meta data."""
+    names = list(columns)
+    arrays = [np.ascontiguousarray(columns[name]) for name in names]
+    # Header length depends on offsets, so size it with placeholder offsets first
+    entries = [
+        {"name": name, "dtype": a.dtype.str, "length": len(a), "offset": 0}
+        for name, a in zip(names, arrays)
+    ]
+    header = {"columns": entries, "meta": meta or {}}
+    size = len(json.dumps(header).encode()) + 32 * len(entries) + 64
+    offset = len(MAGIC) + 8 + size
+    offset += _pad(offset)
+    for entry, a in zip(entries, arrays):
+        entry["offset"] = offset
+        offset += a.nbytes + _pad(a.nbytes)
+    blob = json.dumps(header).encode()
+    blob += b" " * (size - len(blob))
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(blob)))
+        f.write(blob)
+        for entry, a in zip(entries, arrays):
+            f.write(b"\0" * (entry["offset"] - f.tell()))
+            f.write(a.tobytes())
+        f.write(b"\0" * _pad(f.tell()))
+
+
+def read_columns(path):
+    """Open a binary column file written by write_columns.
+    Returns (columns, meta), where columns is a dict of read-only arrays
+    memory-mapped from path. No column data is read until it is accessed."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a tinscan binary file: %s" % path)
+        (size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(size).decode())
+    columns = dict()
+    for entry in header["columns"]:
+        dtype = np.dtype(entry["dtype"])
+        if entry["length"] == 0:
+            columns[entry["name"]] = np.zeros(0, dtype=dtype)
+        else:
+            columns[entry["name"]] = np.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                offset=entry["offset"],
+                shape=(entry["length"],),
+            )
+    return columns, header["meta"]
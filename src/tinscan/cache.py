@@ -0,0 +1,170 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from .faidx import QueryBatch, SeqRef, TargetWindow
+
+# Size of blocks read when hashing sequence files
+HASH_BLOCK = 1 << 20
+
+
+def lastz_version(lzpath="lastz"):
+    """Return version string reported by LASTZ executable."""
+    try:
+        result = subprocess.run(
+            [lzpath, "--version"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+    except OSError:
+        return ""
+    return result.stdout.decode(errors="replace").strip()
+
+
+class AlignmentCache(object):
+    """Persistent, content-addressed store of raw LASTZ output.
+    Entries are keyed by a hash of the target and query sequences, the
+    LASTZ executable path and version, and the hspthresh setting. Post-alignment
+    filters (minIdt, minLen) are applied when an entry is read, so changing them
+    does not invalidate the cache.
+    Least recently used entries are evicted once the cache exceeds maxSize bytes."""
+
+    def __init__(self, path, maxSize=None):
+        self.path = os.path.abspath(path)
+        self.maxSize = maxSize
+        self._tmp = os.path.join(self.path, "tmp")
+        os.makedirs(self._tmp, exist_ok=True)
+        self._digests = dict()
+        self._versions = dict()
+        self._lock = threading.Lock()
+
+    def _fileDigest(self, path):
+        """Hash file contents. Digests are memoised by path, size and mtime."""
+        stat = os.stat(path)
+        memo = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if memo in self._digests:
+                return self._digests[memo]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        with self._lock:
+            self._digests[memo] = digest
+        return digest
+
+    def _recordDigest(self, ref):
+        """Hash the name and bases of a record in an indexed genome, read in
+        blocks through the index. Digests are memoised by genome path and
+        mtime, record name and .fai entry."""
+        stat = os.stat(ref.index.fasta)
+        entry = ref.index.entries[ref.name]
+        memo = (ref.index.fasta, stat.st_mtime_ns, ref.name, entry)
+        with self._lock:
+            if memo in self._digests:
+                return self._digests[memo]
+        h = hashlib.sha256()
+        h.update(b">" + ref.name.encode() + b"\n")
+        for pos in range(0, entry.length, HASH_BLOCK):
+            h.update(ref.index.fetch(ref.name, pos, pos + HASH_BLOCK))
+        digest = h.hexdigest()
+        with self._lock:
+            self._digests[memo] = digest
+        return digest
+
+    def _seqDigest(self, x):
+        """Identify sequence x by content. Fasta files are hashed whole.
+        Records of an indexed genome are hashed in place, so they need not
+        be copied out, and entries stay valid when other records of the
+        genome change."""
+        if isinstance(x, QueryBatch):
+            return "+".join(self._seqDigest(q) for q in x.queries)
+        if isinstance(x, TargetWindow):
+            return "%s[%s:%s]" % (self._seqDigest(x.ref), x.start, x.end)
+        if isinstance(x, SeqRef):
+            return self._recordDigest(x)
+        return self._fileDigest(x)
+
+    def _version(self, lzpath):
+        with self._lock:
+            if lzpath not in self._versions:
+                self._versions[lzpath] = lastz_version(lzpath)
+            return self._versions[lzpath]
+
+    def key(self, target, query, lzpath="lastz", hspthresh=3000):
+        """Compose cache key for aligning query onto target. Each may be a
+        fasta path, SeqRef, TargetWindow or QueryBatch."""
+        resolved = shutil.which(lzpath) or lzpath
+        h = hashlib.sha256()
+        for part in (
+            self._seqDigest(target),
+            self._seqDigest(query),
+            os.path.abspath(resolved),
+            self._version(lzpath),
+            str(hspthresh),
+        ):
+            h.update(part.encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def entry(self, key):
+        """Path to cache entry for key."""
+        return os.path.join(self.path, key[:2], key + ".lz")
+
+    def get(self, key):
+        """Return path to cached LASTZ output, or None if not cached.
+        Reading an entry marks it as recently used."""
+        path = self.entry(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def tempfile(self):
+        """Return a new scratch file within the cache directory, so that
+        completed output can be moved into place with an atomic rename."""
+        fd, path = tempfile.mkstemp(prefix="lastz.", suffix=".tmp", dir=self._tmp)
+        os.close(fd)
+        return path
+
+    def put(self, key, src):
+        """Move completed LASTZ output src into the cache. Returns entry path."""
+        path = self.entry(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src, path)
+        return path
+
+    def size(self):
+        """Total bytes held in cache entries."""
+        return sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        for root, dirs, files in os.walk(self.path):
+            if root == self._tmp:
+                continue
+            for name in files:
+                if name.endswith(".lz"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    yield path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        """Remove least recently used entries until cache is within maxSize.
+        Returns number of entries removed."""
+        if self.maxSize is None:
+            return 0
+        entries = sorted(self._entries(), key=lambda x: x[2])
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for path, size, _ in entries:
+            if total <= self.maxSize:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
@@ -0,0 +1,238 @@
+from collections import namedtuple
+import mmap
+import os
+import sys
+import threading
+
+# Reference to a single sequence within an indexed multifasta
+SeqRef = namedtuple("SeqRef", ["index", "name"])
+
+# Region of a target sequence aligned as a separate job. ref is a SeqRef,
+# start:end the aligned region and core_start:core_end the region for which
+# this window reports hits (idx '0', end exclusive).
+TargetWindow = namedtuple(
+    "TargetWindow", ["ref", "start", "end", "core_start", "core_end"]
+)
+
+# Small query sequences aligned together as one multi-sequence query file.
+# queries are SeqRefs or fasta paths, pairs the index of the pair each query
+# came from, and names the record names in each query.
+QueryBatch = namedtuple("QueryBatch", ["queries", "pairs", "names"])
+
+# Fields of a .fai index line
+FaiEntry = namedtuple("FaiEntry", ["length", "offset", "linebases", "linewidth"])
+
+# Size of blocks written when extracting sequences
+WRITE_BLOCK = 1 << 22
+
+# Line length of extracted sequences
+LINE_WIDTH = 60
+
+
+def buildFai(fasta, faipath=None, write=True):
+    """Scan fasta and write a samtools compatible .fai index.
+    Returns list of (name, FaiEntry) in file order. If write is False, the
+    index is returned without writing it."""
+    if faipath is None:
+        faipath = fasta + ".fai"
+    entries = list()
+    name = None
+    length = offset = linebases = linewidth = 0
+    short = False
+    pos = 0
+    with open(fasta, "rb") as f:
+        if f.read(2) == b"\x1f\x8b":
+            raise ValueError(
+                "Cannot index gzipped fasta, please decompress: %s" % fasta
+            )
+        f.seek(0)
+        for line in f:
+            if line.startswith(b">"):
+                if name is not None:
+                    entries.append(
+                        (name, FaiEntry(length, offset, linebases, linewidth))
+                    )
+                words = line[1:].split(None, 1)
+                name = words[0].decode() if words else ""
+                length = linebases = linewidth = 0
+                short = False
+                offset = pos + len(line)
+            elif name is not None:
+                bases = len(line.rstrip(b"\r\n"))
+                if bases:
+                    # All lines but the last must share the same length
+                    if short or (linebases and bases > linebases):
+                        raise ValueError(
+                            "Inconsistent line lengths in %s record: %s" % (fasta, name)
+                        )
+                    if not linebases:
+                        linebases = bases
+                        linewidth = len(line)
+                    elif bases < linebases or len(line) != linewidth:
+                        short = True
+                    length += bases
+                else:
+                    short = True
+            pos += len(line)
+    if name is not None:
+        entries.append((name, FaiEntry(length, offset, linebases, linewidth)))
+    if write:
+        writeFai(entries, faipath)
+    return entries
+
+
+def writeFai(entries, faipath):
+    """Write list of (name, FaiEntry) to faipath as a .fai index."""
+    with open(faipath, "w") as out:
+        for name, e in entries:
+            out.write(
+                "\t".join(
+                    [
+                        name,
+                        str(e.length),
+                        str(e.offset),
+                        str(e.linebases),
+                        str(e.linewidth),
+                    ]
+                )
+                + "\n"
+            )
+
+
+def readFai(faipath):
+    """Read .fai index. Returns list of (name, FaiEntry) in file order."""
+    entries = list()
+    with open(faipath) as f:
+        for line in f:
+            li = line.rstrip("\n").split("\t")
+            if len(li) >= 5:
+                entries.append((li[0], FaiEntry(*[int(x) for x in li[1:5]])))
+    return entries
+
+
+class FastaIndex(object):
+    """Random access to sequences in a multifasta through a .fai index.
+    The index is built if missing or older than the fasta. Sequence bytes are
+    read through mmap, so only the requested regions are loaded.
+    The index is kept at fasta + '.fai' unless faipath is given. If write is
+    False, or the index can not be written, a missing or outdated index is
+    built in memory only."""
+
+    def __init__(self, fasta, faipath=None, write=True):
+        self.fasta = os.path.abspath(fasta)
+        self.faipath = faipath or self.fasta + ".fai"
+        if not os.path.isfile(self.faipath) or os.path.getmtime(
+            self.faipath
+        ) < os.path.getmtime(self.fasta):
+            entries = buildFai(self.fasta, self.faipath, write=False)
+            if write:
+                try:
+                    writeFai(entries, self.faipath)
+                except OSError as error:
+                    # e.g. genome in a read-only directory
+                    print(
+                        "Could not write index %s (%s), indexing in memory."
+                        % (self.faipath, error.strerror),
+                        file=sys.stderr,
+                    )
+        else:
+            entries = readFai(self.faipath)
+        self.entries = dict()
+        for name, entry in entries:
+            if name in self.entries:
+                raise ValueError("Non-unique name in %s: %s" % (self.fasta, name))
+            self.entries[name] = entry
+        self._mmap = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    @property
+    def names(self):
+        """Sequence names in file order."""
+        return list(self.entries)
+
+    def length(self, name):
+        return self.entries[name].length
+
+    def _map(self):
+        with self._lock:
+            if self._mmap is None:
+                with open(self.fasta, "rb") as f:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._mmap
+
+    def _byte(self, entry, pos):
+        """File offset of base pos (idx '0') within a record."""
+        return (
+            entry.offset
+            + (pos // entry.linebases) * entry.linewidth
+            + pos % entry.linebases
+        )
+
+    def fetch(self, name, start=0, end=None):
+        """Return bases start:end (idx '0', end exclusive) of sequence name as bytes."""
+        entry = self.entries[name]
+        if end is None or end > entry.length:
+            end = entry.length
+        start = max(0, start)
+        if start >= end:
+            return b""
+        raw = self._map()[self._byte(entry, start) : self._byte(entry, end - 1) + 1]
+        return raw.replace(b"\n", b"").replace(b"\r", b"")
+
+    def write(self, name, handle, start=0, end=None):
+        """Write bases start:end of sequence name to open binary handle as fasta.
+        Sequence is copied in blocks, not loaded whole."""
+        entry = self.entries[name]
+        if end is None or end > entry.length:
+            end = entry.length
+        handle.write(b">" + name.encode() + b"\n")
+        block = WRITE_BLOCK - WRITE_BLOCK % LINE_WIDTH
+        for pos in range(start, end, block):
+            seq = self.fetch(name, pos, min(pos + block, end))
+            for i in range(0, len(seq), LINE_WIDTH):
+                handle.write(seq[i : i + LINE_WIDTH] + b"\n")
+
+    def extract(self, name, path, start=0, end=None):
+        """Write bases start:end of sequence name to a new fasta file at path."""
+        with open(path, "wb") as handle:
+            self.write(name, handle, start, end)
+        return path
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+
+
+def fasta_names(path):
+    """Names of records in a fasta file, in file order."""
+    names = list()
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b">"):
+                words = line[1:].split(None, 1)
+                names.append(words[0].decode() if words else "")
+    return names
+
+
+def seq_name(x):
+    """Name of a sequence given as a SeqRef or a single sequence fasta path.
+    TargetWindows and QueryBatches are given descriptive labels."""
+    if isinstance(x, TargetWindow):
+        return "%s:%s-%s" % (x.ref.name, x.start + 1, x.end)
+    if isinstance(x, QueryBatch):
+        return "%s queries (%s ... %s)" % (
+            len(x.queries),
+            seq_name(x.queries[0]),
+            seq_name(x.queries[-1]),
+        )
+    if isinstance(x, SeqRef):
+        return x.name
+    return os.path.splitext(os.path.basename(x))[0]
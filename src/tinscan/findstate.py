@@ -0,0 +1,107 @@
+import hashlib
+import os
+
+import numpy as np
+
+from .binfmt import read_columns, write_columns
+from .hittable import STRAND_CODE, HitTable
+
+# Settings that change which hits in a bucket are paired. minIdent is not
+# listed, as it changes the hits themselves, which are fingerprinted.
+PAIR_PARAMS = ("maxIdentDiff", "minInsert", "maxInsert", "qGap", "maxTSD")
+
+# Name of the state file within a state directory
+STATE_FILE = "pairs.tbin"
+
+# Hit columns included in bucket fingerprints. UIDs are left out as they
+# change when hits are added to or removed from other buckets.
+DIGEST_COLUMNS = (
+    "t_start",
+    "t_end",
+    "t_strand",
+    "q_start",
+    "q_end",
+    "q_strand",
+    "idPct",
+)
+
+# dtypes of fingerprinted columns, so list and table buckets hash alike
+_DTYPES = {"t_strand": np.int8, "q_strand": np.int8, "idPct": np.float64}
+
+
+def pairParams(args):
+    """Dict of the pairing settings in args."""
+    return {name: getattr(args, name) for name in PAIR_PARAMS}
+
+
+def bucketDigest(bucket):
+    """Fingerprint of the hits in one Target:Query bucket, given as a single
+    bucket HitTable or as a list of hit tuples."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(len(bucket)).encode())
+    for c in DIGEST_COLUMNS:
+        if isinstance(bucket, HitTable):
+            values = getattr(bucket, c)
+        elif c in ("t_strand", "q_strand"):
+            values = [STRAND_CODE[getattr(hit, c)] for hit in bucket]
+        else:
+            values = [getattr(hit, c) for hit in bucket]
+        h.update(np.ascontiguousarray(values, dtype=_DTYPES.get(c, np.int64)).data)
+    return h.digest()
+
+
+class FindState(object):
+    """Pairing results of a previous tinscan-find run, kept in a directory.
+    For each Target:Query bucket the fingerprint of its hits and the indices
+    of its paired hits within the bucket are stored, along with the pairing
+    settings used. Saved results are only returned if the settings match."""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.statefile = os.path.join(self.path, STATE_FILE)
+
+    def load(self, params):
+        """Return dict of (t_name, q_name): (digest, hit_idx, mate_idx) saved
+        with the same pairing settings, or an empty dict."""
+        if not os.path.isfile(self.statefile):
+            return dict()
+        columns, meta = read_columns(self.statefile)
+        if meta.get("kind") != "findstate":
+            raise ValueError("Not a tinscan-find state file: %s" % self.statefile)
+        if meta["params"] != params:
+            return dict()
+        stops = np.cumsum(columns["counts"]).tolist()
+        entries = dict()
+        for (t_name, q_name), digest, stop, count in zip(
+            meta["buckets"],
+            np.asarray(columns["digest"]).reshape(-1, 16),
+            stops,
+            columns["counts"].tolist(),
+        ):
+            # Copied, as the state file is replaced on save
+            entries[(t_name, q_name)] = (
+                digest.tobytes(),
+                np.array(columns["hit"][stop - count : stop]),
+                np.array(columns["mate"][stop - count : stop]),
+            )
+        return entries
+
+    def save(self, params, keys, digests, results):
+        """Write fingerprints and (hit_idx, mate_idx) results for buckets keys."""
+        counts = np.array([len(h) for h, m in results], dtype=np.int64)
+        empty = np.zeros(0, dtype=np.int64)
+        columns = {
+            "digest": np.frombuffer(b"".join(digests), dtype=np.uint8),
+            "counts": counts,
+            "hit": np.concatenate([h for h, m in results] + [empty]).astype(np.int64),
+            "mate": np.concatenate([m for h, m in results] + [empty]).astype(np.int64),
+        }
+        meta = {
+            "kind": "findstate",
+            "params": params,
+            "buckets": [list(key) for key in keys],
+        }
+        tmp = self.statefile + ".tmp"
+        write_columns(tmp, columns, meta=meta)
+        os.replace(tmp, self.statefile)
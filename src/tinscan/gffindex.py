@@ -0,0 +1,228 @@
+from collections import namedtuple
+import os
+
+import numpy as np
+
+from .binfmt import is_binary, read_columns, write_columns
+
+# A GFF feature returned by a query. line is the GFF line as written, start
+# and end its coordinates (idx '1', inclusive) and distance the number of
+# bases between the feature and the query (0 if they overlap).
+Feature = namedtuple("Feature", ["seqid", "type", "start", "end", "line", "distance"])
+
+# Extension of candidate index files, added to the GFF file name
+INDEX_EXT = ".tidx"
+
+
+def buildIndex(gff, indexpath=None):
+    """Scan a GFF3 file of candidates and write an interval index of its features.
+    Features are grouped into sections by seqid and type. Within each section
+    they are sorted by start, with the running maximum of their ends, so that
+    overlapping and nearest features can be found by binary search. Features
+    are stored as byte offsets of their lines in gff, as for a .fai index.
+    Returns path to the index."""
+    if indexpath is None:
+        indexpath = gff + INDEX_EXT
+    seqids = dict()
+    types = dict()
+    cols = {
+        name: list() for name in ("seqid", "type", "start", "end", "offset", "length")
+    }
+    pos = 0
+    with open(gff, "rb") as f:
+        for line in f:
+            if line.strip() and not line.startswith(b"#"):
+                li = line.split(b"\t", 5)
+                if len(li) < 5:
+                    raise ValueError("Malformed GFF line in %s: %r" % (gff, line))
+                try:
+                    start, end = int(li[3]), int(li[4])
+                except ValueError:
+                    raise ValueError("Malformed GFF line in %s: %r" % (gff, line))
+                cols["seqid"].append(seqids.setdefault(li[0].decode(), len(seqids)))
+                cols["type"].append(types.setdefault(li[2].decode(), len(types)))
+                # Insert coordinates are reversed if flanks overlap in the target
+                cols["start"].append(min(start, end))
+                cols["end"].append(max(start, end))
+                cols["offset"].append(pos)
+                cols["length"].append(len(line))
+            pos += len(line)
+    seqid = np.asarray(cols["seqid"], dtype=np.int64)
+    ftype = np.asarray(cols["type"], dtype=np.int64)
+    start = np.asarray(cols["start"], dtype=np.int64)
+    end = np.asarray(cols["end"], dtype=np.int64)
+    offset = np.asarray(cols["offset"], dtype=np.int64)
+    length = np.asarray(cols["length"], dtype=np.int64)
+    # Sort by section, then start. Ties keep file order.
+    order = np.lexsort((offset, start, ftype, seqid))
+    seqid, ftype = seqid[order], ftype[order]
+    start, end = start[order], end[order]
+    offset, length = offset[order], length[order]
+    # Section boundaries
+    key = seqid * max(1, len(types)) + ftype
+    bounds = np.flatnonzero(np.diff(key)) + 1
+    starts = np.concatenate(([0], bounds)) if len(key) else np.zeros(0, dtype=int)
+    stops = np.append(bounds, len(key)) if len(key) else np.zeros(0, dtype=int)
+    seqNames = list(seqids)
+    typeNames = list(types)
+    sections = list()
+    maxEnd = np.empty_like(end)
+    for lo, hi in zip(starts.tolist(), stops.tolist()):
+        maxEnd[lo:hi] = np.maximum.accumulate(end[lo:hi])
+        sections.append([seqNames[int(seqid[lo])], typeNames[int(ftype[lo])], lo, hi])
+    write_columns(
+        indexpath,
+        {
+            "start": start,
+            "end": end,
+            "maxEnd": maxEnd,
+            "offset": offset,
+            "length": length,
+        },
+        meta={
+            "kind": "candidates",
+            "gff": os.path.basename(gff),
+            "seqids": seqNames,
+            "types": typeNames,
+            "sections": sections,
+        },
+    )
+    return indexpath
+
+
+class CandidateIndex(object):
+    """Region and nearest feature queries on a GFF3 file of candidates.
+    The index is kept at gff + '.tidx' unless indexpath is given, and is built
+    if missing or older than gff. Index columns are memory-mapped and features
+    are read from gff by offset, so queries do not load the full result set."""
+
+    def __init__(self, gff, indexpath=None):
+        self.gff = os.path.abspath(gff)
+        self.indexpath = indexpath or self.gff + INDEX_EXT
+        if not os.path.isfile(self.indexpath) or os.path.getmtime(
+            self.indexpath
+        ) < os.path.getmtime(self.gff):
+            buildIndex(self.gff, self.indexpath)
+        if not is_binary(self.indexpath):
+            raise ValueError("Not a tinscan index file: %s" % self.indexpath)
+        columns, meta = read_columns(self.indexpath)
+        if meta.get("kind") != "candidates":
+            raise ValueError("Not a tinscan candidate index: %s" % self.indexpath)
+        self.columns = columns
+        self.seqids = meta["seqids"]
+        self.types = meta["types"]
+        # Dict of seqid: list of (type, lo, hi) sections
+        self.sections = dict()
+        for seqid, ftype, lo, hi in meta["sections"]:
+            self.sections.setdefault(seqid, list()).append((ftype, lo, hi))
+        self._handle = None
+
+    def __len__(self):
+        return len(self.columns["start"])
+
+    def __contains__(self, seqid):
+        return seqid in self.sections
+
+    def _sections(self, seqid, types=None):
+        return [
+            (lo, hi)
+            for ftype, lo, hi in self.sections.get(seqid, list())
+            if types is None or ftype in types
+        ]
+
+    def _line(self, row):
+        if self._handle is None:
+            self._handle = open(self.gff, "rb")
+        self._handle.seek(int(self.columns["offset"][row]))
+        return self._handle.read(int(self.columns["length"][row])).decode()
+
+    def _feature(self, seqid, row, distance):
+        line = self._line(row)
+        return Feature(
+            seqid,
+            line.split("\t", 3)[2],
+            int(self.columns["start"][row]),
+            int(self.columns["end"][row]),
+            line,
+            distance,
+        )
+
+    def region(self, seqid, start=1, end=None, types=None):
+        """Return features overlapping bases start:end of seqid (idx '1',
+        inclusive) as a list of Features, ordered by start. If types is given,
+        only features of these GFF types are returned."""
+        rows = list()
+        for lo, hi in self._sections(seqid, types):
+            # Features starting at or before end ...
+            stop = lo + (
+                hi - lo
+                if end is None
+                else int(np.searchsorted(self.columns["start"][lo:hi], end, "right"))
+            )
+            # ... after the first whose running maximum end reaches start
+            first = lo + int(
+                np.searchsorted(self.columns["maxEnd"][lo:stop], start, "left")
+            )
+            ends = np.asarray(self.columns["end"][first:stop])
+            rows.extend((first + np.flatnonzero(ends >= start)).tolist())
+        rows.sort(
+            key=lambda r: (int(self.columns["start"][r]), self.columns["offset"][r])
+        )
+        return [self._feature(seqid, row, 0) for row in rows]
+
+    def nearest(self, seqid, pos, types=None):
+        """Return the feature of seqid closest to base pos (idx '1') as a
+        Feature, or None if seqid has no features. Overlapping features have
+        distance 0. If several features are equally close, the first found is
+        returned."""
+        best = None
+        for lo, hi in self._sections(seqid, types):
+            starts = self.columns["start"][lo:hi]
+            maxEnd = self.columns["maxEnd"][lo:hi]
+            # Features starting at or before pos are [0, n)
+            n = int(np.searchsorted(starts, pos, "right"))
+            found = list()
+            if n:
+                reach = int(maxEnd[n - 1])
+                if reach >= pos:
+                    # The first feature whose end reaches pos overlaps it
+                    found.append(
+                        (0, lo + int(np.searchsorted(maxEnd[:n], pos, "left")))
+                    )
+                else:
+                    # Upstream feature ending closest to pos
+                    found.append(
+                        (
+                            pos - reach,
+                            lo + int(np.searchsorted(maxEnd[:n], reach, "left")),
+                        )
+                    )
+            if n < hi - lo:
+                found.append((int(starts[n]) - pos, lo + n))
+            for distance, row in found:
+                if best is None or (distance, row) < best:
+                    best = (distance, row)
+        if best is None:
+            return None
+        return self._feature(seqid, best[1], best[0])
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+
+
+def parseRegion(region):
+    """Parse a region given as 'seqid', 'seqid:pos' or 'seqid:start-end'
+    (idx '1', inclusive). Returns (seqid, start, end), where end is None for
+    a whole sequence and equal to start for a single position."""
+    seqid, sep, span = region.rpartition(":")
+    if sep:
+        bounds = span.replace(",", "").split("-")
+        if len(bounds) <= 2 and all(x.isdigit() for x in bounds):
+            start = int(bounds[0])
+            end = int(bounds[-1])
+            if start < 1 or end < start:
+                raise ValueError("Invalid region: %s" % region)
+            return seqid, start, end
+    return region, 1, None
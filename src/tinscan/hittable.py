@@ -0,0 +1,358 @@
+from collections import namedtuple
+from itertools import islice
+import os
+
+import numpy as np
+
+from .binfmt import is_binary, read_columns, write_columns
+
+# Named tuple format for a single hit
+hitTup = namedtuple(
+    "Elem",
+    [
+        "t_start",
+        "t_end",
+        "t_strand",
+        "q_start",
+        "q_end",
+        "q_strand",
+        "idPct",
+        "UID",
+    ],
+)
+
+# Strand symbols are stored as int8 codes indexing this tuple
+STRANDS = ("+", "-")
+STRAND_CODE = {"+": 0, "-": 1}
+
+# Number of lines parsed per block when reading LASTZ tab files
+CHUNK_LINES = 1 << 18
+
+# Maximum number of candidate hit:mate comparisons to hold in memory per step
+PAIR_CHUNK = 1 << 22
+
+
+class HitTable(object):
+    """Columnar store of LASTZ hits.
+    Hits are held in typed NumPy arrays and grouped into contiguous slices, one
+    per Target:Query bucket. Scaffold names are interned to integer codes.
+    Buckets and the hits within them are ordered as in the nested dictionary
+    returned by readLASTZ."""
+
+    def __init__(
+        self,
+        names,
+        buckets,
+        t_start,
+        t_end,
+        t_strand,
+        q_start,
+        q_end,
+        q_strand,
+        idPct,
+        UID,
+    ):
+        # List of scaffold names, indexed by name code
+        self.names = list(names)
+        # Array of (t_code, q_code, start, stop) rows, one per bucket
+        self.buckets = np.asarray(buckets, dtype=np.int64).reshape(-1, 4)
+        self.t_start = np.asarray(t_start, dtype=np.int64)
+        self.t_end = np.asarray(t_end, dtype=np.int64)
+        self.t_strand = np.asarray(t_strand, dtype=np.int8)
+        self.q_start = np.asarray(q_start, dtype=np.int64)
+        self.q_end = np.asarray(q_end, dtype=np.int64)
+        self.q_strand = np.asarray(q_strand, dtype=np.int8)
+        self.idPct = np.asarray(idPct, dtype=np.float64)
+        self.UID = np.asarray(UID, dtype=np.int64)
+
+    columns = (
+        "t_start",
+        "t_end",
+        "t_strand",
+        "q_start",
+        "q_end",
+        "q_strand",
+        "idPct",
+        "UID",
+    )
+
+    def __len__(self):
+        return len(self.t_start)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the hit and bucket arrays."""
+        return self.buckets.nbytes + sum(getattr(self, c).nbytes for c in self.columns)
+
+    def iterBuckets(self):
+        """Yield (t_name, q_name, start, stop) for each Target:Query bucket."""
+        for t_code, q_code, start, stop in self.buckets.tolist():
+            yield self.names[t_code], self.names[q_code], start, stop
+
+    def hit(self, i):
+        """Return hit i as a hitTup."""
+        return hitTup(
+            int(self.t_start[i]),
+            int(self.t_end[i]),
+            STRANDS[self.t_strand[i]],
+            int(self.q_start[i]),
+            int(self.q_end[i]),
+            STRANDS[self.q_strand[i]],
+            float(self.idPct[i]),
+            int(self.UID[i]),
+        )
+
+    def bucket(self, start, stop):
+        """Return hits start:stop as a single bucket HitTable of array views."""
+        t_code, q_code = self.buckets[
+            np.searchsorted(self.buckets[:, 3], start, side="right"), :2
+        ]
+        return HitTable(
+            [self.names[t_code], self.names[q_code]],
+            [[0, 1, 0, stop - start]],
+            *[getattr(self, c)[start:stop] for c in self.columns],
+        )
+
+    def toDict(self):
+        """Expand to the nested dictionary of hitTup lists used by readLASTZ."""
+        hitsDict = dict()
+        for t_name, q_name, start, stop in self.iterBuckets():
+            hitsDict.setdefault(t_name, dict())[q_name] = [
+                self.hit(i) for i in range(start, stop)
+            ]
+        return hitsDict
+
+    def save(self, path):
+        """Write table to path in tinscan binary format."""
+        columns = {"buckets": self.buckets.ravel()}
+        for c in self.columns:
+            columns[c] = getattr(self, c)
+        write_columns(path, columns, meta={"kind": "hits", "names": self.names})
+
+    @classmethod
+    def load(cls, path):
+        """Load table from a tinscan binary file. Columns are memory-mapped, not
+        read into memory."""
+        columns, meta = read_columns(path)
+        if meta.get("kind") != "hits":
+            raise ValueError("Not a tinscan alignment file: %s" % path)
+        return cls(
+            meta["names"],
+            columns["buckets"].reshape(-1, 4),
+            *[columns[c] for c in cls.columns],
+        )
+
+    def filter(self, keep):
+        """Return a new table with hits where keep is True.
+        UIDs are renumbered and buckets reordered as if the kept hits had
+        been read from file."""
+        keep = np.asarray(keep, dtype=bool)
+        counts = self.buckets[:, 3] - self.buckets[:, 2]
+        t_codes = np.repeat(self.buckets[:, 0], counts)[keep]
+        q_codes = np.repeat(self.buckets[:, 1], counts)[keep]
+        # Restore file order of kept hits
+        order = np.argsort(self.UID[keep], kind="stable")
+        cols = {c: getattr(self, c)[keep][order] for c in self.columns}
+        cols["UID"] = np.arange(1, len(order) + 1, dtype=np.int64)
+        return HitTable.fromRows(self.names, t_codes[order], q_codes[order], cols)
+
+    @classmethod
+    def fromRows(cls, names, t_codes, q_codes, cols):
+        """Build a table from per-hit name codes and a dict of column lists or
+        arrays in file order. Hits are grouped into buckets ordered by first
+        appearance of the target name, then of the query name within target."""
+        t_codes = np.asarray(t_codes, dtype=np.int64)
+        q_codes = np.asarray(q_codes, dtype=np.int64)
+        n = len(t_codes)
+        if n == 0:
+            return cls(names, [], *[[] for c in cls.columns])
+        # Rank target names by first appearance
+        t_uniq, t_first = np.unique(t_codes, return_index=True)
+        t_rank = np.empty(len(names), dtype=np.int64)
+        t_rank[t_uniq] = np.argsort(np.argsort(t_first))
+        # Number buckets by first appearance of each Target:Query combination
+        key = t_codes * len(names) + q_codes
+        k_uniq, k_first, k_inv = np.unique(key, return_index=True, return_inverse=True)
+        # Order buckets by target rank, then by first appearance within target
+        b_order = np.lexsort((k_first, t_rank[k_uniq // len(names)]))
+        b_rank = np.empty(len(k_uniq), dtype=np.int64)
+        b_rank[b_order] = np.arange(len(k_uniq))
+        # Stable sort keeps hits in file order within each bucket
+        order = np.argsort(b_rank[k_inv.ravel()], kind="stable")
+        counts = np.bincount(b_rank[k_inv.ravel()], minlength=len(k_uniq))
+        stops = np.cumsum(counts)
+        buckets = np.column_stack(
+            (
+                k_uniq[b_order] // len(names),
+                k_uniq[b_order] % len(names),
+                stops - counts,
+                stops,
+            )
+        )
+        return cls(
+            names,
+            buckets,
+            *[np.asarray(cols[c])[order] for c in cls.columns],
+        )
+
+
+def _isPath(infile):
+    return isinstance(infile, (str, bytes, os.PathLike))
+
+
+def iterLASTZChunks(infile, minID=90, chunksize=CHUNK_LINES, metrics=None):
+    """Parse a LASTZ result file in blocks of chunksize lines.
+    For each block yield (t_names, q_names, cols) for hits with identity >= minID,
+    where cols is a dict of NumPy arrays keyed by HitTable column name.
+    Coordinates are converted to idx '0' and inverted query coordinates are
+    swapped. UIDs number kept hits from 1 in file order.
+    Only one block of raw text is held in memory at a time.
+    infile may also be an iterable of result table rows, as yielded by align.
+    If metrics is given, hits read and kept are counted."""
+    counter = 0
+    if _isPath(infile):
+        f = open(infile)
+        source = map(str.split, f)
+    else:
+        f = None
+        source = iter(infile)
+    try:
+        while True:
+            block = list(islice(source, chunksize))
+            if not block:
+                break
+            # Ignore blank lines and lines begining with '#'
+            rows = [row for row in block if row and row[0][0] != "#"]
+            del block
+            if not rows:
+                continue
+            fields = list(zip(*rows))
+            del rows
+            # Apply identity filter before converting remaining columns
+            idPct = np.array(fields[9], dtype=np.float64)
+            keep = np.flatnonzero(idPct >= minID)
+            if metrics is not None:
+                metrics.count("hitsRead", len(idPct))
+                metrics.count("hitsKept", len(keep))
+            if not len(keep):
+                continue
+
+            def column(i, dtype=np.int64):
+                return np.array(fields[i], dtype=dtype)[keep]
+
+            q_a = column(6) - 1
+            q_b = column(7) - 1
+            cols = {
+                "t_start": column(2) - 1,  # Convert from idx '1' to idx '0'
+                "t_end": column(3) - 1,
+                "t_strand": np.array(
+                    [STRAND_CODE[fields[1][i]] for i in keep], dtype=np.int8
+                ),
+                "q_start": np.minimum(q_a, q_b),
+                "q_end": np.maximum(q_a, q_b),
+                "q_strand": np.array(
+                    [STRAND_CODE[fields[5][i]] for i in keep], dtype=np.int8
+                ),
+                "idPct": idPct[keep],
+                "UID": np.arange(counter + 1, counter + len(keep) + 1, dtype=np.int64),
+            }
+            counter += len(keep)
+            t_names = [fields[0][i] for i in keep]
+            q_names = [fields[4][i] for i in keep]
+            yield t_names, q_names, cols
+    finally:
+        if f is not None:
+            f.close()
+
+
+def readHitTable(infile, minID=90, chunksize=CHUNK_LINES, metrics=None):
+    """Read LASTZ result file into a columnar HitTable.
+    Applies the same identity filter and coordinate conversion as readLASTZ.
+    The file is streamed in blocks, so peak memory scales with the number of
+    hits kept rather than the size of the file.
+    Binary alignment files are memory-mapped. Hit arrays are only copied if
+    some hits fall below minID.
+    infile may also be an iterable of result table rows, as yielded by align.
+    If metrics is given, hits read and kept are counted."""
+    if _isPath(infile) and is_binary(infile):
+        table = HitTable.load(infile)
+        keep = table.idPct >= minID
+        if metrics is not None:
+            metrics.count("hitsRead", len(table))
+            metrics.count("hitsKept", int(keep.sum()))
+        if keep.all():
+            return table
+        return table.filter(keep)
+    intern = dict()
+    t_codes = list()
+    q_codes = list()
+    cols = {c: list() for c in HitTable.columns}
+    for t_names, q_names, chunk in iterLASTZChunks(infile, minID, chunksize, metrics):
+        t_codes.append(
+            np.array([intern.setdefault(x, len(intern)) for x in t_names], np.int64)
+        )
+        q_codes.append(
+            np.array([intern.setdefault(x, len(intern)) for x in q_names], np.int64)
+        )
+        for c in HitTable.columns:
+            cols[c].append(chunk[c])
+    if not t_codes:
+        return HitTable.fromRows(list(intern), [], [], cols)
+    return HitTable.fromRows(
+        list(intern),
+        np.concatenate(t_codes),
+        np.concatenate(q_codes),
+        {c: np.concatenate(cols[c]) for c in HitTable.columns},
+    )
+
+
+def bucketPairs(table, start, stop, args):
+    """Return arrays of (hit, mate) row indices for the bucket table[start:stop]
+    that satisfy the getHitPairs filters. Each hit is compared only against mates
+    whose t_start falls in [hit.t_end + minInsert, hit.t_end + maxInsert].
+    Pairs are ordered by hit, then mate, as in the all-vs-all search."""
+    t_start = table.t_start[start:stop]
+    t_end = table.t_end[start:stop]
+    q_start = table.q_start[start:stop]
+    q_end = table.q_end[start:stop]
+    q_strand = table.q_strand[start:stop]
+    idPct = table.idPct[start:stop]
+    # Index bucket by target start position
+    order = np.argsort(t_start, kind="stable")
+    starts = t_start[order]
+    lo = np.searchsorted(starts, t_end + args.minInsert, side="left")
+    hi = np.searchsorted(starts, t_end + args.maxInsert, side="right")
+    counts = np.maximum(hi - lo, 0)
+    hits_out = list()
+    mates_out = list()
+    # Expand hit:mate comparisons in blocks of hits to bound memory
+    ends = np.cumsum(counts)
+    a = 0
+    n = len(counts)
+    while a < n:
+        b = int(np.searchsorted(ends, ends[a] - counts[a] + PAIR_CHUNK, side="right"))
+        b = min(max(b, a + 1), n)
+        c = counts[a:b]
+        total = int(c.sum())
+        if total:
+            hit = np.repeat(np.arange(a, b), c)
+            offset = np.arange(total) - np.repeat(np.cumsum(c) - c, c)
+            mate = order[np.repeat(lo[a:b], c) + offset]
+            keep = (
+                (mate != hit)
+                & (q_strand[mate] == q_strand[hit])
+                & (np.abs(idPct[mate] - idPct[hit]) <= args.maxIdentDiff)
+            )
+            plus = q_strand[hit] == STRAND_CODE["+"]
+            gap = np.where(plus, q_start[mate] - q_end[hit], q_start[hit] - q_end[mate])
+            keep &= (gap <= args.qGap) & (gap >= 0 - args.maxTSD)
+            hit = hit[keep]
+            mate = mate[keep]
+            srt = np.lexsort((mate, hit))
+            hits_out.append(hit[srt] + start)
+            mates_out.append(mate[srt] + start)
+        a = b
+    if not hits_out:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    return np.concatenate(hits_out), np.concatenate(mates_out)
@@ -0,0 +1,166 @@
+from contextlib import contextmanager, nullcontext
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def _peakRSS(who="self"):
+    """Peak resident set size in MB of this process, or of its waited-for
+    child processes if who is 'children'. None if not available."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(
+        resource.RUSAGE_CHILDREN if who == "children" else resource.RUSAGE_SELF
+    )
+    # ru_maxrss is in bytes on macOS and KB elsewhere
+    scale = 1 if sys.platform == "darwin" else 1024
+    return usage.ru_maxrss * scale / 1024**2
+
+
+def _childCPU():
+    """CPU seconds used by waited-for child processes, e.g. LASTZ."""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _resetPeak():
+    """Reset the peak RSS of this process, so that the next reading covers only
+    what follows. Only supported on Linux. Returns True if reset."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _statusPeak():
+    """Peak RSS in MB since the last reset, from /proc/self/status."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class Metrics(object):
+    """Record wall time, CPU time and peak memory of run stages, counters, and
+    the duration of each alignment job. Safe to update from several threads.
+    Stage peak RSS is measured from the start of each stage on Linux. On other
+    systems it is the process high-water mark at the end of the stage."""
+
+    def __init__(self, command=None):
+        self.command = command
+        self.stages = list()
+        self.counters = dict()
+        self.jobs = list()
+        self._lock = threading.Lock()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._childCpu = _childCPU()
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager timing a named stage."""
+        reset = _resetPeak()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        childCpu = _childCPU()
+        try:
+            yield self
+        finally:
+            peak = _statusPeak() if reset else None
+            record = {
+                "stage": name,
+                "wall": round(time.perf_counter() - wall, 4),
+                "cpu": round(time.process_time() - cpu, 4),
+                "childCpu": round(_childCPU() - childCpu, 4),
+                "peakRSS_MB": _round(peak if peak is not None else _peakRSS()),
+            }
+            with self._lock:
+                self.stages.append(record)
+
+    def count(self, name, n=1):
+        """Add n to counter name."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def job(self, **fields):
+        """Record one alignment job, e.g. its sequences and durations."""
+        with self._lock:
+            self.jobs.append(fields)
+
+    def report(self):
+        """Return metrics as a dict."""
+        with self._lock:
+            seconds = [job["seconds"] for job in self.jobs if "seconds" in job]
+            return {
+                "command": self.command,
+                "wall": round(time.perf_counter() - self._wall, 4),
+                "cpu": round(time.process_time() - self._cpu, 4),
+                "childCpu": round(_childCPU() - self._childCpu, 4),
+                "peakRSS_MB": _round(_peakRSS()),
+                "childPeakRSS_MB": _round(_peakRSS("children")),
+                "stages": list(self.stages),
+                "counters": dict(self.counters),
+                "jobSeconds": {
+                    "count": len(seconds),
+                    "total": round(sum(seconds), 4),
+                    "max": round(max(seconds), 4) if seconds else None,
+                },
+                "jobs": list(self.jobs),
+            }
+
+    def write(self, path):
+        """Write metrics to path as JSON."""
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=1)
+            f.write("\n")
+
+
+def timed(metrics, name):
+    """metrics.stage(name), or a context that does nothing if metrics is None."""
+    if metrics is None:
+        return nullcontext()
+    return metrics.stage(name)
+
+
+def _round(x, digits=2):
+    return None if x is None else round(x, digits)
+
+
+@contextmanager
+def profiled(path=None):
+    """Context manager that writes cProfile data for the enclosed code to path,
+    for viewing with pstats or snakeviz. Only the calling thread is profiled.
+    Does nothing if path is None."""
+    if not path:
+        yield None
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        profile.dump_stats(os.path.abspath(path))
+
+
+def profiledCall(path, fn, *args):
+    """Call fn(*args), writing cProfile data for the call to path. Submit to a
+    process pool in place of fn to profile work done in worker processes."""
+    with profiled(path):
+        return fn(*args)
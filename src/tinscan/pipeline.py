@@ -0,0 +1,241 @@
+from collections import OrderedDict
+import os
+import queue
+import shutil
+import sys
+import threading
+
+from . import clusterPairs, getHitPairs, readHitTable, writeGFFlines
+from .LASTZ_wrapper import HEADER, _make_jobs, _run_jobs, _scratch, pair_rows
+from .faidx import SeqRef, fasta_names
+
+
+def _names(x, memo):
+    """Record names that sequence x can contribute to alignments. Names of
+    fasta files are read once and kept in memo by path."""
+    if isinstance(x, SeqRef):
+        return [x.name]
+    if x not in memo:
+        memo[x] = fasta_names(x)
+    return memo[x]
+
+
+class BucketStream(object):
+    """Collect hits of target:query pairs, added in pair order, and release
+    Target:Query buckets once no later pair can add hits to them.
+    Buckets are released in the order tinscan-find reads them from the
+    alignment table: targets by first appearance, then queries by first
+    appearance within each target."""
+
+    def __init__(self, pairs):
+        # Index of the last pair that may contribute hits to each target and bucket
+        self.lastTarget = dict()
+        self.lastBucket = dict()
+        # Each file appears in many pairs
+        memo = dict()
+        for i, (A, B) in enumerate(pairs):
+            queries = _names(B, memo)
+            for t in _names(A, memo):
+                self.lastTarget[t] = i
+                for q in queries:
+                    self.lastBucket[(t, q)] = i
+        self.targets = OrderedDict()
+        self.added = 0
+
+    def add(self, rows):
+        """Add result table rows of the next pair. Return list of
+        ((target, query), rows) for buckets that are now complete."""
+        for row in rows:
+            self.targets.setdefault(row[0], OrderedDict()).setdefault(
+                row[4], list()
+            ).append(row)
+        self.added += 1
+        return list(self._release())
+
+    def _release(self):
+        while self.targets:
+            t, queries = next(iter(self.targets.items()))
+            while queries:
+                q, rows = next(iter(queries.items()))
+                if self.lastBucket.get((t, q), -1) >= self.added:
+                    return
+                del queries[q]
+                yield (t, q), rows
+            if self.lastTarget.get(t, -1) >= self.added:
+                return
+            del self.targets[t]
+
+
+def stream_insertions(
+    pairs,
+    args,
+    gffout,
+    alignOut=None,
+    idWidth=7,
+    workdir=None,
+    tmpdir=None,
+    cache=None,
+    progress=False,
+    metrics=None,
+    cluster=False,
+):
+    """Align target:query pairs and write candidate insertions to gffout as
+    alignments finish. Hits of each finished pair are passed straight to
+    getHitPairs, bucket by bucket, while other alignments are still running.
+    GFF records are written in the same order as tinscan-find, with feature
+    IDs zero-padded to idWidth digits as the total is not known in advance.
+    args holds the tinscan-align and tinscan-find settings. If alignOut is set,
+    the alignment table is also written. If metrics is given, jobs, hits, pairs
+    and features are counted. If cluster is set, overlapping candidates are
+    merged with clusterPairs, holding back the candidates of each target
+    until all of its buckets are done. Returns number of candidates."""
+    if workdir:
+        scratch = os.path.abspath(workdir)
+        os.makedirs(scratch, exist_ok=True)
+    else:
+        scratch = _scratch(tmpdir)
+    jobs, jobouts, byPair = _make_jobs(
+        pairs,
+        scratch,
+        args.lzpath,
+        args.minIdt,
+        args.minLen,
+        args.hspthresh,
+        args.window,
+        args.overlap,
+        args.batchQueries,
+    )
+    # Pairs are ready once all of their jobs have finished
+    remaining = dict()
+    pairsOfJob = dict()
+    for i, outputs in byPair.items():
+        jobIds = set(j for j, _ in outputs)
+        remaining[i] = len(jobIds)
+        for j in jobIds:
+            pairsOfJob.setdefault(j, list()).append(i)
+    ready = queue.Queue()
+    lock = threading.Lock()
+
+    def onDone(j):
+        with lock:
+            for i in pairsOfJob[j]:
+                remaining[i] -= 1
+                if remaining[i] == 0:
+                    ready.put(i)
+
+    errors = list()
+
+    def runJobs():
+        try:
+            _run_jobs(
+                jobs,
+                jobouts,
+                scratch,
+                args.lzpath,
+                args.minIdt,
+                args.minLen,
+                args.hspthresh,
+                args.threads,
+                cache,
+                args.verbose,
+                args.timeout,
+                args.retries,
+                progress,
+                onDone=onDone,
+                metrics=metrics,
+            )
+        except BaseException as error:
+            errors.append(error)
+        finally:
+            ready.put(None)
+
+    runner = threading.Thread(target=runJobs, daemon=True)
+    runner.start()
+    stream = BucketStream(pairs)
+    complete = set()
+    nextPair = 0
+    counter = 0
+    # Candidates of the current target, held back for clustering
+    pending = list()
+    pendingTarget = None
+
+    def writePairs(gff, validPairs):
+        nonlocal counter
+        attributes = None
+        if cluster:
+            if metrics is not None:
+                metrics.count("unclusteredCandidates", len(validPairs))
+            validPairs, attributes = clusterPairs(validPairs)
+        features = 0
+        for x in writeGFFlines(
+            validPairs,
+            args.noflanks,
+            fillLen=idWidth,
+            start=counter,
+            header=False,
+            attributes=attributes,
+        ):
+            gff.write(x)
+            features += 1
+        counter += len(validPairs)
+        if metrics is not None:
+            metrics.count("featuresWritten", features)
+
+    alignFile = open(alignOut, "w") if alignOut else None
+    try:
+        with open(gffout, "w") as gff:
+            for x in writeGFFlines([], header=True):
+                gff.write(x)
+            if alignFile is not None:
+                alignFile.write(HEADER)
+            # Handle pairs in pair order, as soon as each and all before it are done
+            while nextPair < len(pairs):
+                i = ready.get()
+                if i is None:
+                    break
+                complete.add(i)
+                while nextPair in complete:
+                    rows = pair_rows(byPair[nextPair])
+                    if alignFile is not None:
+                        for row in rows:
+                            alignFile.write("\t".join(row) + "\n")
+                    for (t, q), bucket in stream.add(rows):
+                        hits = readHitTable(
+                            bucket, minID=args.minIdent, metrics=metrics
+                        )
+                        validPairs = getHitPairs(hits, args, metrics=metrics)
+                        if not cluster:
+                            writePairs(gff, validPairs)
+                            continue
+                        if t != pendingTarget:
+                            writePairs(gff, pending)
+                            pending = list()
+                            pendingTarget = t
+                        pending += validPairs
+                    # Write held back candidates once their target is complete
+                    if pending and pendingTarget not in stream.targets:
+                        writePairs(gff, pending)
+                        pending = list()
+                    gff.flush()
+                    complete.discard(nextPair)
+                    nextPair += 1
+            if pending:
+                writePairs(gff, pending)
+        runner.join()
+        if errors:
+            raise errors[0]
+    except BaseException:
+        print(
+            "Completed alignments are kept in %s. Re-run with --workdir %s to resume."
+            % (scratch, scratch),
+            file=sys.stderr,
+        )
+        raise
+    finally:
+        if alignFile is not None:
+            alignFile.close()
+    if not workdir:
+        shutil.rmtree(scratch)
+    if cache is not None:
+        cache.evict()
+    return counter
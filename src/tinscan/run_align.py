@@ -6,31 +6,42 @@ import sys
 import tinscan
 
 
-def mainArgs():
-    parser = argparse.ArgumentParser(
-        description="Align B genome (query) sequences onto A genome (target) using LASTZ.",
-        prog="tinscan-align",
-    )
+def add_align_args(parser):
+    """Add genome input, LASTZ and job control options shared by tinscan-align
+    and tinscan-run to parser."""
     # Input options
     parser.add_argument(
         "--adir",
         type=str,
-        required=True,
+        default=None,
         help="Name of directory containing sequences from A genome.",
     )
     parser.add_argument(
         "--bdir",
         type=str,
-        required=True,
+        default=None,
         help="Name of directory containing sequences from B genome.",
     )
+    parser.add_argument(
+        "-A",
+        "--target",
+        type=str,
+        default=None,
+        help="Multifasta containing A genome. Used in place of --adir. Scaffolds are read through a .fai index, which is created if missing.",
+    )
+    parser.add_argument(
+        "-B",
+        "--query",
+        type=str,
+        default=None,
+        help="Multifasta containing B genome. Used in place of --bdir.",
+    )
     parser.add_argument(
         "--pairs",
         type=str,
         default=None,
         help="Optional: Tab-delimited 2-col file specifying target:query sequence pairs to be aligned",
     )
-    # Output options
     parser.add_argument(
         "-d",
         "--outdir",
@@ -38,12 +49,6 @@ def mainArgs():
         default=None,
         help="Write output files to this directory. (Default: cwd)",
     )
-    parser.add_argument(
-        "--outfile",
-        type=str,
-        default="tinscan_alignment.tab",
-        help="Name of alignment result file.",
-    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -51,6 +56,13 @@ def mainArgs():
         default=False,
         help="If set report LASTZ progress.",
     )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of LASTZ alignment jobs to run in parallel.",
+    )
     # LASTZ options
     parser.add_argument(
         "--lzpath",
@@ -70,6 +82,142 @@ def mainArgs():
         default=3000,
         help="LASTZ min HSP threshold. Increase for stricter matches.",
     )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=None,
+        help="Optional: Align target scaffolds longer than this as overlapping windows of this size, run as separate jobs. Hits are lifted back to scaffold coordinates. LASTZ --chain is applied within each window, so hits off the best chain through the whole scaffold may be kept.",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=int,
+        default=100000,
+        help="Overlap between target windows. Set to at least the tinscan-find --maxInsert value. Hits running past a window end are joined to their continuation in the next window.",
+    )
+    parser.add_argument(
+        "--batchQueries",
+        type=int,
+        default=None,
+        help="Optional: Align query scaffolds shorter than this many bases to each target in multi-sequence batches of up to this size. Reduces LASTZ start-up and target seeding for assemblies with many small contigs.",
+    )
+    # Job control options
+    parser.add_argument(
+        "--tmpdir",
+        type=str,
+        default=None,
+        help="Directory in which to create scratch files, e.g. on fast local storage. (Default: system temporary directory)",
+    )
+    parser.add_argument(
+        "--workdir",
+        type=str,
+        default=None,
+        help="Optional: Keep per-job alignment results in this directory. Jobs already completed in it are skipped, so an interrupted run can be resumed.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=None,
+        help="Optional: Stop LASTZ jobs running for longer than this many seconds.",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=1,
+        help="Number of times to retry a failed or timed out LASTZ job.",
+    )
+    parser.add_argument(
+        "--noProgress",
+        action="store_true",
+        default=False,
+        help="If set do not report jobs done, throughput and ETA to stderr.",
+    )
+    # Cache options
+    parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help="Optional: Directory in which to keep raw LASTZ results. Unchanged pairs are not realigned on re-runs.",
+    )
+    parser.add_argument(
+        "--cacheSize",
+        type=int,
+        default=20000,
+        help="Maximum size of alignment cache in MB. Least recently used results are removed first.",
+    )
+
+
+def mainArgs():
+    parser = argparse.ArgumentParser(
+        description="Align B genome (query) sequences onto A genome (target) using LASTZ.",
+        prog="tinscan-align",
+    )
+    add_align_args(parser)
+    # Output options
+    parser.add_argument(
+        "--outfile",
+        type=str,
+        default="tinscan_alignment.tab",
+        help="Name of alignment result file.",
+    )
+    parser.add_argument(
+        "--binOut",
+        type=str,
+        default=None,
+        help="Optional: Also write alignments to this file in tinscan binary format, for fast loading by tinscan-find.",
+    )
+    parser.add_argument(
+        "--dryRun",
+        action="store_true",
+        default=False,
+        help="Report the planned job schedule and predicted run time, then exit without aligning.",
+    )
+    parser.add_argument(
+        "--shard",
+        type=str,
+        default=None,
+        help="Optional: Run only shard i of N (given as i/N) of the pair list, for spreading a run across machines. Pairs are divided by estimated cost. Shard outputs are combined with tinscan-merge.",
+    )
+    # Prefilter options
+    parser.add_argument(
+        "--prefilter",
+        action="store_true",
+        default=False,
+        help="Skip target:query pairs with little shared k-mer content, estimated from sequence sketches.",
+    )
+    parser.add_argument(
+        "--sketchK", type=int, default=21, help="K-mer size used in sketches (<= 31)."
+    )
+    parser.add_argument(
+        "--sketchScale",
+        type=int,
+        default=200,
+        help="Keep about 1 in this many k-mers in sketches.",
+    )
+    parser.add_argument(
+        "--minShared",
+        type=float,
+        default=0.05,
+        help="Minimum estimated fraction of shared k-mers for a pair to be aligned. Fraction is of the smaller sequence.",
+    )
+    parser.add_argument(
+        "--savePairs",
+        type=str,
+        default=None,
+        help="Optional: Write prefiltered pairs to this file, for use with --pairs.",
+    )
+    # Instrumentation
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default=None,
+        help="Optional: Write wall time, CPU time and peak memory of each stage, with the number and duration of LASTZ jobs and hits kept, to this JSON file.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Optional: Write cProfile data for the main thread to this file.",
+    )
     args = parser.parse_args()
     return args
 
@@ -82,18 +230,31 @@ def missing_tool(tool_name):
         return []
 
 
-def set_paths(args):
-    # Check that A/B genome directories exist
-    if not os.path.isdir(args.adir):
-        print("Target sequence directory not found: %s" % args.adir)
+def check_genomes(args):
+    """Check genome inputs and create the output directory.
+    Returns (adir, bdir, outdir), with adir and bdir None for multifasta input."""
+    # Check that A/B genome directories or multifasta files exist
+    for genome, seqdir, fasta in (
+        ("Target", args.adir, args.target),
+        ("Query", args.bdir, args.query),
+    ):
+        if bool(seqdir) == bool(fasta):
+            print(
+                "Provide one of a sequence directory or multifasta for %s genome."
+                % genome
+            )
+            sys.exit(1)
+        if seqdir and not os.path.isdir(seqdir):
+            print("%s sequence directory not found: %s" % (genome, seqdir))
+            sys.exit(1)
+        if fasta and not os.path.isfile(fasta):
+            print("%s genome file not found: %s" % (genome, fasta))
+            sys.exit(1)
+    if bool(args.adir) != bool(args.bdir):
+        print("Provide both genomes as sequence directories, or both as multifasta.")
         sys.exit(1)
-    else:
-        adir = os.path.abspath(args.adir)
-    if not os.path.isdir(args.bdir):
-        print("Query sequence directory not found: %s" % args.bdir)
-        sys.exit(1)
-    else:
-        bdir = os.path.abspath(args.bdir)
+    adir = os.path.abspath(args.adir) if args.adir else None
+    bdir = os.path.abspath(args.bdir) if args.bdir else None
     # Set outdir
     if args.outdir:
         outdir = os.path.abspath(args.outdir)
@@ -101,9 +262,49 @@ def set_paths(args):
             os.makedirs(outdir)
     else:
         outdir = os.getcwd()
+    return adir, bdir, outdir
+
+
+def set_paths(args):
+    adir, bdir, outdir = check_genomes(args)
     # Compose path to outfile
     outtab = os.path.join(outdir, args.outfile)
-    return adir, bdir, outdir, outtab
+    if args.binOut:
+        outbin = os.path.join(outdir, args.binOut)
+    else:
+        outbin = None
+    return adir, bdir, outdir, outtab, outbin
+
+
+def get_pairs(args, adir_path, bdir_path):
+    """Return list of target:query pairs to align, from --pairs or all
+    combinations of A and B genome sequences."""
+    # Index multifasta genomes
+    try:
+        Aindex = tinscan.FastaIndex(args.target) if args.target else None
+        Bindex = tinscan.FastaIndex(args.query) if args.query else None
+    except (OSError, ValueError) as error:
+        print(str(error), "Quitting.")
+        sys.exit(1)
+    # Import file names to be compaired if set
+    if args.pairs and os.path.isfile(args.pairs) and Aindex:
+        try:
+            pairs = tinscan.import_fasta_pairs(
+                file=os.path.abspath(args.pairs), Aindex=Aindex, Bindex=Bindex
+            )
+        except tinscan.Error as error:
+            print(str(error), "Quitting.")
+            sys.exit(1)
+    elif args.pairs and os.path.isfile(args.pairs):
+        pairs = tinscan.import_pairs(
+            file=os.path.abspath(args.pairs), Adir=adir_path, Bdir=bdir_path
+        )
+    # Else run all pairwise alignments between A and B genomes
+    elif Aindex:
+        pairs = tinscan.get_all_fasta_pairs(Aindex=Aindex, Bindex=Bindex)
+    else:
+        pairs = tinscan.get_all_pairs(Adir=adir_path, Bdir=bdir_path)
+    return pairs
 
 
 def main():
@@ -111,29 +312,111 @@ def main():
     # Get cmd line args
     args = mainArgs()
     # Check for LASTZ
-    if missing_tool(args.lzpath):
+    if not args.dryRun and missing_tool(args.lzpath):
         print("LASTZ executable was not found at: %s \n Quitting." % args.lzpath)
         sys.exit(1)
     # Set output paths
-    adir_path, bdir_path, outdir, outtab = set_paths(args)
-    # Import file names to be compaired if set
-    if args.pairs and os.path.isfile(args.pairs):
-        pairs = tinscan.import_pairs(
-            file=os.path.abspath(args.pairs), Adir=adir_path, Bdir=bdir_path
+    adir_path, bdir_path, outdir, outtab, outbin = set_paths(args)
+    metrics = tinscan.Metrics("tinscan-align")
+    with tinscan.profiled(args.profile):
+        alignPairs(args, adir_path, bdir_path, outdir, outtab, outbin, metrics)
+    if args.metrics:
+        metrics.write(args.metrics)
+    print("Finished!")
+
+
+def alignPairs(args, adir_path, bdir_path, outdir, outtab, outbin, metrics):
+    """Compose, filter and align target:query pairs, timing each stage."""
+    # Compose target:query pairs
+    with metrics.stage("pairs"):
+        pairs = get_pairs(args, adir_path, bdir_path)
+    metrics.count("pairs", len(pairs))
+    # Check window settings
+    if args.window is not None and not 0 <= args.overlap < args.window:
+        print("--overlap must be smaller than --window.")
+        sys.exit(1)
+    # Drop pairs with little shared content
+    if args.prefilter:
+        if not 0 < args.sketchK <= 31:
+            print("--sketchK must be between 1 and 31.")
+            sys.exit(1)
+        total = len(pairs)
+        with metrics.stage("prefilter"):
+            pairs, scores = tinscan.prefilterPairs(
+                pairs,
+                k=args.sketchK,
+                scale=args.sketchScale,
+                minShared=args.minShared,
+                threads=args.threads,
+            )
+        metrics.count("pairsPrefiltered", total - len(pairs))
+        print("Prefilter kept %s of %s pairs." % (len(pairs), total))
+        if args.savePairs:
+            tinscan.writePairs(pairs, os.path.join(outdir, args.savePairs))
+    # Report schedule without aligning
+    if args.dryRun:
+        jobs, schedule = tinscan.plan_pairs(
+            pairs,
+            threads=args.threads,
+            window=args.window,
+            overlap=args.overlap,
+            batchSize=args.batchQueries,
         )
-    # Else run all pairwise alignments between A and B genomes
+        print(tinscan.format_schedule(schedule, jobs))
+        sys.exit(0)
+    # Select pairs for this shard
+    pairIds = None
+    comment = None
+    if args.shard:
+        try:
+            shard, shards = tinscan.parse_shard(args.shard)
+        except tinscan.Error as error:
+            print(str(error), "Quitting.")
+            sys.exit(1)
+        if outbin:
+            print("--binOut can not be used with --shard, use tinscan-merge --binOut.")
+            sys.exit(1)
+        comment = tinscan.shard_comment(
+            shard, shards, len(pairs), tinscan.pairs_digest(pairs)
+        )
+        assigned = tinscan.shard_pairs(pairs, shards)
+        pairIds = [i for i, s in enumerate(assigned) if s == shard]
+        pairs = [pairs[i] for i in pairIds]
+        outtab = "%s.shard%sof%s.tab" % (os.path.splitext(outtab)[0], shard, shards)
+        print("Shard %s/%s: %s pairs." % (shard, shards, len(pairs)))
+    # Open alignment cache
+    if args.cache:
+        cache = tinscan.AlignmentCache(args.cache, maxSize=args.cacheSize * 1024**2)
     else:
-        pairs = tinscan.get_all_pairs(Adir=adir_path, Bdir=bdir_path)
-    # Compose alignment commands
-    cmds = tinscan.LASTZ_cmds(
-        lzpath=args.lzpath,
-        pairs=pairs,
-        minIdt=args.minIdt,
-        minLen=args.minLen,
-        hspthresh=args.hspthresh,
-        outfile=outtab,
-        verbose=args.verbose,
-    )
+        cache = None
     # Run alignments
-    tinscan.run_cmd(cmds, verbose=args.verbose)
-    print("Finished!")
+    try:
+        tinscan.run_pairs(
+            lzpath=args.lzpath,
+            pairs=pairs,
+            minIdt=args.minIdt,
+            minLen=args.minLen,
+            hspthresh=args.hspthresh,
+            outfile=outtab,
+            threads=args.threads,
+            cache=cache,
+            verbose=args.verbose,
+            window=args.window,
+            overlap=args.overlap,
+            batchSize=args.batchQueries,
+            workdir=args.workdir,
+            timeout=args.timeout,
+            retries=args.retries,
+            progress=not args.noProgress,
+            pairIds=pairIds,
+            comment=comment,
+            tmpdir=args.tmpdir,
+            metrics=metrics,
+            binfile=outbin,
+        )
+    except tinscan.Error as error:
+        print(" ".join(str(x) for x in error.args), "Quitting.")
+        # Keep the record of completed and failed jobs
+        if args.metrics:
+            metrics.write(args.metrics)
+        sys.exit(1)
@@ -0,0 +1,52 @@
+import argparse
+import os
+import sys
+
+import tinscan
+
+
+def mainArgs():
+    parser = argparse.ArgumentParser(
+        description="Convert tab delimited LASTZ alignment data to tinscan binary format for fast loading by tinscan-find.",
+        prog="tinscan-convert",
+    )
+    parser.add_argument(
+        "-i",
+        "--infile",
+        type=str,
+        required=True,
+        help="Input file containing tab delimited LASTZ alignment data.",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        type=str,
+        default=None,
+        help="Name of binary alignment file. (Default: infile with '.tbin' extension)",
+    )
+    parser.add_argument(
+        "--minIdent",
+        type=float,
+        default=0,
+        help="Optional: Minimum identity for a hit to be kept.",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    # Get args
+    args = mainArgs()
+    # Check alignment results file exists
+    if not os.path.isfile(args.infile):
+        print("Alignment results not found: %s" % args.infile)
+        sys.exit(1)
+    # Set output path
+    if args.outfile:
+        outfile = os.path.abspath(args.outfile)
+    else:
+        outfile = os.path.splitext(os.path.abspath(args.infile))[0] + ".tbin"
+    # Read hits and write binary table
+    hits = tinscan.readHitTable(args.infile, minID=args.minIdent)
+    hits.save(outfile)
+    print("Wrote %s hits to: %s" % (len(hits), outfile))
@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+
+import tinscan
+
+
+def mainArgs():
+    parser = argparse.ArgumentParser(
+        description="Combine shard outputs of tinscan-align --shard into a single alignment file.",
+        prog="tinscan-merge",
+    )
+    parser.add_argument(
+        "shards",
+        type=str,
+        nargs="+",
+        help="Shard files written by tinscan-align --shard. All shards of the run are required.",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        type=str,
+        default="tinscan_alignment.tab",
+        help="Name of merged alignment result file.",
+    )
+    parser.add_argument(
+        "--binOut",
+        type=str,
+        default=None,
+        help="Optional: Also write alignments to this file in tinscan binary format, for fast loading by tinscan-find.",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    # Get args
+    args = mainArgs()
+    # Check shard files exist
+    for path in args.shards:
+        if not os.path.isfile(path):
+            print("Shard file not found: %s" % path)
+            sys.exit(1)
+    outfile = os.path.abspath(args.outfile)
+    # Combine shards in pair order
+    try:
+        total = tinscan.merge_shards(args.shards, outfile)
+    except tinscan.Error as error:
+        print(str(error), "Quitting.")
+        sys.exit(1)
+    # Write binary copy of alignments
+    if args.binOut:
+        tinscan.readHitTable(outfile, minID=0).save(os.path.abspath(args.binOut))
+    print(
+        "Merged %s pairs from %s shards into: %s" % (total, len(args.shards), outfile)
+    )
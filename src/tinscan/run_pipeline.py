@@ -0,0 +1,113 @@
+import argparse
+import os
+import sys
+
+import tinscan
+from tinscan.pipeline import stream_insertions
+from tinscan.run_align import add_align_args, check_genomes, get_pairs, missing_tool
+from tinscan.run_scan import add_find_args
+
+
+def mainArgs():
+    parser = argparse.ArgumentParser(
+        description="Align B genome (query) sequences onto A genome (target) using LASTZ and report candidate insertions as alignments finish.",
+        prog="tinscan-run",
+    )
+    add_align_args(parser)
+    add_find_args(parser)
+    parser.add_argument(
+        "--alignOut",
+        type=str,
+        default=None,
+        help="Optional: Also write alignments to this file, as from tinscan-align.",
+    )
+    parser.add_argument(
+        "--idWidth",
+        type=int,
+        default=7,
+        help="Zero-pad feature IDs to this many digits.",
+    )
+    # Instrumentation
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default=None,
+        help="Optional: Write wall time, CPU time and peak memory, with the number and duration of LASTZ jobs, hits read and kept, pairs examined and accepted, and features written, to this JSON file.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Optional: Write cProfile data for the main thread to this file.",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def set_paths(args):
+    adir, bdir, outdir = check_genomes(args)
+    # Compose paths to outfiles
+    gffout = os.path.join(outdir, args.gffOut)
+    if args.alignOut:
+        alignout = os.path.join(outdir, args.alignOut)
+    else:
+        alignout = None
+    return adir, bdir, gffout, alignout
+
+
+def main():
+    """Align genomes and scan alignments for insertions in a single pass."""
+    # Get cmd line args
+    args = mainArgs()
+    # Check for LASTZ
+    if missing_tool(args.lzpath):
+        print("LASTZ executable was not found at: %s \n Quitting." % args.lzpath)
+        sys.exit(1)
+    if args.window is not None and not 0 <= args.overlap < args.window:
+        print("--overlap must be smaller than --window.")
+        sys.exit(1)
+    # Inserts longer than the overlap can be split between windows
+    if args.window is not None and args.overlap < args.maxInsert:
+        print("--overlap must be at least --maxInsert when --window is set.")
+        sys.exit(1)
+    # Set output paths
+    adir_path, bdir_path, gffout, alignout = set_paths(args)
+    metrics = tinscan.Metrics("tinscan-run")
+    # Compose target:query pairs
+    with metrics.stage("pairs"):
+        pairs = get_pairs(args, adir_path, bdir_path)
+    metrics.count("pairs", len(pairs))
+    # Open alignment cache
+    if args.cache:
+        cache = tinscan.AlignmentCache(args.cache, maxSize=args.cacheSize * 1024**2)
+    else:
+        cache = None
+    # Align pairs and write candidates as each bucket of hits is complete
+    try:
+        with tinscan.profiled(args.profile), metrics.stage("run"):
+            total = stream_insertions(
+                pairs,
+                args,
+                gffout,
+                alignOut=alignout,
+                idWidth=args.idWidth,
+                workdir=args.workdir,
+                tmpdir=args.tmpdir,
+                cache=cache,
+                progress=not args.noProgress,
+                metrics=metrics,
+                cluster=args.cluster,
+            )
+    except tinscan.Error as error:
+        print(" ".join(str(x) for x in error.args), "Quitting.")
+        if args.metrics:
+            metrics.write(args.metrics)
+        sys.exit(1)
+    metrics.count("candidates", total)
+    # Index candidates for region queries
+    if args.index:
+        with metrics.stage("index"):
+            tinscan.buildIndex(gffout)
+    if args.metrics:
+        metrics.write(args.metrics)
+    print("Found %s candidate insertions: %s" % (total, gffout))
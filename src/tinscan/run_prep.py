@@ -1,10 +1,14 @@
+from concurrent.futures import ProcessPoolExecutor
 from shlex import quote
 import argparse
+import gzip
 import os
 import sys
 
 from Bio import SeqIO
 
+from tinscan.metrics import Metrics, profiled, profiledCall
+
 
 def mainArgs():
     parser = argparse.ArgumentParser(
@@ -17,10 +21,14 @@ def mainArgs():
         "--target",
         type=str,
         required=True,
-        help="Multifasta containing A genome.",
+        help="Multifasta containing A genome. May be gzipped.",
     )
     parser.add_argument(
-        "-B", "--query", type=str, required=True, help="Multifasta containing B genome."
+        "-B",
+        "--query",
+        type=str,
+        required=True,
+        help="Multifasta containing B genome. May be gzipped.",
     )
     # Output options
     parser.add_argument(
@@ -36,21 +44,78 @@ def mainArgs():
         default=None,
         help="Write split directories within this directory. (Default: cwd)",
     )
+    parser.add_argument(
+        "--biopython",
+        action="store_true",
+        default=False,
+        help="If set, parse and rewrite records with Biopython instead of copying raw sequence lines.",
+    )
+    # Instrumentation
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default=None,
+        help="Optional: Write wall time, CPU time and peak memory of genome splitting to this JSON file.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Optional: Write cProfile data for the main process to this file. Splitting runs in worker processes, profiled to this name with suffixes .A and .B for the two genomes.",
+    )
     args = parser.parse_args()
     return args
 
 
+def openFasta(path, mode="rb"):
+    """Open FASTA file, decompressing gzipped input."""
+    with open(path, "rb") as f:
+        magic = f.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
 def splitFasta(infile, outdir, unique=True):
-    seen = list()
-    for rec in SeqIO.parse(infile, "fasta"):
-        if str(rec.id) in seen and unique:
-            print("Non-unique name in genome: %s. Quitting." % str(rec.id))
-            sys.exit(1)
-        else:
-            seen.append(str(rec.id))
-        outfile = os.path.join(outdir, rec.id + ".fa")
-        with open(outfile, "w") as handle:
-            SeqIO.write(rec, handle, "fasta")
+    """Split multifasta into one file per record using Biopython."""
+    seen = set()
+    with openFasta(infile, "rt") as handle:
+        for rec in SeqIO.parse(handle, "fasta"):
+            if str(rec.id) in seen and unique:
+                raise ValueError("Non-unique name in genome: %s." % str(rec.id))
+            else:
+                seen.add(str(rec.id))
+            outfile = os.path.join(outdir, rec.id + ".fa")
+            with open(outfile, "w") as out:
+                SeqIO.write(rec, out, "fasta")
+
+
+def splitFastaFast(infile, outdir, unique=True):
+    """Split multifasta into one file per record.
+    Header and sequence lines are copied as raw bytes without parsing records.
+    Output files are named for the first word of each header, as in splitFasta."""
+    seen = set()
+    out = None
+    try:
+        with openFasta(infile) as f:
+            for line in f:
+                if line.startswith(b">"):
+                    if out:
+                        out.close()
+                    words = line[1:].split(None, 1)
+                    name = words[0].decode() if words else ""
+                    if name in seen and unique:
+                        raise ValueError("Non-unique name in genome: %s." % name)
+                    seen.add(name)
+                    out = open(os.path.join(outdir, name + ".fa"), "wb")
+                    out.write(line.rstrip() + b"\n")
+                elif out:
+                    line = line.rstrip()
+                    if line:
+                        out.write(line + b"\n")
+    finally:
+        if out:
+            out.close()
 
 
 def isfile(path):
@@ -97,5 +162,36 @@ def main():
     # Check files and set outpaths
     A_genome, B_genome, A_dir, B_dir = check_paths(args)
     # Read and split input genomes - enforce unique names within genomes
-    splitFasta(A_genome, A_dir)
-    splitFasta(B_genome, B_dir)
+    if args.biopython:
+        splitter = splitFasta
+    else:
+        splitter = splitFastaFast
+    metrics = Metrics("tinscan-prep")
+    # Split A and B genomes concurrently
+    with profiled(args.profile), metrics.stage("split"):
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            jobs = list()
+            for suffix, genome, outdir in (
+                (".A", A_genome, A_dir),
+                (".B", B_genome, B_dir),
+            ):
+                if args.profile:
+                    jobs.append(
+                        pool.submit(
+                            profiledCall,
+                            args.profile + suffix,
+                            splitter,
+                            genome,
+                            outdir,
+                        )
+                    )
+                else:
+                    jobs.append(pool.submit(splitter, genome, outdir))
+            for job in jobs:
+                try:
+                    job.result()
+                except ValueError as error:
+                    print(str(error), "Quitting.")
+                    sys.exit(1)
+    if args.metrics:
+        metrics.write(args.metrics)
@@ -0,0 +1,150 @@
+import argparse
+import os
+import sys
+
+import tinscan
+
+
+def mainArgs():
+    parser = argparse.ArgumentParser(
+        description="Report candidate insertions, TSDs and flanks overlapping or nearest to regions of the target genome, using an interval index of tinscan-find output.",
+        prog="tinscan-query",
+    )
+    parser.add_argument(
+        "-i",
+        "--gff",
+        type=str,
+        required=True,
+        help="GFF3 file of candidates from tinscan-find or tinscan-run. Indexed as gff + '.tidx', which is created if missing or out of date.",
+    )
+    parser.add_argument(
+        "-r",
+        "--region",
+        type=str,
+        nargs="+",
+        default=list(),
+        help="Regions to query as seqid, seqid:pos or seqid:start-end (1-based, inclusive).",
+    )
+    parser.add_argument(
+        "--bed",
+        type=str,
+        default=None,
+        help="Optional: BED file of regions to query, e.g. genes or loci.",
+    )
+    parser.add_argument(
+        "--nearest",
+        action="store_true",
+        default=False,
+        help="If set, report the closest feature to each region and its distance in bases, instead of all overlapping features.",
+    )
+    parser.add_argument(
+        "--type",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Optional: Only report features of these types, e.g. Candidate_Insertion Candidate_TSD InsertFlank.",
+    )
+    parser.add_argument(
+        "-o",
+        "--outfile",
+        type=str,
+        default=None,
+        help="Write results to this file. (Default: stdout)",
+    )
+    parser.add_argument(
+        "--buildOnly",
+        action="store_true",
+        default=False,
+        help="If set, build the index and exit.",
+    )
+    args = parser.parse_args()
+    return args
+
+
+def readBed(infile):
+    """Read regions from a BED file as (seqid, start, end) (idx '1', inclusive)."""
+    regions = list()
+    with open(infile) as f:
+        for line in f:
+            li = line.rstrip("\n").split("\t")
+            if not li[0] or li[0].startswith(("#", "track", "browser")):
+                continue
+            regions.append((li[0], int(li[1]) + 1, int(li[2])))
+    return regions
+
+
+def main():
+    # Get args
+    args = mainArgs()
+    # Check candidates file exists
+    if not os.path.isfile(args.gff):
+        print("Candidates file not found: %s" % args.gff)
+        sys.exit(1)
+    # Open index, building it if required
+    try:
+        index = tinscan.CandidateIndex(args.gff)
+    except ValueError as error:
+        print(str(error), "Quitting.")
+        sys.exit(1)
+    if args.buildOnly:
+        print("Indexed %s features: %s" % (len(index), index.indexpath))
+        return
+    # Collect query regions
+    try:
+        regions = [tinscan.parseRegion(x) for x in args.region]
+    except ValueError as error:
+        print(str(error))
+        sys.exit(1)
+    if args.bed:
+        if not os.path.isfile(args.bed):
+            print("BED file not found: %s" % args.bed)
+            sys.exit(1)
+        regions += readBed(args.bed)
+    if not regions:
+        print("Provide regions to query with --region or --bed.")
+        sys.exit(1)
+    out = open(args.outfile, "w") if args.outfile else sys.stdout
+    try:
+        if args.nearest:
+            # Tabulate closest feature to each region
+            out.write(
+                "#query\tdistance\tseqid\tsource\ttype\tstart\tend\tscore\tstrand\tphase\tattributes\n"
+            )
+            for seqid, start, end in regions:
+                hits = index.region(seqid, start, end, args.type)
+                if hits:
+                    feature = hits[0]
+                elif end is None:
+                    # No features on this sequence
+                    continue
+                else:
+                    # Closest of the features nearest each end of the region
+                    found = [
+                        x
+                        for x in (
+                            index.nearest(seqid, start, args.type),
+                            index.nearest(seqid, end, args.type),
+                        )
+                        if x is not None
+                    ]
+                    if not found:
+                        continue
+                    feature = min(found, key=lambda x: x.distance)
+                if end is None:
+                    label = seqid
+                else:
+                    label = "%s:%s-%s" % (seqid, start, end)
+                out.write("%s\t%s\t%s" % (label, feature.distance, feature.line))
+        else:
+            # Write overlapping features as GFF, once each
+            out.write("#gff-version 3\n")
+            seen = set()
+            for seqid, start, end in regions:
+                for feature in index.region(seqid, start, end, args.type):
+                    if (seqid, feature.line) not in seen:
+                        seen.add((seqid, feature.line))
+                        out.write(feature.line)
+    finally:
+        index.close()
+        if args.outfile:
+            out.close()
@@ -1,27 +1,15 @@
 import argparse
+import itertools
 import os
 import sys
 
 import tinscan as ts
 
 
-def mainArgs():
-    parser = argparse.ArgumentParser(
-        description="Parse whole genome alignments for signatures of transposon insertion.",
-        prog="tinscan-find",
-    )
-    # Input
-    parser.add_argument(
-        "-i",
-        "--infile",
-        type=str,
-        required=True,
-        help="Input file containing tab delimited LASTZ alignment data.",
-    )
+def add_find_args(parser):
+    """Add candidate output options and insert scan settings shared by
+    tinscan-find and tinscan-run to parser."""
     # Output
-    parser.add_argument(
-        "--outdir", default=None, help="Optional: Directory to write output to."
-    )
     parser.add_argument(
         "--gffOut",
         type=str,
@@ -34,6 +22,18 @@ def mainArgs():
         default=True,
         help="If set, do not report flanking hit regions in GFF.",
     )
+    parser.add_argument(
+        "--cluster",
+        action="store_true",
+        default=False,
+        help="If set, merge candidates with overlapping inserts on the same target into one record, with the best flank identities of the cluster reported as members, bestLeftID and bestRightID.",
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        default=False,
+        help="If set, also write an interval index of candidates to gffOut + '.tidx', for region queries with tinscan-query.",
+    )
     # Insert scan settings
     parser.add_argument(
         "--maxTSD",
@@ -71,6 +71,90 @@ def mainArgs():
         default=20,
         help="Maximum divergence in identity (to query) allowed between insert flanking sequences.",
     )
+
+
+def mainArgs():
+    parser = argparse.ArgumentParser(
+        description="Parse whole genome alignments for signatures of transposon insertion.",
+        prog="tinscan-find",
+    )
+    # Input
+    parser.add_argument(
+        "-i",
+        "--infile",
+        type=str,
+        required=True,
+        help="Input file containing tab delimited LASTZ alignment data.",
+    )
+    # Output
+    parser.add_argument(
+        "--outdir", default=None, help="Optional: Directory to write output to."
+    )
+    add_find_args(parser)
+    parser.add_argument(
+        "--genome",
+        type=str,
+        default=None,
+        help="Optional: Multifasta of the target (A) genome. If set, write insert, flank and TSD sequences of candidates to --seqOut, and report TSD identity in GFF. Read through a .fai index, which is created if missing.",
+    )
+    parser.add_argument(
+        "--seqOut",
+        type=str,
+        default=None,
+        help="Write candidate sequences to this fasta file. (Default: --gffOut name with .fa extension)",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of processes to use when pairing hits.",
+    )
+    parser.add_argument(
+        "--state",
+        type=str,
+        default=None,
+        help="Optional: Keep fingerprints and hit pairs of each Target:Query bucket in this directory. On re-runs, only buckets whose hits or pairing settings changed are searched again.",
+    )
+    # Parameter sweep
+    parser.add_argument(
+        "--sweep",
+        type=str,
+        default=None,
+        help="Optional: File listing values to test for any of minIdent, maxIdentDiff, minInsert, maxInsert, qGap, maxTSD. One setting per line followed by its values. Every combination is evaluated in a single pass and summarised in --sweepOut.",
+    )
+    parser.add_argument(
+        "--sweepOut",
+        type=str,
+        default="sweep_summary.tsv",
+        help="Write candidate counts for each sweep combination to this file.",
+    )
+    parser.add_argument(
+        "--sweepGFF",
+        action="store_true",
+        default=False,
+        help="If set, also write a gff3 file for each sweep combination.",
+    )
+    # Validation
+    parser.add_argument(
+        "--naivePairs",
+        action="store_true",
+        default=False,
+        help="If set, pair hits with the original all-vs-all search. Slow on large inputs, use to validate results.",
+    )
+    # Instrumentation
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        default=None,
+        help="Optional: Write wall time, CPU time and peak memory of each stage, with counts of hits read and kept, pairs examined and accepted, and features written, to this JSON file.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Optional: Write cProfile data for the main process to this file. With --threads > 1, hits are paired in worker processes, which are not profiled.",
+    )
     args = parser.parse_args()
     return args
 
@@ -87,21 +171,184 @@ def set_paths(args):
             os.makedirs(outdir)
     else:
         outdir = os.getcwd()
+    # Check target genome exists
+    if args.genome and not os.path.isfile(args.genome):
+        print("Target genome file not found: %s" % args.genome)
+        sys.exit(1)
+    # Bucket state is only kept for the sort-and-sweep search
+    if args.state and (args.sweep or args.naivePairs):
+        print("--state cannot be used with --sweep or --naivePairs.")
+        sys.exit(1)
+    if args.cluster and args.sweep:
+        print("--cluster cannot be used with --sweep.")
+        sys.exit(1)
     # Compose path to outfile
     gffout = os.path.join(outdir, args.gffOut)
-    return gffout
+    return gffout, outdir
+
+
+def readGrid(infile, args):
+    """Read sweep settings file. Each non-comment line names a setting followed
+    by one or more values, separated by whitespace or commas. Return a list of
+    settings namespaces, one per combination of values. Settings not listed
+    keep their command line values."""
+    grid = dict()
+    with open(infile) as f:
+        for line in f:
+            li = line.replace(",", " ").split()
+            if not li or li[0].startswith("#"):
+                continue
+            if li[0] not in ts.SWEEP_PARAMS:
+                print(
+                    "Unknown sweep setting: %s. Choose from: %s"
+                    % (li[0], ", ".join(ts.SWEEP_PARAMS))
+                )
+                sys.exit(1)
+            if li[0] == "maxIdentDiff":
+                cast = float
+            else:
+                cast = int
+            if len(li) < 2:
+                print("Invalid value for sweep setting %s: no values given" % li[0])
+                sys.exit(1)
+            grid[li[0]] = list()
+            for x in li[1:]:
+                try:
+                    grid[li[0]].append(cast(x))
+                except ValueError:
+                    print("Invalid value for sweep setting %s: %s" % (li[0], x))
+                    sys.exit(1)
+    names = list(grid)
+    points = list()
+    for values in itertools.product(*[grid[name] for name in names]):
+        point = argparse.Namespace(**vars(args))
+        for name, value in zip(names, values):
+            setattr(point, name, value)
+        points.append(point)
+    return points
+
+
+def runSweep(args, gffout, outdir):
+    """Evaluate all sweep combinations from a single read of the alignments."""
+    points = readGrid(args.sweep, args)
+    minID = min(p.minIdent for p in points)
+    hits = ts.readHitTable(args.infile, minID=minID)
+    fillLen = len(str(len(points)))
+    with open(os.path.join(outdir, args.sweepOut), "w") as summary:
+        summary.write(
+            "\t".join(["#point"] + list(ts.SWEEP_PARAMS) + ["candidates", "TSDs"])
+            + "\n"
+        )
+        if args.sweepGFF:
+            results = ts.sweepHitPairs(hits, points, threads=args.threads)
+        else:
+            results = ts.sweepCounts(hits, points, threads=args.threads)
+        for i, result in enumerate(results, start=1):
+            pointID = str(i).zfill(fillLen)
+            if args.sweepGFF:
+                point, validPairs = result
+                candidates = len(validPairs)
+                TSDs = sum(1 for pair in validPairs if ts.getTSDlen(pair))
+                pointgff = os.path.splitext(gffout)[0] + "_sweep" + pointID + ".gff3"
+                with open(pointgff, "w") as f:
+                    for x in ts.writeGFFlines(validPairs, args.noflanks):
+                        f.write(x)
+            else:
+                point, candidates, TSDs = result
+            summary.write(
+                "\t".join(
+                    [pointID]
+                    + [str(getattr(point, name)) for name in ts.SWEEP_PARAMS]
+                    + [str(candidates), str(TSDs)]
+                )
+                + "\n"
+            )
+
+
+def findInsertions(args, gffout, outdir, metrics):
+    """Read alignments, pair hits and write candidates, timing each stage."""
+    # Read in LASTZ hits file
+    with metrics.stage("read"):
+        if args.naivePairs:
+            hits = ts.readLASTZ(args.infile, minID=args.minIdent, metrics=metrics)
+        else:
+            hits = ts.readHitTable(args.infile, minID=args.minIdent, metrics=metrics)
+    # Screen for candidate insertion events
+    with metrics.stage("pair"):
+        try:
+            validPairs = ts.getHitPairs(
+                hits,
+                args,
+                naive=args.naivePairs,
+                threads=args.threads,
+                metrics=metrics,
+                state=ts.FindState(args.state) if args.state else None,
+            )
+        except ValueError as error:
+            print(str(error), "Quitting.")
+            sys.exit(1)
+    # Merge overlapping candidates
+    attributes = None
+    if args.cluster:
+        metrics.count("unclusteredCandidates", len(validPairs))
+        with metrics.stage("cluster"):
+            validPairs, attributes = ts.clusterPairs(validPairs)
+    # Open target genome for sequence extraction
+    if args.genome:
+        try:
+            genome = ts.FastaIndex(args.genome)
+        except (OSError, ValueError) as error:
+            print(str(error), "Quitting.")
+            sys.exit(1)
+    else:
+        genome = None
+    # Write insert, flank and TSD sequences, checking candidates lie in genome
+    if genome is not None:
+        if args.seqOut:
+            seqout = os.path.join(outdir, args.seqOut)
+        else:
+            seqout = os.path.splitext(gffout)[0] + ".fa"
+        try:
+            with metrics.stage("extract"):
+                metrics.count(
+                    "sequencesWritten",
+                    ts.writeCandidateSeqs(validPairs, genome, seqout),
+                )
+        except ts.Error as error:
+            print(str(error), "Quitting.")
+            sys.exit(1)
+    # Write insertions and TSDs to gff file
+    with metrics.stage("write"):
+        features = 0
+        with open(gffout, "w") as f:
+            for x in ts.writeGFFlines(
+                validPairs, args.noflanks, genome=genome, attributes=attributes
+            ):
+                f.write(x)
+                features += 1
+        # Count features, not the header
+        metrics.count("featuresWritten", features - 1)
+        metrics.count("candidates", len(validPairs))
+    # Index candidates for region queries
+    if args.index:
+        with metrics.stage("index"):
+            ts.buildIndex(gffout)
+    if genome is not None:
+        genome.close()
 
 
 def main():
     # Get args
     args = mainArgs()
     # Check existence of output directory
-    gffout = set_paths(args)
-    # Read in LASTZ hits file
-    hits = ts.readLASTZ(args.infile, minID=args.minIdent)
-    # Screen for candidate insertion events
-    validPairs = ts.getHitPairs(hits, args)
-    # Write insertions and TSDs to gff file
-    with open(gffout, "w") as f:
-        for x in ts.writeGFFlines(validPairs, args.noflanks):
-            f.write(x)
+    gffout, outdir = set_paths(args)
+    metrics = ts.Metrics("tinscan-find")
+    with ts.profiled(args.profile):
+        # Evaluate grid of settings
+        if args.sweep:
+            with metrics.stage("sweep"):
+                runSweep(args, gffout, outdir)
+        else:
+            findInsertions(args, gffout, outdir, metrics)
+    if args.metrics:
+        metrics.write(args.metrics)
@@ -0,0 +1,175 @@
+from collections import namedtuple
+import heapq
+import os
+import sys
+import threading
+import time
+
+from .faidx import QueryBatch, SeqRef, TargetWindow, seq_name
+
+# Fixed cost of a LASTZ job, in bases. Covers process start-up and seeding.
+JOB_OVERHEAD = 200000
+
+# Jobs costing less than this many bases are packed together into batches
+# of about this size, so that tiny pairs do not each occupy a worker
+PACK_SIZE = 2000000
+
+# Jobs run one after another by a single worker, and their estimated cost
+Batch = namedtuple("Batch", ["jobs", "cost"])
+
+# Planned order of batches, predicted worker loads and finish time
+Schedule = namedtuple("Schedule", ["batches", "loads", "makespan", "total"])
+
+
+def seq_length(x):
+    """Estimated length of sequence x: a TargetWindow, QueryBatch, SeqRef, or a
+    path to a fasta file. File sizes are used when no index is available."""
+    if isinstance(x, QueryBatch):
+        return sum(seq_length(q) for q in x.queries)
+    if isinstance(x, TargetWindow):
+        return x.end - x.start
+    if isinstance(x, SeqRef):
+        return x.index.length(x.name)
+    return os.path.getsize(x)
+
+
+def job_cost(A, B):
+    """Estimated cost of aligning query B onto target A, in bases.
+    LASTZ run time grows with the length of both sequences."""
+    return JOB_OVERHEAD + seq_length(A) + seq_length(B)
+
+
+def plan_jobs(jobs, threads=1, packSize=PACK_SIZE):
+    """Order (pair index, target, query) jobs longest-processing-time first.
+    Jobs cheaper than packSize are packed into batches of about packSize, or
+    smaller if needed to give each worker several batches.
+    Returns a Schedule with batches in dispatch order and the worker loads
+    predicted by assigning each batch to the next free worker."""
+    costs = [job_cost(A, B) for _, A, B in jobs]
+    order = sorted(range(len(jobs)), key=lambda i: -costs[i])
+    packSize = min(packSize, sum(costs) / (4 * max(1, threads)))
+    batches = list()
+    packed = list()
+    packedCost = 0
+    for i in order:
+        if costs[i] >= packSize:
+            batches.append(Batch([i], costs[i]))
+            continue
+        packed.append(i)
+        packedCost += costs[i]
+        if packedCost >= packSize:
+            batches.append(Batch(packed, packedCost))
+            packed = list()
+            packedCost = 0
+    if packed:
+        batches.append(Batch(packed, packedCost))
+    batches.sort(key=lambda batch: -batch.cost)
+    # Simulate workers taking the next batch as they become free
+    loads = [0] * max(1, threads)
+    heap = [(0, w) for w in range(len(loads))]
+    for batch in batches:
+        load, w = heapq.heappop(heap)
+        loads[w] = load + batch.cost
+        heapq.heappush(heap, (loads[w], w))
+    return Schedule(batches, loads, max(loads), sum(costs))
+
+
+def _job_label(job):
+    _, A, B = job
+    return "%s vs %s" % (seq_name(A), seq_name(B))
+
+
+def format_schedule(schedule, jobs):
+    """Return a text report of a planned schedule."""
+    lines = [
+        "# Batch\tJobs\tEst_Mbp\tPairs",
+    ]
+    for n, batch in enumerate(schedule.batches):
+        lines.append(
+            "\t".join(
+                [
+                    str(n + 1),
+                    str(len(batch.jobs)),
+                    "%.2f" % (batch.cost / 1e6),
+                    ", ".join(_job_label(jobs[i]) for i in batch.jobs),
+                ]
+            )
+        )
+    workers = len(schedule.loads)
+    makespan = schedule.makespan or 1
+    lines.append(
+        "# %s jobs in %s batches on %s workers"
+        % (len(jobs), len(schedule.batches), workers)
+    )
+    lines.append(
+        "# Predicted makespan: %.2f Mbp (serial: %.2f Mbp, speedup %.2fx, worker use %.0f%%)"
+        % (
+            schedule.makespan / 1e6,
+            schedule.total / 1e6,
+            schedule.total / makespan,
+            100.0 * schedule.total / (makespan * workers),
+        )
+    )
+    return "\n".join(lines)
+
+
+def _clock(seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class Progress(object):
+    """Report jobs done, throughput and estimated time remaining while jobs run.
+    Throughput and ETA are based on estimated job costs (see job_cost).
+    Reports are written to stream at most every interval seconds."""
+
+    def __init__(self, jobs, todo, stream=None, interval=5.0):
+        self.costs = {j: job_cost(jobs[j][1], jobs[j][2]) for j in todo}
+        self.total = len(todo)
+        self.totalCost = sum(self.costs.values())
+        self.done = 0
+        self.doneCost = 0
+        self.stream = stream or sys.stderr
+        self.interval = interval
+        self.start = time.time()
+        self.last = None
+        self.reported = 0
+        self._lock = threading.Lock()
+
+    def update(self, j):
+        """Record job j as finished."""
+        with self._lock:
+            self.done += 1
+            self.doneCost += self.costs[j]
+            now = time.time()
+            if self.last is None or now - self.last >= self.interval:
+                self._report(now)
+
+    def finish(self):
+        """Report final totals, unless the last report already covered them."""
+        with self._lock:
+            if self.last is None or self.reported != self.done:
+                self._report(time.time())
+
+    def _report(self, now):
+        self.last = now
+        self.reported = self.done
+        elapsed = now - self.start
+        rate = self.doneCost / elapsed if elapsed > 0 else 0
+        if rate:
+            eta = _clock((self.totalCost - self.doneCost) / rate)
+        else:
+            eta = "?"
+        print(
+            "Aligned %s of %s jobs (%.0f%%), %.2f Mbp/s, elapsed %s, ETA %s"
+            % (
+                self.done,
+                self.total,
+                100.0 * self.doneCost / (self.totalCost or 1),
+                rate / 1e6,
+                _clock(elapsed),
+                eta,
+            ),
+            file=self.stream,
+            flush=True,
+        )
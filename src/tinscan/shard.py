@@ -0,0 +1,120 @@
+import hashlib
+
+from .LASTZ_wrapper import HEADER, Error
+from .faidx import seq_name
+from .schedule import job_cost
+
+# Size of blocks copied when merging shards
+COPY_BLOCK = 1 << 20
+
+
+def parse_shard(spec):
+    """Parse a shard given as 'i/N' (idx '1'). Returns (i, N)."""
+    try:
+        i, n = [int(x) for x in spec.split("/")]
+    except ValueError:
+        raise Error("Shard must be given as i/N, e.g. 1/4: %s" % spec)
+    if not 1 <= i <= n:
+        raise Error("Shard number must be between 1 and %s: %s" % (n, spec))
+    return i, n
+
+
+def pairs_digest(pairs):
+    """Hash of the sequence names in a pair list. Shards of one run must be
+    made from the same pair list. Names are used rather than paths, so nodes
+    may mount the data at different locations."""
+    h = hashlib.sha1()
+    for A, B in pairs:
+        h.update((seq_name(A) + "\t" + seq_name(B) + "\n").encode())
+    return h.hexdigest()[:20]
+
+
+def shard_pairs(pairs, shards):
+    """Assign pairs to shards balanced by estimated alignment cost.
+    Pairs are placed largest first onto the least loaded shard. The result
+    depends only on the pair list and sequence sizes, so every node computes
+    the same assignment. Returns list of shard numbers (idx '1') for pairs."""
+    costs = [job_cost(A, B) for A, B in pairs]
+    loads = [0] * shards
+    assigned = [None] * len(pairs)
+    for i in sorted(range(len(pairs)), key=lambda i: (-costs[i], i)):
+        s = min(range(shards), key=lambda s: (loads[s], s))
+        loads[s] += costs[i]
+        assigned[i] = s + 1
+    return assigned
+
+
+def shard_comment(i, n, total, digest):
+    """Comment line identifying shard i of n, for a run of total pairs."""
+    return "shard %s/%s pairs=%s digest=%s" % (i, n, total, digest)
+
+
+def read_shard(path):
+    """Scan a shard file written by tinscan-align --shard.
+    Returns (i, N, total pairs, digest, blocks), where blocks is a dict of
+    pair index: (byte offset, byte length) of the hits for that pair."""
+    info = None
+    blocks = dict()
+    current = None
+    pos = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if line.startswith(b"##shard "):
+                fields = line.decode().split()
+                i, n = parse_shard(fields[1])
+                meta = dict(x.split("=", 1) for x in fields[2:])
+                info = (i, n, int(meta["pairs"]), meta["digest"])
+            elif line.startswith(b"##pair "):
+                current = int(line.split()[1])
+                blocks[current] = (pos + len(line), 0)
+            elif current is not None and not line.startswith(b"#"):
+                offset, length = blocks[current]
+                blocks[current] = (offset, length + len(line))
+            pos += len(line)
+    if info is None:
+        raise Error("Not a tinscan-align shard file: %s" % path)
+    return info + (blocks,)
+
+
+def merge_shards(paths, outfile):
+    """Combine shard files into a single alignment table, in original pair
+    order. Checks that all shards of one run are present, each once.
+    Returns number of pairs merged."""
+    shards = dict()
+    run = None
+    for path in paths:
+        i, n, total, digest, blocks = read_shard(path)
+        if run is not None and (n, total, digest) != run:
+            raise Error("Shard is from a different run: %s" % path)
+        run = (n, total, digest)
+        if i in shards:
+            raise Error("Shard %s/%s given more than once: %s" % (i, n, path))
+        shards[i] = (path, blocks)
+    if run is None:
+        raise Error("No shard files given.")
+    n, total, _ = run
+    missing = sorted(set(range(1, n + 1)) - set(shards))
+    if missing:
+        raise Error("Missing shards: %s" % ", ".join("%s/%s" % (i, n) for i in missing))
+    where = dict()
+    for path, blocks in shards.values():
+        for pair, block in blocks.items():
+            where[pair] = (path, block)
+    if sorted(where) != list(range(total)):
+        raise Error("Shards do not cover all %s pairs." % total)
+    handles = {path: open(path, "rb") for path, _ in shards.values()}
+    try:
+        with open(outfile, "wb") as out:
+            out.write(HEADER.encode())
+            for pair in range(total):
+                path, (offset, length) = where[pair]
+                f = handles[path]
+                f.seek(offset)
+                while length > 0:
+                    data = f.read(min(length, COPY_BLOCK))
+                    out.write(data)
+                    length -= len(data)
+    finally:
+        for f in handles.values():
+            f.close()
+    return total
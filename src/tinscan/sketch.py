@@ -0,0 +1,185 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+
+from .faidx import FastaIndex, SeqRef
+
+# Bases of sequence hashed per block
+SKETCH_BLOCK = 1 << 22
+
+# 2-bit codes for nucleotides, 4 marks any other character
+_CODES = np.full(256, 4, dtype=np.uint8)
+for _i, _b in enumerate(b"ACGT"):
+    _CODES[_b] = _i
+    _CODES[ord(chr(_b).lower())] = _i
+
+# FastaIndex objects opened by worker processes, keyed by fasta path
+_INDEXES = dict()
+
+
+def _mix64(x):
+    """splitmix64 finalizer. Spreads k-mer values over the full 64-bit range."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def kmerHashes(seq, k=21):
+    """Return hashes of canonical k-mers in seq (bytes). K-mers containing
+    non-ACGT characters are skipped. k must be <= 31."""
+    codes = _CODES[np.frombuffer(seq, dtype=np.uint8)]
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    # Drop windows containing ambiguous bases
+    bad = np.concatenate(([0], np.cumsum(codes == 4)))
+    valid = (bad[k:] - bad[:-k]) == 0
+    fwd = np.zeros(n, dtype=np.uint64)
+    rev = np.zeros(n, dtype=np.uint64)
+    c = codes.astype(np.uint64) & np.uint64(3)
+    for j in range(k):
+        fwd = (fwd << np.uint64(2)) | c[j : j + n]
+        rev = rev | ((np.uint64(3) - c[j : j + n]) << np.uint64(2 * j))
+    return _mix64(np.minimum(fwd, rev)[valid])
+
+
+def _iterBlocks(x, k):
+    """Yield blocks of sequence x as bytes, overlapping by k - 1 bases.
+    x is a SeqRef, or a path to a fasta file whose records are read end to end."""
+    if isinstance(x, SeqRef):
+        length = x.index.length(x.name)
+        for pos in range(0, max(length - k + 1, 1), SKETCH_BLOCK):
+            yield x.index.fetch(x.name, pos, pos + SKETCH_BLOCK + k - 1)
+        return
+    carry = b""
+    buffer = list()
+    size = 0
+    with open(x, "rb") as f:
+        for line in f:
+            if line.startswith(b">"):
+                continue
+            line = line.rstrip()
+            buffer.append(line)
+            size += len(line)
+            if size >= SKETCH_BLOCK:
+                block = carry + b"".join(buffer)
+                yield block
+                carry = block[-(k - 1) :] if k > 1 else b""
+                buffer = list()
+                size = 0
+    if buffer:
+        yield carry + b"".join(buffer)
+
+
+def sketch(x, k=21, scale=200):
+    """FracMinHash sketch of sequence x: sorted, unique k-mer hashes below
+    2^64 / scale. Keeps about 1 in scale distinct k-mers."""
+    limit = np.uint64((2**64 - 1) // scale)
+    parts = list()
+    for block in _iterBlocks(x, k):
+        h = kmerHashes(block, k)
+        parts.append(np.unique(h[h <= limit]))
+    if not parts:
+        return np.zeros(0, dtype=np.uint64)
+    return np.unique(np.concatenate(parts))
+
+
+def _sketchWorker(spec, k, scale):
+    """Sketch a sequence in a worker process. spec is (fasta, name) for a
+    sequence in an indexed multifasta, or (path, None) for a fasta file."""
+    path, name = spec
+    if name is None:
+        return sketch(path, k, scale)
+    if path not in _INDEXES:
+        _INDEXES[path] = FastaIndex(path)
+    return sketch(SeqRef(_INDEXES[path], name), k, scale)
+
+
+def _spec(x):
+    if isinstance(x, SeqRef):
+        return (x.index.fasta, x.name)
+    return (x, None)
+
+
+def sketchAll(seqs, k=21, scale=200, threads=1):
+    """Sketch each sequence in seqs, in parallel if threads > 1.
+    Returns list of sketches in the same order."""
+    if threads <= 1:
+        return [sketch(x, k, scale) for x in seqs]
+    with ProcessPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(_sketchWorker, _spec(x), k, scale) for x in seqs]
+        return [future.result() for future in futures]
+
+
+class SketchIndex(object):
+    """Inverted index of hashes from a list of sketches, for counting the
+    hashes each indexed sketch shares with a query sketch."""
+
+    def __init__(self, sketches):
+        self.size = len(sketches)
+        ids = np.repeat(np.arange(self.size), [len(s) for s in sketches])
+        hashes = np.concatenate(list(sketches) + [np.zeros(0, dtype=np.uint64)])
+        order = np.argsort(hashes, kind="stable")
+        self.hashes = hashes[order]
+        self.ids = ids[order]
+
+    def shared(self, s):
+        """Return array with the number of hashes in s shared with each
+        indexed sketch."""
+        lo = np.searchsorted(self.hashes, s, side="left")
+        hi = np.searchsorted(self.hashes, s, side="right")
+        counts = hi - lo
+        total = int(counts.sum())
+        if not total:
+            return np.zeros(self.size, dtype=np.int64)
+        offset = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        hit = self.ids[np.repeat(lo, counts) + offset]
+        return np.bincount(hit, minlength=self.size)
+
+
+def prefilterPairs(pairs, k=21, scale=200, minShared=0.05, threads=1):
+    """Keep target:query pairs that are estimated to share at least minShared
+    of the k-mer content of the smaller sequence.
+    Pairs where either sketch is empty (very short sequences) are kept, as
+    shared content cannot be estimated. Returns (kept pairs, scores), in the
+    input pair order. Score is None for pairs kept without an estimate."""
+    Aseqs = list(dict.fromkeys(A for A, _ in pairs))
+    Bseqs = list(dict.fromkeys(B for _, B in pairs))
+    Asketches = sketchAll(Aseqs, k, scale, threads)
+    Bsketches = sketchAll(Bseqs, k, scale, threads)
+    index = SketchIndex(Asketches)
+    Apos = {A: i for i, A in enumerate(Aseqs)}
+    Bpos = {B: j for j, B in enumerate(Bseqs)}
+    # Group pairs by query so that shared counts are computed once per query
+    byQuery = dict()
+    for n, (A, B) in enumerate(pairs):
+        byQuery.setdefault(Bpos[B], list()).append((n, Apos[A]))
+    scores = [None] * len(pairs)
+    keep = [True] * len(pairs)
+    for j, members in byQuery.items():
+        shared = index.shared(Bsketches[j])
+        for n, i in members:
+            smaller = min(len(Asketches[i]), len(Bsketches[j]))
+            if smaller:
+                scores[n] = shared[i] / smaller
+                keep[n] = scores[n] >= minShared
+    kept = [pair for pair, k in zip(pairs, keep) if k]
+    kept_scores = [score for score, k in zip(scores, keep) if k]
+    return kept, kept_scores
+
+
+def writePairs(pairs, outfile):
+    """Write pairs as a --pairs file. Split file pairs are written as file
+    names, indexed sequence pairs as sequence names."""
+    with open(outfile, "w") as f:
+        for A, B in pairs:
+            names = list()
+            for x in (A, B):
+                if isinstance(x, SeqRef):
+                    names.append(x.name)
+                else:
+                    names.append(os.path.basename(x))
+            f.write("\t".join(names) + "\n")
@@ -0,0 +1,18 @@
+import tinscan
+
+RAW = [
+    "#name1\tstrand1\tstart1\tend1\tlength1\tname2\tstrand2\tstart2+\tend2+\tlength2\tscore\tidentity\n",
+    "A1\t+\t500\t700\t200\tB1\t-\t10\t210\t200\t9000\t190/200\t95.0%\n",
+    "A1\t+\t100\t150\t50\tB1\t+\t10\t60\t50\t3000\t50/50\t100.0%\n",
+    "A1\t+\t20\t420\t400\tB1\t+\t30\t430\t400\t9000\t200/400\t50.0%\n",
+    "A1\t+\t20\t320\t300\tB1\t+\t40\t340\t300\t9000\t270/300\t90.0%\n",
+    "# lastz end-of-file\n",
+]
+
+
+def test_filter_and_sort():
+    rows = tinscan.sort_hits(list(tinscan.filter_LASTZ(RAW, minIdt=60, minLen=100)))
+    assert rows == [
+        ["A1", "+", "20", "320", "B1", "+", "40", "340", "9000", "90.0"],
+        ["A1", "+", "500", "700", "B1", "-", "10", "210", "9000", "95.0"],
+    ]
@@ -0,0 +1,18 @@
+import numpy as np
+
+import tinscan
+from test_pairing import writeAlignment
+
+
+def test_binary_roundtrip(tmp_path):
+    infile = writeAlignment(tmp_path / "aln.tab", nhits=500, seed=6)
+    binfile = str(tmp_path / "aln.tbin")
+    tinscan.readHitTable(infile, minID=0).save(binfile)
+    # Unfiltered load is memory-mapped
+    table = tinscan.readHitTable(binfile, minID=0)
+    assert isinstance(table.t_start.base, np.memmap)
+    for minID in (0, 85, 95):
+        fromTab = tinscan.readHitTable(infile, minID=minID).toDict()
+        fromBin = tinscan.readHitTable(binfile, minID=minID).toDict()
+        assert list(fromBin.items()) == list(fromTab.items())
+        assert tinscan.readLASTZ(binfile, minID=minID) == fromTab
@@ -0,0 +1,47 @@
+import os
+
+import tinscan
+
+
+def test_cache_roundtrip_and_evict(tmp_path):
+    target = tmp_path / "A1.fa"
+    query = tmp_path / "B1.fa"
+    target.write_text(">A1\nACGTACGT\n")
+    query.write_text(">B1\nACGTTTTT\n")
+    cache = tinscan.AlignmentCache(tmp_path / "cache", maxSize=10)
+    key = cache.key(str(target), str(query), lzpath="lastz", hspthresh=3000)
+    assert cache.get(key) is None
+    # Key depends on settings and sequence content
+    assert key != cache.key(str(target), str(query), lzpath="lastz", hspthresh=2000)
+    assert key != cache.key(str(query), str(target), lzpath="lastz", hspthresh=3000)
+    temp = cache.tempfile()
+    with open(temp, "w") as f:
+        f.write("#raw lastz output\n")
+    path = cache.put(key, temp)
+    assert cache.get(key) == path
+    assert not os.path.exists(temp)
+    # Entry exceeds maxSize
+    assert cache.evict() == 1
+    assert cache.get(key) is None
+
+
+def test_cache_key_indexed_records(tmp_path):
+    genome = tmp_path / "A.fa"
+    genome.write_text(">A1\nACGTACGT\nACG\n>A2\nTTTTGGGG\n")
+    query = tmp_path / "B1.fa"
+    query.write_text(">B1\nACGTTTTT\n")
+    cache = tinscan.AlignmentCache(tmp_path / "cache")
+
+    def key():
+        # Rebuild the index for each version of the genome
+        if os.path.exists(str(genome) + ".fai"):
+            os.remove(str(genome) + ".fai")
+        index = tinscan.FastaIndex(str(genome))
+        return cache.key(tinscan.SeqRef(index, "A1"), str(query), lzpath="lastz")
+
+    before = key()
+    # Keys follow record content, not the genome file
+    genome.write_text(">A0\nCCCC\n>A1\nACGTACGTACG\n>A2\nTTTTGGGG\n>A3\nAAAA\n")
+    assert key() == before
+    genome.write_text(">A1\nACGTACGTACC\n>A2\nTTTTGGGG\n")
+    assert key() != before
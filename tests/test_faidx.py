@@ -0,0 +1,100 @@
+import random
+
+import pytest
+
+import tinscan
+
+
+def writeFasta(path, seqs, width=60):
+    with open(path, "w") as f:
+        for name, seq in seqs.items():
+            f.write(">" + name + " description\n")
+            for i in range(0, len(seq), width):
+                f.write(seq[i : i + width] + "\n")
+    return str(path)
+
+
+def test_fetch_matches_sequence(tmp_path):
+    rng = random.Random(1)
+    seqs = {
+        "chr" + str(i): "".join(rng.choice("ACGT") for _ in range(rng.randint(1, 500)))
+        for i in range(10)
+    }
+    fasta = writeFasta(tmp_path / "genome.fa", seqs, width=37)
+    index = tinscan.FastaIndex(fasta)
+    assert index.names == list(seqs)
+    for name, seq in seqs.items():
+        assert index.length(name) == len(seq)
+        assert index.fetch(name) == seq.encode()
+        start = rng.randint(0, len(seq))
+        end = rng.randint(start, len(seq))
+        assert index.fetch(name, start, end) == seq[start:end].encode()
+    # Reuse existing index
+    assert tinscan.FastaIndex(fasta).entries == index.entries
+    # Extracted record
+    out = tmp_path / "chr3.fa"
+    index.extract("chr3", str(out))
+    lines = out.read_text().split()
+    assert lines[0] == ">chr3"
+    assert "".join(lines[1:]) == seqs["chr3"]
+
+
+def test_inconsistent_lines(tmp_path):
+    fasta = tmp_path / "bad.fa"
+    fasta.write_text(">chr1\nACGT\nAC\nACGT\n")
+    with pytest.raises(ValueError):
+        tinscan.FastaIndex(str(fasta))
+
+
+def test_unwritable_index(tmp_path, monkeypatch, capsys):
+    fasta = writeFasta(tmp_path / "genome.fa", {"chr1": "ACGT" * 20})
+
+    def denied(entries, faipath):
+        raise PermissionError(13, "Permission denied", faipath)
+
+    # Genome directory is read-only
+    monkeypatch.setattr(tinscan.faidx, "writeFai", denied)
+    index = tinscan.FastaIndex(fasta)
+    assert index.fetch("chr1", 4, 8) == b"ACGT"
+    assert not (tmp_path / "genome.fa.fai").exists()
+    assert "indexing in memory" in capsys.readouterr().err
+
+
+def test_candidate_sequences(tmp_path):
+    rng = random.Random(2)
+    left, insert, right = [
+        "".join(rng.choice("ACGT") for _ in range(n)) for n in (300, 200, 300)
+    ]
+    TSD = "ACGTTGCAAC" * 2
+    copy = "T" + TSD[1:]
+    fasta = writeFasta(tmp_path / "A.fa", {"A1": left + TSD + insert + copy + right})
+    genome = tinscan.FastaIndex(fasta)
+    # Flanks overlap by 20 bases in the query (TSD len=19), idx '0' coordinates
+    pair = (
+        ("A1", "B1"),
+        tinscan.hitTup(0, 319, "+", 0, 319, "+", 99.0, 1),
+        tinscan.hitTup(520, 839, "+", 300, 619, "+", 98.0, 2),
+    )
+    assert tinscan.tsdIdentity(TSD.encode(), copy.encode()) == 95.0
+    gff = "".join(tinscan.writeGFFlines([pair], genome=genome))
+    assert gff.count(";TSDid=95.0\n") == 2
+    out = str(tmp_path / "seqs.fa")
+    assert tinscan.writeCandidateSeqs([pair], genome, out) == 5
+    records = dict()
+    for line in open(out):
+        if line.startswith(">"):
+            name = line[1:].split()[0]
+            records[name] = ""
+        else:
+            records[name] += line.strip()
+    assert records == {
+        "IS_01": insert,
+        "IS_01_Flank_L": left + TSD,
+        "IS_01_Flank_R": copy + right,
+        "IS_01_TSD_L": TSD,
+        "IS_01_TSD_R": copy,
+    }
+    # Candidates outside the genome are rejected
+    short = tinscan.FastaIndex(writeFasta(tmp_path / "short.fa", {"A1": left}))
+    with pytest.raises(tinscan.Error):
+        tinscan.writeCandidateSeqs([pair], short, out)
@@ -0,0 +1,205 @@
+import os
+import stat
+import sys
+import threading
+import time
+
+import pytest
+
+import tinscan
+
+# LASTZ stand-in: logs each call, then fails if the query name is listed in
+# the file FAIL, sleeps if the query is listed in SLOW, else reports one hit
+FAKE_LASTZ = (
+    r"""#!%s
+import os, sys, time
+args = [a for a in sys.argv[1:] if not a.startswith("--")]
+here = os.path.dirname(os.path.abspath(sys.argv[0]))
+t = open(args[0]).readline()[1:].split()[0]
+q = open(args[1]).readline()[1:].split()[0]
+with open(os.path.join(here, "calls"), "a") as log:
+    log.write(t + " " + q + "\n")
+def listed(name):
+    path = os.path.join(here, name)
+    return os.path.exists(path) and q in open(path).read().split()
+if listed("FAIL"):
+    sys.exit(1)
+if listed("SLOW"):
+    time.sleep(30)
+row = [t, "+", 1, 200, 200, q, "+", 1, 200, 200, 18000, "200/200", "100.0%%"]
+print("\t".join(map(str, row)))
+"""
+    % sys.executable
+)
+
+
+def setup(tmp_path):
+    lastz = tmp_path / "lastz"
+    lastz.write_text(FAKE_LASTZ)
+    lastz.chmod(lastz.stat().st_mode | stat.S_IEXEC)
+    for genome in ("A", "B"):
+        (tmp_path / genome).mkdir()
+        for n in range(3):
+            (tmp_path / genome / ("%s%s.fa" % (genome, n))).write_text(
+                ">%s%s\nACGTACGTAC\n" % (genome, n)
+            )
+    pairs = sorted(tinscan.get_all_pairs(str(tmp_path / "A"), str(tmp_path / "B")))
+    return str(lastz), pairs
+
+
+def calls(tmp_path):
+    with open(str(tmp_path / "calls")) as f:
+        lines = f.read().splitlines()
+    os.remove(str(tmp_path / "calls"))
+    return lines
+
+
+def test_failed_jobs_resume(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    lastz, pairs = setup(tmp_path)
+    outfile = str(tmp_path / "out.tab")
+    workdir = str(tmp_path / "work")
+    (tmp_path / "FAIL").write_text("B1\n")
+    with pytest.raises(tinscan.Error):
+        tinscan.run_pairs(
+            lzpath=lastz,
+            pairs=pairs,
+            outfile=outfile,
+            threads=2,
+            workdir=workdir,
+            retries=1,
+            progress=True,
+        )
+    # Failing jobs are tried twice, other jobs still run
+    log = calls(tmp_path)
+    assert len(log) == 9 + 3
+    assert sum(line.endswith("B1") for line in log) == 6
+    # Resume runs only the failed jobs
+    os.remove(str(tmp_path / "FAIL"))
+    tinscan.run_pairs(
+        lzpath=lastz, pairs=pairs, outfile=outfile, threads=2, workdir=workdir
+    )
+    assert sorted(calls(tmp_path)) == ["A0 B1", "A1 B1", "A2 B1"]
+    with open(outfile) as f:
+        rows = [line.split("\t")[:5:4] for line in f if not line.startswith("#")]
+    assert rows == [[A[-5:-3], B[-5:-3]] for A, B in pairs]
+
+
+def test_job_timeout(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    lastz, pairs = setup(tmp_path)
+    (tmp_path / "SLOW").write_text("B2\n")
+    start = time.time()
+    with pytest.raises(tinscan.Error):
+        tinscan.run_pairs(
+            lzpath=lastz,
+            pairs=pairs[:3],
+            outfile=str(tmp_path / "out.tab"),
+            timeout=1,
+        )
+    assert time.time() - start < 20
+
+
+def test_job_metrics(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    lastz, pairs = setup(tmp_path)
+    metrics = tinscan.Metrics("test")
+    tinscan.run_pairs(
+        lzpath=lastz,
+        pairs=pairs,
+        outfile=str(tmp_path / "out.tab"),
+        threads=2,
+        metrics=metrics,
+    )
+    report = metrics.report()
+    assert report["counters"]["lastzJobs"] == 9
+    assert [s["stage"] for s in report["stages"]] == ["align", "merge"]
+    assert report["jobSeconds"]["count"] == 9
+    assert all(job["ok"] and job["hits"] == 1 for job in report["jobs"])
+
+
+def test_binary_output(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    lastz, pairs = setup(tmp_path)
+    outfile = str(tmp_path / "out.tab")
+    binfile = str(tmp_path / "out.tbin")
+    tinscan.run_pairs(
+        lzpath=lastz, pairs=pairs, outfile=outfile, threads=2, binfile=binfile
+    )
+    # Binary table holds the same hits as the merged text table
+    table = tinscan.readHitTable(binfile, minID=0)
+    assert len(table) == 9
+    assert table.toDict() == tinscan.readHitTable(outfile, minID=0).toDict()
+
+
+def test_shared_sequence_copies(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    lastz, _ = setup(tmp_path)
+    indexes = list()
+    for genome in ("A", "B"):
+        fasta = tmp_path / (genome + ".fa")
+        fasta.write_text("".join(">%s%s\nACGTACGTAC\n" % (genome, n) for n in range(3)))
+        indexes.append(tinscan.FastaIndex(str(fasta)))
+    pairs = tinscan.get_all_fasta_pairs(*indexes)
+    extracted = list()
+    extract = tinscan.FastaIndex.extract
+
+    def counted(self, name, path, start=0, end=None):
+        extracted.append(name)
+        return extract(self, name, path, start, end)
+
+    monkeypatch.setattr(tinscan.FastaIndex, "extract", counted)
+    workdir = tmp_path / "work"
+    cache = tinscan.AlignmentCache(str(tmp_path / "cache"))
+    tinscan.run_pairs(
+        lzpath=lastz,
+        pairs=pairs,
+        outfile=str(tmp_path / "out.tab"),
+        threads=3,
+        cache=cache,
+        workdir=str(workdir),
+    )
+    # Each sequence is copied once for all of its jobs, then removed
+    assert sorted(extracted) == ["A0", "A1", "A2", "B0", "B1", "B2"]
+    assert not list(workdir.glob("seq_*"))
+    assert len(calls(tmp_path)) == 9
+    # Cache keys do not depend on the scratch copies
+    key = cache.key(pairs[0][0], pairs[0][1], lzpath=lastz)
+    assert cache.get(key) is not None
+
+
+def test_shared_copies_threaded(tmp_path, monkeypatch):
+    fasta = tmp_path / "A.fa"
+    bases = ["ACGT"[n % 4] * (n + 1) for n in range(8)]
+    fasta.write_text("".join(">s%s\n%s\n" % (n, seq) for n, seq in enumerate(bases)))
+    index = tinscan.FastaIndex(str(fasta))
+    refs = [tinscan.SeqRef(index, name) for name in index.names]
+    extract = tinscan.FastaIndex.extract
+
+    def slow(self, name, path, start=0, end=None):
+        # Let the other threads start their own first copies
+        time.sleep(0.2)
+        return extract(self, name, path, start, end)
+
+    monkeypatch.setattr(tinscan.FastaIndex, "extract", slow)
+    seqs = tinscan.ScratchSeqs(str(tmp_path), [(i, x, x) for i, x in enumerate(refs)])
+    start = threading.Barrier(len(refs))
+    paths = dict()
+
+    def first(x):
+        start.wait()
+        paths[x.name] = seqs.path(x)
+
+    threads = [threading.Thread(target=first, args=(x,)) for x in refs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Each sequence has its own copy, holding its own bases
+    assert len(set(paths.values())) == len(refs)
+    for n, x in enumerate(refs):
+        with open(paths[x.name]) as f:
+            assert f.read() == ">s%s\n%s\n" % (n, bases[n])
+        seqs.release(x)
+        seqs.release(x)
+    assert not list(tmp_path.glob("seq_*"))
@@ -0,0 +1,223 @@
+import argparse
+import random
+
+import pytest
+
+import tinscan
+
+
+def makeArgs(**kwargs):
+    settings = dict(
+        maxTSD=100,
+        maxInsert=100000,
+        minInsert=100,
+        qGap=100,
+        minIdent=90,
+        maxIdentDiff=20,
+    )
+    settings.update(kwargs)
+    return argparse.Namespace(**settings)
+
+
+def writeAlignment(path, nhits=400, seed=1):
+    """Write a random LASTZ tab file with a few Target:Query buckets."""
+    rng = random.Random(seed)
+    lines = [
+        "#name1\tstrand1\tstart1\tend1\tname2\tstrand2\tstart2+\tend2+\tscore\tidentity\n"
+    ]
+    for _ in range(nhits):
+        t_name = rng.choice(["A1", "A2"])
+        q_name = rng.choice(["B1", "B2", "B3"])
+        t_start = rng.randint(1, 200000)
+        t_len = rng.randint(100, 5000)
+        q_start = rng.randint(1, 200000)
+        q_len = rng.randint(100, 5000)
+        strand = rng.choice(["+", "-"])
+        idt = round(rng.uniform(80, 100), 1)
+        lines.append(
+            "\t".join(
+                [
+                    t_name,
+                    "+",
+                    str(t_start),
+                    str(t_start + t_len),
+                    q_name,
+                    strand,
+                    str(q_start),
+                    str(q_start + q_len),
+                    "1000",
+                    str(idt),
+                ]
+            )
+            + "\n"
+        )
+    with open(path, "w") as f:
+        f.writelines(lines)
+    return path
+
+
+def test_sweep_matches_naive(tmp_path):
+    infile = writeAlignment(tmp_path / "aln.tab")
+    hits = tinscan.readLASTZ(infile, minID=85)
+    for settings in [
+        dict(),
+        dict(minInsert=-500, maxInsert=2000, qGap=50000, maxTSD=50000),
+        dict(minInsert=0, maxInsert=0, qGap=200000, maxTSD=200000),
+    ]:
+        args = makeArgs(**settings)
+        fast = tinscan.getHitPairs(hits, args)
+        slow = tinscan.getHitPairs(hits, args, naive=True)
+        assert fast == slow
+
+
+def test_hittable_matches_dict(tmp_path):
+    infile = writeAlignment(tmp_path / "aln.tab", nhits=600, seed=2)
+    hits = tinscan.readLASTZ(infile, minID=85)
+    table = tinscan.readHitTable(infile, minID=85)
+    assert table.toDict() == hits
+    for settings in [
+        dict(),
+        dict(minInsert=-500, maxInsert=2000, qGap=50000, maxTSD=50000),
+    ]:
+        args = makeArgs(**settings)
+        assert tinscan.getHitPairs(table, args) == tinscan.getHitPairs(hits, args)
+
+
+def test_chunked_reader(tmp_path):
+    infile = writeAlignment(tmp_path / "aln.tab", nhits=500, seed=3)
+    table = tinscan.readHitTable(infile, minID=85)
+    small = tinscan.readHitTable(infile, minID=85, chunksize=7)
+    assert small.toDict() == table.toDict()
+    assert list(small.toDict()) == list(tinscan.readLASTZ(infile, minID=85))
+
+
+def test_threaded_pairs(tmp_path):
+    infile = writeAlignment(tmp_path / "aln.tab", nhits=600, seed=4)
+    args = makeArgs(minInsert=-500, maxInsert=2000, qGap=50000, maxTSD=50000)
+    hits = tinscan.readLASTZ(infile, minID=85)
+    table = tinscan.readHitTable(infile, minID=85)
+    serial = tinscan.getHitPairs(hits, args)
+    assert tinscan.getHitPairs(hits, args, threads=2) == serial
+    assert tinscan.getHitPairs(table, args, threads=2) == serial
+
+
+def test_sweep_matches_direct_runs(tmp_path):
+    infile = writeAlignment(tmp_path / "aln.tab", nhits=800, seed=7)
+    points = [
+        makeArgs(minIdent=85, maxInsert=5000, qGap=1000, maxTSD=5000),
+        makeArgs(minIdent=95, minInsert=-500, qGap=50000, maxTSD=50000),
+        makeArgs(minIdent=90, maxIdentDiff=2, qGap=50000, maxTSD=0),
+    ]
+    table = tinscan.readHitTable(infile, minID=85)
+    results = list(tinscan.sweepHitPairs(table, points))
+    counts = tinscan.sweepCounts(table, points)
+    for (point, pairs), (_, candidates, TSDs) in zip(results, counts):
+        direct = tinscan.getHitPairs(tinscan.readLASTZ(infile, point.minIdent), point)
+        # UIDs differ as hits are numbered under the loosest minIdent
+        assert [(k, h[:-1], m[:-1]) for k, h, m in pairs] == [
+            (k, h[:-1], m[:-1]) for k, h, m in direct
+        ]
+        assert candidates == len(direct)
+        assert TSDs == sum(1 for pair in direct if tinscan.getTSDlen(pair))
+
+
+def test_pair_metrics(tmp_path):
+    infile = writeAlignment(tmp_path / "aln.tab")
+    metrics = tinscan.Metrics()
+    hits = tinscan.readHitTable(infile, minID=85, metrics=metrics)
+    pairs = tinscan.getHitPairs(hits, makeArgs(), metrics=metrics)
+    counters = metrics.report()["counters"]
+    assert counters["hitsRead"] == 400
+    assert counters["hitsKept"] == len(hits)
+    assert counters["pairsAccepted"] == len(pairs)
+    assert counters["pairsExamined"] >= len(pairs)
+    # The naive search compares every hit against every hit in its bucket
+    naive = tinscan.Metrics()
+    tinscan.getHitPairs(hits, makeArgs(), naive=True, metrics=naive)
+    counters = naive.report()["counters"]
+    assert "pairsExamined" not in counters
+    assert counters["pairsCompared"] == sum(
+        (stop - start) ** 2 for _, _, start, stop in hits.iterBuckets()
+    )
+
+
+def test_incremental_state(tmp_path):
+    infile = writeAlignment(tmp_path / "aln.tab")
+    state = tinscan.FindState(str(tmp_path / "state"))
+    args = makeArgs()
+    hits = tinscan.readHitTable(infile, minID=85)
+    assert tinscan.getHitPairs(hits, args, state=state) == tinscan.getHitPairs(
+        hits, args
+    )
+    # Replace hits of target A2 with those from another run
+    other = writeAlignment(tmp_path / "other.tab", seed=2)
+    with open(infile) as f:
+        lines = [x for x in f if not x.startswith("A2\t")]
+    with open(other) as f:
+        lines += [x for x in f if x.startswith("A2\t")]
+    changed = tmp_path / "changed.tab"
+    changed.write_text("".join(lines))
+    hits = tinscan.readHitTable(str(changed), minID=85)
+    metrics = tinscan.Metrics()
+    pairs = tinscan.getHitPairs(hits, args, state=state, metrics=metrics)
+    assert pairs == tinscan.getHitPairs(hits, args)
+    counters = metrics.report()["counters"]
+    assert counters["bucketsReused"] == 3
+    assert counters["bucketsPaired"] == 3
+    # Changed settings invalidate all buckets
+    args = makeArgs(qGap=500)
+    metrics = tinscan.Metrics()
+    pairs = tinscan.getHitPairs(hits, args, state=state, metrics=metrics)
+    assert pairs == tinscan.getHitPairs(hits, args)
+    assert metrics.report()["counters"]["bucketsPaired"] == 6
+
+
+def test_cluster_pairs(tmp_path):
+    infile = writeAlignment(tmp_path / "aln.tab", nhits=1500, seed=3)
+    hits = tinscan.readHitTable(infile, minID=80)
+    validPairs = tinscan.getHitPairs(hits, makeArgs(maxInsert=3000, qGap=5000))
+    reps, attributes = tinscan.clusterPairs(validPairs)
+    # Group candidates by chains of overlapping inserts, all-vs-all
+    spans = [
+        (str(p[0][0]),) + tuple(sorted((p[1].t_end + 1, p[2].t_start - 1)))
+        for p in validPairs
+    ]
+    group = list(range(len(spans)))
+
+    def root(i):
+        while group[i] != i:
+            i = group[i]
+        return i
+
+    for i, a in enumerate(spans):
+        for j, b in enumerate(spans[:i]):
+            if a[0] == b[0] and a[1] <= b[2] and b[1] <= a[2]:
+                group[root(i)] = root(j)
+    clusters = dict()
+    for i in range(len(spans)):
+        clusters.setdefault(root(i), list()).append(validPairs[i])
+    assert 1 < len(reps) < len(validPairs)
+    expected = sorted(clusters.values(), key=lambda c: validPairs.index(c[0]))
+    for rep, attrs, members in zip(reps, attributes, expected):
+        assert attrs["members"] == len(members)
+        assert attrs["bestLeftID"] == max(p[1].idPct for p in members)
+        assert attrs["bestRightID"] == max(p[2].idPct for p in members)
+        assert rep in members
+        assert rep[1].idPct + rep[2].idPct == max(
+            p[1].idPct + p[2].idPct for p in members
+        )
+
+
+def test_sweep_grid_bad_value(tmp_path, capsys):
+    from tinscan.run_scan import readGrid
+
+    grid = tmp_path / "grid.txt"
+    grid.write_text("minInsert 50, 100\nqGap 10 ten\n")
+    with pytest.raises(SystemExit):
+        readGrid(str(grid), makeArgs())
+    assert "qGap: ten" in capsys.readouterr().out
+    # A setting listed without values would leave no combinations to run
+    grid.write_text("minInsert 50, 100\nqGap\n")
+    with pytest.raises(SystemExit):
+        readGrid(str(grid), makeArgs())
+    assert "qGap: no values given" in capsys.readouterr().out
@@ -0,0 +1,97 @@
+import gzip
+import os
+import pstats
+import random
+import sys
+
+import pytest
+
+from tinscan import run_prep
+from tinscan.run_prep import splitFasta, splitFastaFast
+
+
+def writeGenome(path, nrecs=4, width=60, seed=3):
+    """Write a multifasta with sequence lines wrapped at width. Returns dict of
+    record name: sequence."""
+    rng = random.Random(seed)
+    records = dict()
+    with open(path, "w") as f:
+        for n in range(nrecs):
+            name = "scaffold_%s" % n
+            seq = "".join(rng.choice("ACGT") for _ in range(rng.randint(50, 400)))
+            records[name] = seq
+            f.write(">%s length=%s\n" % (name, len(seq)))
+            for i in range(0, len(seq), width):
+                f.write(seq[i : i + width] + "\n")
+    return records
+
+
+def readSplit(outdir):
+    """Return dict of file name: (header, sequence) for a split directory."""
+    split = dict()
+    for name in os.listdir(outdir):
+        with open(os.path.join(outdir, name)) as f:
+            lines = f.read().splitlines()
+        split[name] = (lines[0], "".join(lines[1:]))
+    return split
+
+
+@pytest.mark.parametrize("splitter", [splitFasta, splitFastaFast])
+@pytest.mark.parametrize("compress", [False, True])
+def test_split_records(tmp_path, splitter, compress):
+    infile = str(tmp_path / "genome.fa")
+    records = writeGenome(infile)
+    if compress:
+        with open(infile, "rb") as f, gzip.open(infile + ".gz", "wb") as gz:
+            gz.write(f.read())
+        infile += ".gz"
+    outdir = tmp_path / "split"
+    outdir.mkdir()
+    splitter(infile, str(outdir))
+    # One file per record, named for the record ID, with wrapped lines joined
+    assert readSplit(str(outdir)) == {
+        name + ".fa": (">%s length=%s" % (name, len(seq)), seq)
+        for name, seq in records.items()
+    }
+
+
+@pytest.mark.parametrize("splitter", [splitFasta, splitFastaFast])
+def test_split_duplicate_name(tmp_path, splitter):
+    infile = tmp_path / "genome.fa"
+    infile.write_text(">seq1\nACGT\n>seq2\nGGCC\n>seq1 again\nTTAA\n")
+    outdir = tmp_path / "split"
+    outdir.mkdir()
+    with pytest.raises(ValueError, match="seq1"):
+        splitter(str(infile), str(outdir))
+
+
+def test_split_identical_output(tmp_path):
+    infile = str(tmp_path / "genome.fa")
+    writeGenome(infile, nrecs=6, seed=8)
+    for splitter in (splitFasta, splitFastaFast):
+        outdir = tmp_path / splitter.__name__
+        outdir.mkdir()
+        splitter(infile, str(outdir))
+    names = sorted(os.listdir(str(tmp_path / "splitFasta")))
+    assert names == sorted(os.listdir(str(tmp_path / "splitFastaFast")))
+    for name in names:
+        with open(str(tmp_path / "splitFasta" / name), "rb") as f:
+            slow = f.read()
+        with open(str(tmp_path / "splitFastaFast" / name), "rb") as f:
+            assert f.read() == slow
+
+
+def test_split_profiles_workers(tmp_path, monkeypatch):
+    writeGenome(str(tmp_path / "A.fa"))
+    writeGenome(str(tmp_path / "B.fa"), seed=4)
+    profile = str(tmp_path / "prep.prof")
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["tinscan-prep", "-A", str(tmp_path / "A.fa"), "-B", str(tmp_path / "B.fa")]
+        + ["--outdir", str(tmp_path / "out"), "--profile", profile],
+    )
+    run_prep.main()
+    # Parent and each genome split are profiled separately
+    for path in (profile, profile + ".A", profile + ".B"):
+        assert pstats.Stats(path).total_calls > 0
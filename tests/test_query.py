@@ -0,0 +1,62 @@
+import random
+
+import tinscan
+
+from test_pairing import makeArgs, writeAlignment
+
+
+def readFeatures(gff):
+    """All features in gff as (seqid, type, start, end, line)."""
+    features = list()
+    with open(gff) as f:
+        for line in f:
+            if not line.startswith("#"):
+                li = line.split("\t")
+                start, end = sorted((int(li[3]), int(li[4])))
+                features.append((li[0], li[2], start, end, line))
+    return features
+
+
+def test_region_and_nearest(tmp_path):
+    infile = writeAlignment(tmp_path / "aln.tab", nhits=1000)
+    hits = tinscan.readHitTable(infile, minID=80)
+    validPairs = tinscan.getHitPairs(hits, makeArgs(minIdent=80, qGap=5000))
+    gff = str(tmp_path / "candidates.gff3")
+    with open(gff, "w") as f:
+        for x in tinscan.writeGFFlines(validPairs):
+            f.write(x)
+    features = readFeatures(gff)
+    assert len(features) > 100
+    index = tinscan.CandidateIndex(gff)
+    assert len(index) == len(features)
+    rng = random.Random(2)
+    for _ in range(200):
+        seqid = rng.choice(["A1", "A2", "A3"])
+        start = rng.randint(1, 210000)
+        end = start + rng.choice([0, 10, 1000, 20000])
+        types = rng.choice([None, ["Candidate_Insertion"], ["Candidate_TSD"]])
+        selected = [
+            x for x in features if x[0] == seqid and (types is None or x[1] in types)
+        ]
+        # Overlapping features
+        found = index.region(seqid, start, end, types)
+        expected = [x[4] for x in selected if x[2] <= end and x[3] >= start]
+        assert sorted(f.line for f in found) == sorted(expected)
+        assert [f.start for f in found] == sorted(f.start for f in found)
+        # Nearest feature distance
+        near = index.nearest(seqid, start, types)
+        if not selected:
+            assert near is None
+            continue
+        distances = [max(0, x[2] - start, start - x[3]) for x in selected]
+        assert near.distance == min(distances)
+        assert near.line in [
+            x[4] for x, d in zip(selected, distances) if d == near.distance
+        ]
+    index.close()
+
+
+def test_parse_region():
+    assert tinscan.parseRegion("chr1:1,000-2,000") == ("chr1", 1000, 2000)
+    assert tinscan.parseRegion("chr1:500") == ("chr1", 500, 500)
+    assert tinscan.parseRegion("HLA:A*01") == ("HLA:A*01", 1, None)
@@ -0,0 +1,38 @@
+import tinscan
+
+
+def test_plan_jobs_longest_first(tmp_path):
+    sizes = {"big": 5000000, "mid": 3000000, "s1": 1000, "s2": 1000, "s3": 1000}
+    paths = dict()
+    for name, size in sizes.items():
+        path = tmp_path / (name + ".fa")
+        path.write_bytes(b">" + name.encode() + b"\n" + b"A" * size + b"\n")
+        paths[name] = str(path)
+    query = paths["s1"]
+    # Largest pair is last in input order
+    jobs = [
+        (i, paths[name], query) for i, name in enumerate(["s2", "s3", "mid", "big"])
+    ]
+    schedule = tinscan.plan_jobs(jobs, threads=2, packSize=1000000)
+    assert [batch.jobs for batch in schedule.batches] == [[3], [2], [0, 1]]
+    costs = [tinscan.job_cost(A, B) for _, A, B in jobs]
+    assert schedule.total == sum(costs)
+    # Small batch follows the mid job, as that worker is free first
+    assert schedule.makespan == max(costs[3], costs[2] + costs[0] + costs[1])
+    report = tinscan.format_schedule(schedule, jobs)
+    assert "big vs s1" in report.splitlines()[1]
+
+
+def test_plan_pairs_writes_nothing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("TMPDIR", str(tmp_path / "tmp"))
+    target = tmp_path / "big.fa"
+    target.write_bytes(b">big\n" + b"\n".join([b"A" * 60] * 500) + b"\n")
+    query = tmp_path / "q.fa"
+    query.write_bytes(b">q\nACGT\n")
+    jobs, schedule = tinscan.plan_pairs(
+        [(str(target), str(query))], window=10000, overlap=2000
+    )
+    # Target is windowed from an index built in memory
+    assert len(jobs) == 4
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["big.fa", "q.fa"]
@@ -0,0 +1,36 @@
+import pytest
+
+import tinscan
+from test_jobs import setup
+
+
+def test_shards_merge_to_unsharded(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    lastz, pairs = setup(tmp_path)
+    # Make one target much larger than the rest
+    with open(pairs[0][0], "a") as f:
+        f.write("ACGT" * 100000 + "\n")
+    assigned = tinscan.shard_pairs(pairs, 3)
+    # Its three pairs are spread over all shards
+    assert sorted(assigned[:3]) == [1, 2, 3]
+    assert assigned == tinscan.shard_pairs(list(pairs), 3)
+    whole = str(tmp_path / "whole.tab")
+    tinscan.run_pairs(lzpath=lastz, pairs=pairs, outfile=whole)
+    comment = tinscan.shard_comment(0, 3, len(pairs), tinscan.pairs_digest(pairs))
+    shards = list()
+    for shard in (1, 2, 3):
+        pairIds = [i for i, s in enumerate(assigned) if s == shard]
+        shards.append(str(tmp_path / ("shard%s.tab" % shard)))
+        tinscan.run_pairs(
+            lzpath=lastz,
+            pairs=[pairs[i] for i in pairIds],
+            outfile=shards[-1],
+            pairIds=pairIds,
+            comment=comment.replace("shard 0/3", "shard %s/3" % shard),
+        )
+    merged = str(tmp_path / "merged.tab")
+    assert tinscan.merge_shards(shards[::-1], merged) == len(pairs)
+    with open(whole) as f, open(merged) as g:
+        assert f.read() == g.read()
+    with pytest.raises(tinscan.Error):
+        tinscan.merge_shards(shards[:2], merged)
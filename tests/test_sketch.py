@@ -0,0 +1,51 @@
+import os
+import random
+
+from tinscan import get_all_pairs, kmerHashes, prefilterPairs, sketch, writePairs
+
+
+def randomSeq(rng, n):
+    return "".join(rng.choice("ACGT") for _ in range(n))
+
+
+def mutate(rng, seq, rate):
+    return "".join(rng.choice("ACGT") if rng.random() < rate else b for b in seq)
+
+
+def writeFasta(path, name, seq):
+    with open(path, "w") as f:
+        f.write(">%s\n%s\n" % (name, seq))
+
+
+def test_kmers_canonical():
+    seq = b"ACGTTGCAAGGCTTAACCGGATCGATCGGGANNACGTTGCAAGGCTTAACCGGAT"
+    rc = seq[::-1].translate(bytes.maketrans(b"ACGTN", b"TGCAN"))
+    assert sorted(kmerHashes(seq)) == sorted(kmerHashes(rc))
+    # K-mers spanning N are skipped
+    assert len(kmerHashes(b"ACGTACGTACGTACGTACGTAN")) == 1
+
+
+def test_prefilter_pairs(tmp_path):
+    rng = random.Random(1)
+    base = randomSeq(rng, 60000)
+    Adir = tmp_path / "A"
+    Bdir = tmp_path / "B"
+    Adir.mkdir()
+    Bdir.mkdir()
+    writeFasta(str(Adir / "a1.fa"), "a1", base[:40000])
+    writeFasta(str(Adir / "a2.fa"), "a2", randomSeq(rng, 40000))
+    writeFasta(str(Bdir / "b1.fa"), "b1", mutate(rng, base[10000:30000], 0.02))
+    writeFasta(str(Bdir / "b2.fa"), "b2", randomSeq(rng, 20000))
+    # Too short to sketch, always kept
+    writeFasta(str(Bdir / "b3.fa"), "b3", "ACGT")
+    pairs = sorted(get_all_pairs(str(Adir), str(Bdir)))
+    kept, scores = prefilterPairs(pairs, threads=2)
+    names = [(os.path.basename(A), os.path.basename(B)) for A, B in kept]
+    assert names == [("a1.fa", "b1.fa"), ("a1.fa", "b3.fa"), ("a2.fa", "b3.fa")]
+    assert scores[0] > 0.5 and scores[1] is None
+    # Serial sketches match parallel
+    assert kept == prefilterPairs(pairs, threads=1)[0]
+    assert len(sketch(str(Adir / "a1.fa"))) > 0
+    writePairs(kept, str(tmp_path / "pairs.txt"))
+    with open(str(tmp_path / "pairs.txt")) as f:
+        assert f.readline() == "a1.fa\tb1.fa\n"
@@ -0,0 +1,44 @@
+import argparse
+import os
+import sys
+
+import tinscan
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import synth  # noqa: E402
+
+
+def test_planted_insertions_recovered(tmp_path):
+    settings = synth.DEFAULTS._replace(scaffolds=4, hitsPerBucket=100)
+    rows, planted, genome = synth.generate(settings)
+    # Generator is seeded
+    assert synth.generate(settings)[0] == rows
+    infile = synth.writeRows(rows, str(tmp_path / "aln.tab"))
+    args = argparse.Namespace(
+        maxTSD=100, maxInsert=100000, minInsert=100, qGap=100, maxIdentDiff=20
+    )
+    validPairs = tinscan.getHitPairs(tinscan.readHitTable(infile, minID=80), args)
+    # Insert bodies as idx '1' target coordinates, and TSD lengths
+    found = set()
+    for pair in validPairs:
+        TSDlen = tinscan.getTSDlen(pair)
+        found.add(
+            (
+                pair[0][0],
+                pair[0][1],
+                pair[1].t_end + 2,
+                pair[2].t_start,
+                TSDlen + 1 if TSDlen else 0,
+                pair[1].q_strand,
+            )
+        )
+    assert len(planted) == 40
+    assert set(tuple(p) for p in planted) <= found
+    # TSD copies flank the insert in the synthetic genome
+    synth.writeGenomes(genome, 1, str(tmp_path / "A.fa"), str(tmp_path / "B.fa"))
+    index = tinscan.FastaIndex(str(tmp_path / "A.fa"))
+    for p in planted:
+        left = index.fetch(p.target, p.start - 1 - p.tsd, p.start - 1)
+        right = index.fetch(p.target, p.end, p.end + p.tsd)
+        assert len(left) == p.tsd and left == right
@@ -0,0 +1,314 @@
+import argparse
+import os
+import random
+import stat
+import sys
+
+import tinscan
+from tinscan.pipeline import stream_insertions
+
+# Minimal LASTZ stand-in: reports maximal exact forward matches >= 100 bp.
+# If FAKE_CHAIN is set, --chain keeps only the best scoring colinear chain of
+# matches for each query, as LASTZ does.
+FAKE_LASTZ = (
+    r"""#!%s
+import os, sys
+args = [a for a in sys.argv[1:] if not a.startswith("--")]
+
+
+def read(path):
+    records = []
+    for line in open(path):
+        if line.startswith(">"):
+            records.append([line[1:].split()[0], ""])
+        else:
+            records[-1][1] += line.strip()
+    return records
+
+
+def chain(hits):
+    hits.sort(key=lambda h: h[2])
+    best = list()
+    for k, h in enumerate(hits):
+        score, prev = h[10], None
+        for m, g in enumerate(hits[:k]):
+            if g[3] < h[2] and g[8] < h[7] and best[m][0] + h[10] > score:
+                score, prev = best[m][0] + h[10], m
+        best.append((score, prev))
+    kept = list()
+    k = max(range(len(hits)), key=lambda k: best[k][0]) if hits else None
+    while k is not None:
+        kept.insert(0, hits[k])
+        k = best[k][1]
+    return kept
+
+
+((tname, t),) = read(args[0])
+seeds = dict()
+for i in range(len(t) - 31):
+    seeds.setdefault(t[i : i + 32], i)
+for qname, q in read(args[1]):
+    hits = list()
+    j = 0
+    while j < len(q) - 31:
+        i = seeds.get(q[j : j + 32])
+        if i is None:
+            j += 1
+            continue
+        n = 32
+        while i + n < len(t) and j + n < len(q) and t[i + n] == q[j + n]:
+            n += 1
+        if n >= 100:
+            row = [tname, "+", i + 1, i + n, n, qname, "+", j + 1, j + n, n]
+            row += [n * 90, "%%d/%%d" %% (n, n), "100.0%%"]
+            hits.append(row)
+        j += n
+    if "--chain" in sys.argv and os.environ.get("FAKE_CHAIN"):
+        hits = chain(hits)
+    for row in hits:
+        print("\t".join(map(str, row)))
+"""
+    % sys.executable
+)
+
+
+def writeLastz(tmp_path):
+    lastz = tmp_path / "lastz"
+    lastz.write_text(FAKE_LASTZ)
+    lastz.chmod(lastz.stat().st_mode | stat.S_IEXEC)
+    return str(lastz)
+
+
+def randomSeq(rng, n):
+    return "".join(rng.choice("ACGT") for _ in range(n))
+
+
+def runAlignments(tmp_path, lastz, pairs, name, **kw):
+    outfile = str(tmp_path / name)
+    tinscan.run_pairs(lzpath=lastz, pairs=pairs, outfile=outfile, threads=2, **kw)
+    with open(outfile) as f:
+        return f.read()
+
+
+def test_window_lifting_matches_whole_target(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(3)
+    target = randomSeq(rng, 30000)
+    # Query segments of the target, separated by inserted sequence
+    query = ""
+    for start in (500, 7600, 14000, 21900, 26000):
+        query += target[start : start + 3000]
+        query += randomSeq(rng, 500)
+    lastz = writeLastz(tmp_path)
+    fasta = tmp_path / "A.fa"
+    fasta.write_text(
+        ">A1\n" + "\n".join(target[i : i + 60] for i in range(0, 30000, 60)) + "\n"
+    )
+    (tmp_path / "B.fa").write_text(">B1\n" + query + "\n")
+    pairs = [(str(fasta), str(tmp_path / "B.fa"))]
+    windows = tinscan.target_windows(None, 30000, 8000, 4000)
+    # Window cores tile the target
+    assert [w.core_start for w in windows[1:]] == [w.core_end for w in windows[:-1]]
+    assert windows[-1].end == windows[-1].core_end == 30000
+    whole = runAlignments(tmp_path, lastz, pairs, "whole.tab")
+    assert whole.count("\n") == 6
+    assert whole == runAlignments(
+        tmp_path, lastz, pairs, "windows.tab", window=8000, overlap=4000
+    )
+    # Split target files are indexed in scratch space
+    assert not os.path.exists(str(fasta) + ".fai")
+
+
+def test_window_hits_longer_than_overlap(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(7)
+    target = randomSeq(rng, 30000)
+    # Segments longer than the overlap cross the end of one or two windows
+    query = target[3000:9500] + randomSeq(rng, 500) + target[13000:25000]
+    lastz = writeLastz(tmp_path)
+    (tmp_path / "A.fa").write_text(">A1\n" + target + "\n")
+    (tmp_path / "B.fa").write_text(">B1\n" + query + "\n")
+    pairs = [(str(tmp_path / "A.fa"), str(tmp_path / "B.fa"))]
+    whole = runAlignments(tmp_path, lastz, pairs, "whole.tab")
+    windows = runAlignments(
+        tmp_path, lastz, pairs, "windows.tab", window=8000, overlap=4000
+    )
+    assert [line.split("\t")[2:4] for line in whole.splitlines()[1:]] == [
+        ["3001", "9500"],
+        ["13001", "25000"],
+    ]
+    assert windows == whole
+    # Joined hits are found per query in batched jobs too
+    assert whole == runAlignments(
+        tmp_path,
+        lastz,
+        pairs,
+        "batched.tab",
+        window=8000,
+        overlap=4000,
+        batchSize=100000,
+    )
+
+
+def test_stitch_reverse_strand_hits():
+    # Query coordinates of - strand hits fall as target coordinates rise
+    row = ["A1", "+", "3001", "8000", "B1", "-", "1501", "6500", "450000", "100.0%"]
+    rows = [row, ["A1", "+", "5001", "5200", "B1", "+", "1", "200", "18000", "99.0%"]]
+    pieces = [
+        ["A1", "+", "4001", "9500", "B1", "-", "1", "5500", "495000", "98.0%"],
+        # Not contiguous with the hit on the query
+        ["A1", "+", "4001", "9000", "B1", "-", "1", "4000", "450000", "100.0%"],
+    ]
+    tinscan.stitch_hits(rows, pieces)
+    assert rows[0] == [
+        "A1",
+        "+",
+        "3001",
+        "9500",
+        "B1",
+        "-",
+        "1",
+        "6500",
+        "585000",
+        "99.5%",
+    ]
+    assert rows[1][2:4] == ["5001", "5200"]
+
+
+def test_window_chaining(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("FAKE_CHAIN", "1")
+    rng = random.Random(5)
+    target = randomSeq(rng, 30000)
+    # Query holds two target segments in reverse order, so only one of them
+    # is on the best chain through the whole target
+    query = target[20000:24000] + randomSeq(rng, 500) + target[2000:5000]
+    lastz = writeLastz(tmp_path)
+    (tmp_path / "A.fa").write_text(">A1\n" + target + "\n")
+    (tmp_path / "B.fa").write_text(">B1\n" + query + "\n")
+    pairs = [(str(tmp_path / "A.fa"), str(tmp_path / "B.fa"))]
+    whole = runAlignments(tmp_path, lastz, pairs, "whole.tab")
+    windows = runAlignments(
+        tmp_path, lastz, pairs, "windows.tab", window=8000, overlap=4000
+    )
+    # Each window is chained separately and keeps its own segment
+    assert [line.split("\t")[2] for line in whole.splitlines()[1:]] == ["20001"]
+    assert [line.split("\t")[2] for line in windows.splitlines()[1:]] == [
+        "2001",
+        "20001",
+    ]
+
+
+def test_query_batches_match_per_pair(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(4)
+    targets = [randomSeq(rng, 5000) for _ in range(2)]
+    with open(str(tmp_path / "A.fa"), "w") as f:
+        for n, seq in enumerate(targets):
+            f.write(">A%s\n%s\n" % (n, seq))
+    with open(str(tmp_path / "B.fa"), "w") as f:
+        for n in range(12):
+            seq = targets[n % 2][n * 300 : n * 300 + 400] + randomSeq(rng, 100)
+            f.write(">B%s\n%s\n" % (n, seq))
+    Aindex = tinscan.FastaIndex(str(tmp_path / "A.fa"))
+    Bindex = tinscan.FastaIndex(str(tmp_path / "B.fa"))
+    pairs = tinscan.get_all_fasta_pairs(Aindex=Aindex, Bindex=Bindex)
+    lastz = writeLastz(tmp_path)
+    jobs = tinscan.batch_queries([(i, A, B) for i, (A, B) in enumerate(pairs)], 2000)
+    # 12 queries of 500 bp per target, 4 to a batch
+    assert len(jobs) == 6
+    assert all(len(B.queries) == 4 for _, _, B in jobs)
+    per_pair = runAlignments(tmp_path, lastz, pairs, "pairs.tab")
+    assert per_pair.count("\n") == 13
+    assert per_pair == runAlignments(
+        tmp_path, lastz, pairs, "batched.tab", batchSize=2000
+    )
+
+
+def test_align_yields_table_rows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(5)
+    target = randomSeq(rng, 6000)
+    (tmp_path / "A.fa").write_text(">A1\n" + target + "\n")
+    (tmp_path / "B.fa").write_text(">B1\n" + target[1000:3000] + "\n")
+    pairs = [(str(tmp_path / "A.fa"), str(tmp_path / "B.fa"))]
+    lastz = writeLastz(tmp_path)
+    table = runAlignments(tmp_path, lastz, pairs, "out.tab")
+    # Scratch files go to tmpdir, cwd is left untouched
+    cwd = tmp_path / "cwd"
+    cwd.mkdir()
+    monkeypatch.chdir(cwd)
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+    rows = list(tinscan.align(pairs, lzpath=lastz, tmpdir=str(scratch)))
+    assert os.getcwd() == str(cwd)
+    assert not os.listdir(str(cwd)) and not os.listdir(str(scratch))
+    assert ["\t".join(row) + "\n" for row in rows] == table.splitlines(True)[1:]
+    hits = tinscan.readHitTable(iter(rows), minID=0)
+    assert len(hits) == len(rows) == 1
+
+
+def test_streamed_insertions_match_find(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    rng = random.Random(6)
+    # Each query joins two target segments, so the target carries an insertion
+    targets = [randomSeq(rng, 12000) for _ in range(2)]
+    with open(str(tmp_path / "A.fa"), "w") as f:
+        for n, seq in enumerate(targets):
+            f.write(">A%s\n%s\n" % (n, seq))
+    with open(str(tmp_path / "B.fa"), "w") as f:
+        for n in range(4):
+            t = targets[n % 2]
+            start = 1000 + n * 1500
+            seq = t[start : start + 1000] + t[start + 1500 : start + 2500]
+            f.write(">B%s\n%s\n" % (n, seq))
+    Aindex = tinscan.FastaIndex(str(tmp_path / "A.fa"))
+    Bindex = tinscan.FastaIndex(str(tmp_path / "B.fa"))
+    pairs = tinscan.get_all_fasta_pairs(Aindex=Aindex, Bindex=Bindex)
+    lastz = writeLastz(tmp_path)
+    args = argparse.Namespace(
+        lzpath=lastz,
+        minIdt=60,
+        minLen=100,
+        hspthresh=3000,
+        window=None,
+        overlap=100000,
+        batchQueries=None,
+        threads=2,
+        verbose=False,
+        timeout=None,
+        retries=0,
+        minIdent=90,
+        noflanks=True,
+        maxTSD=100,
+        maxInsert=100000,
+        minInsert=100,
+        qGap=100,
+        maxIdentDiff=20,
+    )
+    # Alignment table and candidates from tinscan-align then tinscan-find
+    table = runAlignments(tmp_path, lastz, pairs, "out.tab")
+    validPairs = tinscan.getHitPairs(
+        tinscan.readHitTable(str(tmp_path / "out.tab"), minID=90), args
+    )
+    assert len(validPairs) == 4
+    expected = "".join(tinscan.writeGFFlines(validPairs, fillLen=3))
+    for batchSize in (None, 5000):
+        args.batchQueries = batchSize
+        gff = str(tmp_path / "streamed.gff3")
+        total = stream_insertions(
+            pairs, args, gff, alignOut=str(tmp_path / "streamed.tab"), idWidth=3
+        )
+        assert total == 4
+        assert (tmp_path / "streamed.gff3").read_text() == expected
+        assert (tmp_path / "streamed.tab").read_text() == table
+    # Clustered candidates are held back until their target is complete
+    reps, attributes = tinscan.clusterPairs(validPairs)
+    expected = "".join(tinscan.writeGFFlines(reps, fillLen=3, attributes=attributes))
+    total = stream_insertions(pairs, args, gff, idWidth=3, cluster=True)
+    assert total == len(reps)
+    assert (tmp_path / "streamed.gff3").read_text() == expected
+    assert sorted(os.listdir(str(tmp_path))) == sorted(
+        ["A.fa", "A.fa.fai", "B.fa", "B.fa.fai", "lastz", "out.tab"]
+        + ["streamed.gff3", "streamed.tab"]
+    )